@@ -0,0 +1,449 @@
+"""Benchmarks for the archive importers.
+
+Synthetic source trees are generated, packed into zip and sqlite3 archives
+with importers.pack and then imported from. For every tree and archive type
+the following are measured:
+
+  * hook.cold/hook.warm
+        ArchiveHook.__call__ for every module location with a new hook (which
+        has to open the archive) and with a hook that has it cached.
+  * find_module.cold/find_module.warm
+        find_module() for every module on newly created and on re-used
+        finders.
+  * load_module.cold/load_module.warm
+        load_module() for every module the first time (for sqlite3 this
+        includes compiling and writing bytecode) and again once bytecode is
+        available.
+  * load_module.lazy
+        load_module() through importers.lazy.Mixin without touching the
+        modules.
+
+Besides the time taken, the number of file_exists() calls made and, where
+/proc/self/io is available, the number of read/write syscalls made during the
+last run of every benchmark are recorded. Run with PYTHONDONTWRITEBYTECODE
+unset, otherwise the warm loads cannot use bytecode.
+
+Results are printed as JSON (or written to --output) so that runs can be
+compared; --compare reports every benchmark that got slower than a previous
+run by more than --tolerance and exits with a non-zero status if any did.
+
+Run from the root of the source tree::
+
+  python benchmarks/bench_importers.py [--trees flat,deep] [--repeat 5]
+                                       [--output results.json]
+                                       [--compare baseline.json]
+
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from importers import lazy
+from importers import pack
+from importers import sqlite3 as importers_sqlite3
+from importers import zip as importers_zip
+
+
+MODULE_TEMPLATE = '''\
+"""Synthetic module {name}."""
+import os
+
+CONSTANT = {index}
+
+
+def function_{index}(value):
+    """Return the value adjusted by the constant."""
+    return value + CONSTANT
+
+
+class Class_{index}:
+
+    def method(self, value):
+        return function_{index}(value) * 2
+'''
+
+LARGE_FUNCTION = '''
+
+def generated_{index}(a, b, c):
+    """Generated function {index}."""
+    total = a + b * c
+    for x in range(a):
+        total += x if x % 2 else -x
+    return {{'total': total, 'index': {index}, 'name': 'generated_{index}'}}
+'''
+
+
+def _write(root, relative, data):
+    path = os.path.join(root, *relative.split('/'))
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as file:
+        file.write(data)
+
+
+def make_flat(root, count=300):
+    """Many top-level modules."""
+    names = []
+    for index in range(count):
+        name = 'bench_flat_{:04d}'.format(index)
+        _write(root, name + '.py', MODULE_TEMPLATE.format(name=name,
+                                                          index=index))
+        names.append(name)
+    return names
+
+
+def make_deep(root, depth=20):
+    """A single chain of nested packages with a module at every level."""
+    names = []
+    parts = []
+    for index in range(depth):
+        parts.append('bench_deep_{:02d}'.format(index))
+        package = '.'.join(parts)
+        _write(root, '/'.join(parts) + '/__init__.py',
+               MODULE_TEMPLATE.format(name=package, index=index))
+        _write(root, '/'.join(parts) + '/mod.py',
+               MODULE_TEMPLATE.format(name=package + '.mod', index=index))
+        names.extend([package, package + '.mod'])
+    return names
+
+
+def make_packages(root, packages=60, modules=5):
+    """Many packages each with a few modules."""
+    names = []
+    for pkg_index in range(packages):
+        package = 'bench_pkg_{:03d}'.format(pkg_index)
+        _write(root, package + '/__init__.py',
+               MODULE_TEMPLATE.format(name=package, index=pkg_index))
+        names.append(package)
+        for index in range(modules):
+            name = '{}.mod_{}'.format(package, index)
+            _write(root, '{}/mod_{}.py'.format(package, index),
+                   MODULE_TEMPLATE.format(name=name, index=index))
+            names.append(name)
+    return names
+
+
+def make_large(root, count=8, functions=1500):
+    """A few very large modules."""
+    names = []
+    for index in range(count):
+        name = 'bench_large_{}'.format(index)
+        source = [MODULE_TEMPLATE.format(name=name, index=index)]
+        source.extend(LARGE_FUNCTION.format(index=x) for x in range(functions))
+        _write(root, name + '.py', ''.join(source))
+        names.append(name)
+    return names
+
+
+TREES = {'flat': make_flat, 'deep': make_deep, 'packages': make_packages,
+         'large': make_large}
+
+
+class LazySqlite3Importer(lazy.Mixin, importers_sqlite3.Importer):
+    pass
+
+
+class LazyZipImporter(lazy.Mixin, importers_zip.Importer):
+    pass
+
+
+class Sqlite3Hook(importers_sqlite3.Hook):
+    lazy = False
+
+    def finder(self, archive, archive_path, location):
+        cls = LazySqlite3Importer if self.lazy else importers_sqlite3.Importer
+        return cls(archive, archive_path, location)
+
+
+class ZipHook(importers_zip.Hook):
+    lazy = False
+
+    def finder(self, archive, archive_path, location):
+        cls = LazyZipImporter if self.lazy else importers_zip.Importer
+        return cls(archive, archive_path, location)
+
+
+BACKENDS = {'sqlite3': (Sqlite3Hook, pack.pack_sqlite3, '.db'),
+            'zip': (ZipHook, pack.pack_zip, '.zip')}
+
+
+def _syscalls():
+    """Return the number of read and write syscalls made by the process so
+    far or None if the platform does not expose it."""
+    try:
+        with open('/proc/self/io') as file:
+            counts = dict(line.split(':') for line in file)
+    except (IOError, ValueError):
+        return None
+    return int(counts['syscr']) + int(counts['syscw'])
+
+
+class Counter:
+
+    """Wrap the file_exists() method of finders to count calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def wrap(self, finder):
+        file_exists = finder.file_exists
+        def counting(path):
+            self.calls += 1
+            return file_exists(path)
+        finder.file_exists = counting
+        return finder
+
+
+def _location(archive, name):
+    """Return the path to hand the hook for the module."""
+    return os.path.join(archive, *name.split('.')[:-1])
+
+
+def _forget(names):
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+def _measure(operation, repeat):
+    """Run the operation (which returns the number of file_exists() calls it
+    caused) 'repeat' times, returning the statistics."""
+    times = []
+    for _ in range(repeat):
+        setup = operation.setup() if hasattr(operation, 'setup') else None
+        syscalls_before = _syscalls()
+        start = time.perf_counter()
+        probes = operation(setup)
+        elapsed = time.perf_counter() - start
+        syscalls_after = _syscalls()
+        times.append(elapsed)
+        if hasattr(operation, 'teardown'):
+            operation.teardown(setup)
+    syscalls = None
+    if syscalls_before is not None and syscalls_after is not None:
+        syscalls = syscalls_after - syscalls_before
+    return {'min': min(times), 'median': statistics.median(times),
+            'file_exists_calls': probes, 'syscalls': syscalls}
+
+
+class Benchmark:
+
+    """A single measured operation over every module of an archive."""
+
+    def __init__(self, hook_class, archive, names, lazy_load=False):
+        self.hook_class = hook_class
+        self.archive = archive
+        self.names = names
+        self.lazy = lazy_load
+        # The number of copies of the archive made.
+        self.copies = 0
+
+    def hook(self):
+        hook = self.hook_class()
+        hook.lazy = self.lazy
+        return hook
+
+
+class HookCold(Benchmark):
+
+    def __call__(self, _):
+        for name in self.names:
+            self.hook()(_location(self.archive, name))
+        return 0
+
+
+class HookWarm(Benchmark):
+
+    def setup(self):
+        hook = self.hook()
+        hook(self.archive)
+        return hook
+
+    def __call__(self, hook):
+        for name in self.names:
+            hook(_location(self.archive, name))
+        return 0
+
+
+class FindCold(Benchmark):
+
+    def setup(self):
+        return self.hook(), Counter()
+
+    def __call__(self, state):
+        hook, counter = state
+        for name in self.names:
+            finder = counter.wrap(hook(_location(self.archive, name)))
+            finder.find_module(name)
+        return counter.calls
+
+
+class FindWarm(Benchmark):
+
+    def setup(self):
+        hook, counter = self.hook(), Counter()
+        finders = [(name, counter.wrap(hook(_location(self.archive, name))))
+                    for name in self.names]
+        for name, finder in finders:
+            finder.find_module(name)
+        counter.calls = 0
+        return finders, counter
+
+    def __call__(self, state):
+        finders, counter = state
+        for name, finder in finders:
+            finder.find_module(name)
+        return counter.calls
+
+
+class Load(Benchmark):
+
+    # Every run loads from a fresh copy of the archive so that bytecode
+    # written by a previous run does not turn it into a warm load.
+    fresh = True
+
+    def setup(self):
+        archive = self.archive
+        if self.fresh:
+            self.copies += 1
+            base, ext = os.path.splitext(self.archive)
+            archive = '{}-{}{}'.format(base, self.copies, ext)
+            shutil.copyfile(self.archive, archive)
+        hook, counter = self.hook(), Counter()
+        loaders = []
+        for name in self.names:
+            finder = counter.wrap(hook(_location(archive, name)))
+            loaders.append((name, finder.find_module(name)))
+        counter.calls = 0
+        _forget(self.names)
+        return loaders, counter, hook, archive
+
+    def __call__(self, state):
+        loaders, counter = state[:2]
+        for name, loader in loaders:
+            loader.load_module(name)
+        return counter.calls
+
+    def teardown(self, state):
+        _forget(self.names)
+        hook, archive = state[2:]
+        hook.close()
+        if archive != self.archive:
+            os.remove(archive)
+
+
+class LoadWarm(Load):
+
+    fresh = False
+
+    def setup(self):
+        state = super().setup()
+        # Load once so that any bytecode gets written.
+        self(state)
+        _forget(self.names)
+        state[1].calls = 0
+        return state
+
+
+def run(trees, repeat, directory):
+    """Run all benchmarks, returning the list of results."""
+    results = []
+    for tree in trees:
+        root = os.path.join(directory, tree)
+        names = TREES[tree](root)
+        for backend, (hook_class, packer, ext) in sorted(BACKENDS.items()):
+            benchmarks = [('hook.cold', HookCold), ('hook.warm', HookWarm),
+                          ('find_module.cold', FindCold),
+                          ('find_module.warm', FindWarm),
+                          ('load_module.cold', Load),
+                          ('load_module.warm', LoadWarm),
+                          ('load_module.lazy', Load)]
+            for benchmark, cls in benchmarks:
+                # A fresh archive each time so bytecode written by a previous
+                # benchmark does not leak into a cold measurement.
+                archive = os.path.join(directory,
+                                       '{}-{}{}'.format(tree, benchmark, ext))
+                packer(root, archive)
+                operation = cls(hook_class, archive, names,
+                                lazy_load=benchmark.endswith('.lazy'))
+                result = _measure(operation, repeat)
+                result.update({'tree': tree, 'backend': backend,
+                               'benchmark': benchmark,
+                               'modules': len(names)})
+                results.append(result)
+                print('{:9} {:8} {:18} {:10.6f}s'.format(tree, backend,
+                                                         benchmark,
+                                                         result['min']),
+                      file=sys.stderr)
+    return results
+
+
+def compare(baseline, results, tolerance):
+    """Return the descriptions of the results that are slower than the same
+    benchmark in the baseline by more than the tolerance (a fraction)."""
+    previous = {(r['tree'], r['backend'], r['benchmark']): r
+                    for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = result['tree'], result['backend'], result['benchmark']
+        if key not in previous:
+            continue
+        old = previous[key]['min']
+        if old and result['min'] > old * (1 + tolerance):
+            regressions.append('{} {} {}: {:.6f}s -> {:.6f}s ({:+.1%})'.format(
+                                    key[0], key[1], key[2], old,
+                                    result['min'], result['min'] / old - 1))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--trees', default=','.join(sorted(TREES)),
+                        help='comma-separated trees to benchmark '
+                             '(default: all of {})'.format(
+                                ', '.join(sorted(TREES))))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='times to run every benchmark')
+    parser.add_argument('--output', default=None,
+                        help='file to write the JSON results to')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown (as a fraction) counted as a '
+                             'regression')
+    options = parser.parse_args(args)
+    trees = options.trees.split(',')
+    directory = tempfile.mkdtemp()
+    try:
+        results = run(trees, options.repeat, directory)
+    finally:
+        shutil.rmtree(directory)
+    report = {'python': sys.version, 'platform': platform.platform(),
+              'dont_write_bytecode': sys.dont_write_bytecode,
+              'repeat': options.repeat, 'results': results}
+    output = json.dumps(report, indent=1, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+    if options.compare:
+        with open(options.compare) as file:
+            regressions = compare(json.load(file), results, options.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
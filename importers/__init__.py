@@ -7,3 +7,65 @@ def remove_file(file_path, full_path):
         raise ValueError('{} does not start with {}'.format(full_path,
                                                             file_path))
     return full_path[len(file_path)+len(os.sep):]
+
+
+def cache_directory(name):
+    """Return the path of the named directory for the project's caches,
+    within $XDG_CACHE_HOME (~/.cache by default)."""
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'importers', name)
+
+
+if os.sep == '/':
+    def neutral_path(path):
+        """Convert a path to only use forward slashes."""
+        return path
+else:
+    _NEUTRAL = str.maketrans(os.sep, '/')
+
+    def neutral_path(path):
+        """Convert a path to only use forward slashes."""
+        return path.translate(_NEUTRAL)
+
+
+# The tags put before the suffix of bytecode compiled with optimizations
+# (PEP 488).
+_OPTIMIZATION_TAGS = ('.opt-1', '.opt-2')
+
+
+def split_optimization_tag(path):
+    """Return (path without its suffix and optimization tag, optimization
+    level) for the path of a bytecode file."""
+    base, tag = os.path.splitext(os.path.splitext(path)[0])
+    if tag in _OPTIMIZATION_TAGS:
+        return base, int(tag[len('.opt-'):])
+    return base + tag, 0
+
+
+class ArchivePrefix:
+
+    """Convert paths within an archive to the OS-neutral paths of its members.
+
+    The prefix (the archive path plus a separator) and its length are computed
+    once so that converting a path is a single check and slice.
+
+    """
+
+    __slots__ = ('path', 'prefix', '_length')
+
+    def __init__(self, archive_path):
+        self.path = archive_path
+        self.prefix = archive_path + os.sep
+        self._length = len(self.prefix)
+
+    def relative(self, full_path):
+        """Return the OS-neutral path of the full path relative to the archive.
+
+        ValueError is raised if the path is not within the archive.
+
+        """
+        if not full_path.startswith(self.prefix):
+            raise ValueError('{} does not start with {}'.format(full_path,
+                                                                self.path))
+        return neutral_path(full_path[self._length:])
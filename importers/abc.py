@@ -1,8 +1,18 @@
+from . import split_optimization_tag
 import abc
 import collections
 import imp
 import importlib.abc
+import io
 import os
+import sys
+import time
+import weakref
+
+
+_SOURCE_SUFFIXES = {x[0] for x in imp.get_suffixes() if x[2] == imp.PY_SOURCE}
+_BYTECODE_SUFFIXES = {x[0] for x in imp.get_suffixes()
+                        if x[2] == imp.PY_COMPILED}
 
 
 def _super_paths(path):
@@ -36,13 +46,19 @@ def _file_search(location, fullname, exists, *types_):
     (e.g.  imp.PY_SOURCE).
 
     """
-    tail_name = fullname.rpartition('.')[-1]
     extensions = [x[0] for x in imp.get_suffixes()
                     if x[2] in types_]
+    return _suffix_search(location, fullname, exists, extensions)
+
+
+def _suffix_search(location, fullname, exists, suffixes):
+    """Search for a file representing the module in the specified location
+    with one of the suffixes, preferring a package; see _file_search()."""
+    tail_name = fullname.rpartition('.')[-1]
     module_path = os.path.join(location, tail_name)
     pkg_path = os.path.join(module_path, '__init__')
     for base_path in (pkg_path, module_path):
-        for ext in extensions:
+        for ext in suffixes:
             path = base_path + ext
             if exists(path):
                 return path
@@ -50,45 +66,263 @@ def _file_search(location, fullname, exists, *types_):
         return None
 
 
+def top_level_names(paths):
+    """Return the set of top-level module and package names provided by the
+    relative, '/'-separated file paths (as returned by ArchiveHook.paths())."""
+    names = set()
+    for path in paths:
+        head, sep, tail = path.partition('/')
+        if not sep:
+            name, ext = _module_stem(head)
+        else:
+            name, ext = _module_stem(tail)
+            if name != '__init__':
+                continue
+            name = head
+        if ext is not None:
+            names.add(name)
+    return names
+
+
+def _module_stem(file_name):
+    """Return (module name, suffix) for the file name, with the optimization
+    tag of bytecode stripped from the name, or (file name, None) if it is
+    not the file of a module."""
+    stem, ext = os.path.splitext(file_name)
+    if ext in _SOURCE_SUFFIXES:
+        return stem, ext
+    elif ext in _BYTECODE_SUFFIXES:
+        return split_optimization_tag(file_name)[0], ext
+    return file_name, None
+
+
+def _location_modules(paths):
+    """Return a dict mapping the names of the modules and packages directly
+    in a directory to whether they are packages, given the relative,
+    '/'-separated paths of the files in (and below) the directory."""
+    modules = {}
+    for path in paths:
+        head, sep, tail = path.partition('/')
+        if not sep:
+            name, ext = _module_stem(head)
+            is_package = False
+        else:
+            stem, ext = _module_stem(tail)
+            if stem != '__init__':
+                continue
+            name, is_package = head, True
+        if ext is None or name == '__init__' or '.' in name:
+            continue
+        # A package shadows a module of the same name.
+        modules[name] = modules.get(name, False) or is_package
+    return modules
+
+
+def _signature(path):
+    """Return the stat details used to detect that a file was replaced or
+    modified."""
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size
+
+
+# Every ArchiveHook instance, so that their archives can be reopened in forked
+# child processes.
+_hooks = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    """Give every hook's archives handles of their own in the child
+    process."""
+    for hook in list(_hooks):
+        hook._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 def _is_package_file(path):
     """Check if a file path is for a package's __init__ file."""
     file_name = os.path.basename(path)
     return os.path.splitext(file_name)[0] == '__init__'
 
 
+class ArchiveState:
+
+    """Base class for the state shared by all finders for the same open
+    archive (see ArchiveHook.shared_state()).
+
+    Once a hook has adopted the state (which it does for the states of the
+    finders it returns) the state keeps the hook alive. If the hook closes
+    the archive (close() or eviction) while finders or loaders still use the
+    state, the state is detached from it and reopens the archive through the
+    hook the next time it is used.
+
+    """
+
+    __slots__ = ('_archive', 'path', 'hook', '__weakref__')
+
+    def __init__(self, archive, archive_path):
+        self._archive = archive
+        self.path = archive_path
+        self.hook = None
+
+    @property
+    def archive(self):
+        """The open archive, reopened through the hook if it was closed."""
+        archive = self._archive
+        if archive is None:
+            if self.hook is None:
+                raise IOError("{} is closed".format(self.path))
+            try:
+                archive = self.hook.archive(self.path)
+            except ValueError as exc:
+                raise IOError("cannot reopen {}: {}".format(self.path, exc))
+            self._archive = archive
+        return archive
+
+    @archive.setter
+    def archive(self, archive):
+        self._archive = archive
+
+    def detach(self):
+        """Forget the archive, which the hook closed."""
+        self._archive = None
+
+
 class ArchiveHook(metaclass=abc.ABCMeta):
 
     """ABC for path hooks handling archive files (e.g. zipfiles).
 
     The hook keeps a cache of opened archives so that multiple connections to
-    the archive files are not needed. Deletion of the hook will call the
-    close() method on all archives.
+    the archive files are not needed. If 'max_archives' is not None then at
+    most that many archives are kept open, closing the least recently used
+    archive when another one is opened; an evicted archive is reopened on
+    demand the next time the hook is asked for it. Calling close() (which
+    happens when the hook is used as a context manager or is deleted) calls
+    the close() method on all open archives. Finders and loaders still using
+    a closed archive reopen it through the hook (see ArchiveState), so a
+    hook stays alive as long as they do.
+
+    If 'check_interval' is not None then an archive is checked for having been
+    replaced or modified (comparing its signature(), by default its device,
+    inode, mtime and size) at most once every 'check_interval' seconds when
+    the hook is used or check() is called. A changed archive is reopened and
+    swapped into the cache, entries for it in sys.path_importer_cache are
+    dropped and the callables registered through add_listener() are called.
+    The previously opened archive is left open for the finders and loaders
+    still using it and is closed once they are garbage collected.
+
+    Closed or evicted archives also have their sys.path_importer_cache entries
+    dropped and listeners notified so that no finder keeps using them.
+
+    Open file handles and database connections must not be shared with a
+    forked child process. Where os.register_at_fork() is available, every
+    open archive is passed to reopen() in the child and, if a different
+    archive object is returned, swapped into the cache with the
+    sys.path_importer_cache entries for it dropped and listeners notified
+    ('forked'). reopen() implementations should keep in-memory indexes so
+    that children do not have to rebuild them.
 
     Abstract methods:
 
         * open
         * finder
 
+    Archives which can list their contents should also override paths() so
+    that they can be indexed (see importers.index).
+
+    If 'extension_cache' is not None, it is set as the extension_cache of the
+    finders the hook returns so that they find extension modules (see
+    importers.extension).
+
+    If 'shared_index' (an importers.shared.SharedIndexes) is not None, hooks
+    supporting it index the archives they open there, or use the index
+    another process already published, instead of building their own view of
+    each archive.
+
     """
 
-    def __init__(self):
+    def __init__(self, check_interval=None, max_archives=None,
+                 extension_cache=None, shared_index=None):
         """Initialize the internal cache of archives."""
-        self._archives = {}
+        self.extension_cache = extension_cache
+        self.shared_index = shared_index
+        # Archive path -> archive, least recently used first.
+        self._archives = collections.OrderedDict()
+        self._max_archives = max_archives
+        self._check_interval = check_interval
+        # Archive path -> (stat signature when opened, time of last check).
+        self._signatures = {}
+        self._last_check = None
+        self._listeners = []
+        # Archive path -> state shared by the finders for the archive.
+        self._states = {}
+        # Every state adopted by the hook, to detach when its archive is
+        # closed.
+        self._adopted = weakref.WeakSet()
+        _hooks.add(self)
 
     def __del__(self):
+        """Close all archives.
+
+        Nothing is invalidated: no finder uses the archives any more (their
+        states keep the hook alive) and sys.path_importer_cache may already
+        be gone at interpreter exit.
+
+        """
+        if getattr(self, '_archives', None):
+            self._close_all(invalidate=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
         """Close all archives, raising the last exception triggered
-        (if any)."""
+        (if any).
+
+        Finders and loaders still using the archives reopen them through the
+        hook when next used.
+
+        """
+        self._close_all()
+
+    def _close_all(self, invalidate=True):
         exception = None
-        for archive in self._archives:
+        while self._archives:
+            path, archive = self._archives.popitem(last=False)
             try:
-                archive.close()
-            except AttributeError:
-                continue
+                self._close(path, archive, invalidate)
             except Exception as exc:
                 exception = exc
         if exception:
             raise exception
 
+    def _detach(self, path, archive):
+        """Detach the adopted states using the archive at the path."""
+        for state in list(self._adopted):
+            if state.path == path and state._archive is archive:
+                state.detach()
+
+    def _close(self, path, archive, invalidate=True):
+        """Close the archive (if it can be closed) and drop everything
+        depending on it."""
+        self._signatures.pop(path, None)
+        self._detach(path, archive)
+        try:
+            close = archive.close
+        except AttributeError:
+            pass
+        else:
+            close()
+        finally:
+            if invalidate:
+                self._invalidate(path, 'closed')
+
     @abc.abstractmethod
     def open(self, path:str) -> object:
         """Open the (potential) path to an archive, raising ValueError if it is
@@ -100,23 +334,200 @@ class ArchiveHook(metaclass=abc.ABCMeta):
         """Return a finder for the open archive at the specified location."""
         raise NotImplementedError
 
+    def paths(self, archive:object) -> list:
+        """Return an iterable of the relative, '/'-separated paths of all files
+        in the open archive."""
+        raise NotImplementedError
+
+    def archive(self, path:str) -> object:
+        """Return the open archive for the path to an archive file, opening and
+        caching it if necessary (raising ValueError if it is not an
+        archive)."""
+        path = os.path.abspath(path)
+        if path in self._archives:
+            return self._cached(path)
+        return self._open(path)
+
+    def _cached(self, path):
+        """Return the cached archive after checking it is up-to-date and
+        marking it as the most recently used."""
+        self.check(path)
+        self._archives.move_to_end(path)
+        return self._archives[path]
+
+    def _open(self, path):
+        """Open the archive and cache it along with its signature, evicting
+        the least recently used archives if there are too many open."""
+        archive, signature = self._open_signed(path)
+        self._archives[path] = archive
+        self._signatures[path] = signature, time.monotonic()
+        if self._max_archives is not None:
+            while len(self._archives) > self._max_archives:
+                self._close(*self._archives.popitem(last=False))
+        return archive
+
+    def _open_signed(self, path):
+        """Open the archive, returning it along with its signature (None if
+        the signature cannot be taken or the file was replaced while being
+        opened, so that the next check reopens it)."""
+        file_id = _signature(path)[:2]
+        archive = self.open(path)
+        try:
+            signature = self.signature(path, archive)
+        except (OSError, ValueError):
+            signature = None
+        if _signature(path)[:2] != file_id:
+            signature = None
+        return archive, signature
+
+    def signature(self, path:str, archive:object) -> object:
+        """Return the details of the archive opened from the path which
+        check() compares to detect that it changed.
+
+        The default implementation returns the device, inode, mtime and size
+        of the file. Archives which are written to through their finders
+        should leave out whatever their own writes change.
+
+        """
+        return _signature(path)
+
+    def shared_state(self, archive, archive_path, factory):
+        """Return the state object shared by all finders for the open archive,
+        creating (and adopting) it with factory(archive, archive_path) if
+        needed.
+
+        The factory is expected to return an ArchiveState; a new state is
+        created once the archive has been replaced.
+
+        """
+        state = self._states.get(archive_path)
+        if state is None or state._archive is not archive:
+            state = factory(archive, archive_path)
+            self.adopt(state)
+            self._states[archive_path] = state
+        return state
+
+    def adopt(self, state):
+        """Make the hook reopen the archive for the ArchiveState once it
+        closes it (see ArchiveState)."""
+        state.hook = self
+        self._adopted.add(state)
+
+    def reopen(self, path:str, archive:object) -> object:
+        """Return an archive usable in a newly forked child process in place
+        of the archive opened by the parent.
+
+        The default implementation opens the archive again.
+
+        """
+        return self.open(path)
+
+    def _after_fork(self):
+        """Replace every archive inherited from the parent process."""
+        self._last_check = None
+        for path, archive in list(self._archives.items()):
+            try:
+                new_archive = self.reopen(path, archive)
+            except (OSError, ValueError):
+                # Leave it to be opened on demand.
+                del self._archives[path]
+                self._signatures.pop(path, None)
+                self._detach(path, archive)
+                self._invalidate(path, 'forked')
+                continue
+            if new_archive is not archive:
+                self._archives[path] = new_archive
+                self._invalidate(path, 'forked')
+
+    def add_listener(self, callback):
+        """Register a callable to be called with the hook, the archive path
+        and the event whenever an archive is reopened because it changed
+        ('reopened'), is replaced in a forked child process ('forked') or is
+        closed ('closed')."""
+        self._listeners.append(callback)
+
+    def check(self, path=None):
+        """Reopen the archive at the path (or all open archives if no path is
+        given) if it has changed, returning the list of reopened archive
+        paths.
+
+        Nothing is checked if 'check_interval' is None or the archive was
+        checked less than 'check_interval' seconds ago. If the archive cannot
+        be stat'ed or opened (e.g. it is in the middle of being replaced) the
+        currently open archive is kept and the check is retried later.
+
+        """
+        if self._check_interval is None:
+            return []
+        now = time.monotonic()
+        if path is None:
+            if (self._last_check is not None and
+                    now - self._last_check < self._check_interval):
+                return []
+            self._last_check = now
+            paths = list(self._archives)
+        else:
+            paths = [path]
+        reloaded = []
+        for path in paths:
+            try:
+                signature, checked = self._signatures[path]
+            except KeyError:
+                continue
+            if now - checked < self._check_interval:
+                continue
+            try:
+                current = self.signature(path, self._archives[path])
+                if current == signature:
+                    self._signatures[path] = signature, now
+                    continue
+                archive, current = self._open_signed(path)
+            except (OSError, ValueError):
+                continue
+            self._archives[path] = archive
+            self._signatures[path] = current, now
+            self._invalidate(path, 'reopened')
+            reloaded.append(path)
+        return reloaded
+
+    def _invalidate(self, path, event):
+        """Drop the caches depending on the archive at the path."""
+        self._states.pop(path, None)
+        prefix = path + os.sep
+        for entry in list(sys.path_importer_cache):
+            if entry == path or entry.startswith(prefix):
+                del sys.path_importer_cache[entry]
+        for callback in self._listeners:
+            callback(self, path, event)
+
+    def _finder(self, archive, archive_path, location):
+        """Return the finder for the location, given the extension cache and
+        with its state adopted (for finders created without the shared
+        state)."""
+        finder = self.finder(archive, archive_path, location)
+        if self.extension_cache is not None:
+            finder.extension_cache = self.extension_cache
+        state = getattr(finder, '_state', None)
+        if isinstance(state, ArchiveState) and state.hook is None:
+            self.adopt(state)
+        return finder
+
     def __call__(self, path):
         """See if the path contains an archive file path, returning a finder if
         appropriate."""
         path = os.path.abspath(path)
         for pre_path, location in _super_paths(path):
             if pre_path in self._archives:
-                return self.finder(self._archives[pre_path], pre_path,
+                return self._finder(self._cached(pre_path), pre_path,
                                     location)
 
         for pre_path, location in _super_paths(path):
             if os.path.isfile(pre_path):
                 try:
-                    archive = self.open(pre_path)
+                    archive = self._open(pre_path)
                 except ValueError:
                     continue
-                self._archives[pre_path] = archive
-                return self.finder(archive, pre_path, location)
+                return self._finder(archive, pre_path, location)
             elif os.path.isdir(pre_path):
                 msg = "{} does not contain a file path".format(path)
                 raise ImportError(msg)
@@ -134,8 +545,18 @@ class PyFileFinder(importlib.abc.Finder):
         * file_exists
         * loader
 
+    Finders which can list their location should also implement
+    location_paths() to support iter_modules().
+
+    If 'extension_cache' is set to an importers.extension.ExtensionCache,
+    find_module() also finds extension modules (which take precedence), read
+    with the finder's get_data() method and extracted to the cache to be
+    loaded.
+
     """
 
+    extension_cache = None
+
     def __init__(self, location):
         """Store the location that the finder searches in.
 
@@ -159,8 +580,22 @@ class PyFileFinder(importlib.abc.Finder):
         """Return the loader for the module found at the specified path."""
         raise NotImplementedError
 
+    def _find_extension(self, fullname):
+        """Return the loader for the module as an extension module, or None if
+        there is none (or no extension cache)."""
+        if self.extension_cache is None:
+            return None
+        path = _file_search(self.location, fullname, self.file_exists,
+                            imp.C_EXTENSION)
+        if path is None:
+            return None
+        return self.extension_cache.loader(self, path)
+
     def find_module(self, fullname):
         """Find the module's file path."""
+        loader = self._find_extension(fullname)
+        if loader is not None:
+            return loader
         path = _file_search(self.location, fullname, self.file_exists,
                             imp.PY_SOURCE, imp.PY_COMPILED)
         if path is not None:
@@ -168,6 +603,28 @@ class PyFileFinder(importlib.abc.Finder):
         else:
             return None
 
+    def location_paths(self) -> list:
+        """Return the relative, '/'-separated paths of the files in the
+        location; paths of files further below it may be included.
+
+        Only needed for iter_modules(); finders which cannot list their
+        location leave it unimplemented.
+
+        """
+        raise NotImplementedError
+
+    def iter_modules(self, prefix=''):
+        """Yield (name, is_package) pairs, sorted by name, for the modules and
+        packages directly in the location without loading any of them.
+
+        Every name is prefixed with 'prefix', which is what
+        pkgutil.iter_modules() expects of the finders it is given.
+
+        """
+        modules = _location_modules(self.location_paths())
+        for name in sorted(modules):
+            yield prefix + name, modules[name]
+
 
 class PyFileLoader(importlib.abc.PyLoader):
 
@@ -198,6 +655,17 @@ class PyFileLoader(importlib.abc.PyLoader):
         """
         raise NotImplementedError
 
+    def open_data(self, path:str) -> io.RawIOBase:
+        """Return a binary file-like object for reading the data at the path,
+        raising IOError if it does not exist.
+
+        Loaders able to stream their data (so large resources need not be read
+        into memory in one go) override this; the default wraps the bytes
+        get_data() returns.
+
+        """
+        return io.BytesIO(self.get_data(path))
+
     def source_path(self, fullname):
         """Return the source path for the module."""
         return _file_search(self.location, fullname, self.file_exists,
@@ -0,0 +1,248 @@
+"""Import modules from archives without blocking an asyncio event loop.
+
+Finding and loading a module from an archive means a number of blocking
+reads (existence checks, mtimes, source and bytecode). prefetch() performs
+those for a set of modules concurrently in an executor using the finders the
+given hooks provide; the returned loaders then complete the imports
+synchronously from the prefetched data, leaving only the execution of the
+modules' code on the event loop's thread::
+
+    hooks = [importers.sqlite3.Hook(), importers.zip.Hook()]
+    modules = await importers.aio.import_modules(['plugins.a', 'plugins.b'],
+                                                 hooks)
+
+import_modules() also imports any parent packages that are not imported yet,
+one level of the package hierarchy at a time.
+
+Loaders supporting bytecode produce the code object in the executor with
+their own get_code(), so that they validate bytecode and write new bytecode
+(e.g. with the hash of its source) as they do when loading modules
+themselves.
+
+"""
+import asyncio
+import importlib.abc
+import sys
+
+
+class PrefetchedLoader(importlib.abc.PyLoader):
+
+    """Loader completing the import of a module from data read ahead of time
+    by fetch().
+
+    Data for paths which were not prefetched is read from the wrapped loader,
+    which is also used for anything else the loader is asked for after the
+    import (e.g. get_data() calls for resources). The hook the loader comes
+    from, if given, is kept alive along with the loader.
+
+    """
+
+    def __init__(self, loader, fullname, hook=None):
+        """Store the loader for the module to prefetch."""
+        self._loader = loader
+        self._fullname = fullname
+        self._hook = hook
+        self._source_path = None
+        self._is_package = None
+        self._data = {}
+
+    def fetch(self):
+        """Read everything needed to load the module from the wrapped loader,
+        then let it forget what it found for the module (if it has a forget()
+        method) as it does not load the module itself."""
+        try:
+            self._fetch()
+        finally:
+            forget = getattr(self._loader, 'forget', None)
+            if forget is not None:
+                forget(self._fullname)
+
+    def _fetch(self):
+        loader, fullname = self._loader, self._fullname
+        self._source_path = loader.source_path(fullname)
+        self._is_package = loader.is_package(fullname)
+        self._fetch_data(self._source_path)
+
+    def _fetch_data(self, path):
+        """Read the data for the path if it exists."""
+        if path is not None:
+            try:
+                self._data[path] = self._loader.get_data(path)
+            except IOError:
+                pass
+
+    def source_path(self, fullname):
+        if fullname != self._fullname:
+            return self._loader.source_path(fullname)
+        return self._source_path
+
+    def is_package(self, fullname):
+        if fullname != self._fullname:
+            return self._loader.is_package(fullname)
+        return self._is_package
+
+    def get_data(self, path):
+        """Return the prefetched data for the path (only once) or read it from
+        the wrapped loader."""
+        try:
+            return self._data.pop(path)
+        except KeyError:
+            return self._loader.get_data(path)
+
+
+class PrefetchedPycLoader(PrefetchedLoader, importlib.abc.PyPycLoader):
+
+    """PrefetchedLoader for loaders supporting bytecode.
+
+    The code object is fetched from the wrapped loader's get_code(), which
+    reads (and validates) the bytecode or compiles the source, writing
+    bytecode through the wrapped loader.
+
+    """
+
+    def __init__(self, loader, fullname, hook=None):
+        super().__init__(loader, fullname, hook)
+        self._bytecode_path = None
+        self._code = None
+
+    def _fetch(self):
+        loader, fullname = self._loader, self._fullname
+        self._source_path = loader.source_path(fullname)
+        self._bytecode_path = loader.bytecode_path(fullname)
+        self._is_package = loader.is_package(fullname)
+        self._code = loader.get_code(fullname)
+
+    def bytecode_path(self, fullname):
+        if fullname != self._fullname:
+            return self._loader.bytecode_path(fullname)
+        return self._bytecode_path
+
+    def source_mtime(self, fullname):
+        return self._loader.source_mtime(fullname)
+
+    def get_code(self, fullname):
+        """Return the fetched code object for the module (only once) or get
+        it from the wrapped loader."""
+        if fullname == self._fullname and self._code is not None:
+            code, self._code = self._code, None
+            return code
+        return self._loader.get_code(fullname)
+
+    def write_bytecode(self, fullname, data):
+        return self._loader.write_bytecode(fullname, data)
+
+    def write_data(self, path, data, *args):
+        return self._loader.write_data(path, data, *args)
+
+
+def prefetched_loader(loader, fullname, hook=None):
+    """Return the (not yet fetched) prefetching loader wrapping the loader
+    from the hook."""
+    if isinstance(loader, importlib.abc.PyPycLoader):
+        return PrefetchedPycLoader(loader, fullname, hook)
+    return PrefetchedLoader(loader, fullname, hook)
+
+
+def _finders(hooks, path):
+    """Return (hook, finder) for the finders the hooks provide for the
+    entries of the path, in order."""
+    finders = []
+    for entry in path:
+        for hook in hooks:
+            try:
+                finders.append((hook, hook(entry)))
+            except ImportError:
+                continue
+            break
+    return finders
+
+
+def _fetch(fullname, finders):
+    """Find the module with the finders and prefetch its data, returning the
+    prefetching loader or None if the module was not found."""
+    for hook, finder in finders:
+        loader = finder.find_module(fullname)
+        if loader is not None:
+            prefetched = prefetched_loader(loader, fullname, hook)
+            prefetched.fetch()
+            return prefetched
+    return None
+
+
+async def prefetch(names, hooks, path=None, executor=None):
+    """Find the modules and read their data concurrently in the executor (the
+    loop's default executor if None), returning a dict mapping each name to
+    its prefetching loader or to None if it was not found.
+
+    Top-level modules are searched for in the finders the hooks return for the
+    entries of 'path' (sys.path by default); submodules in those for the
+    __path__ of their parent package, which must already be imported.
+    Finders are created on the calling thread as hooks are not thread-safe.
+
+    """
+    loop = asyncio.get_running_loop()
+    if path is None:
+        path = sys.path
+    # Parent package name ('' for top-level) -> finders.
+    finders = {}
+    futures = []
+    names = list(names)
+    for name in names:
+        parent = name.rpartition('.')[0]
+        if parent not in finders:
+            if not parent:
+                finders[parent] = _finders(hooks, path)
+            else:
+                try:
+                    package_path = sys.modules[parent].__path__
+                except (KeyError, AttributeError):
+                    raise ImportError("parent package {} of {} is not "
+                                      "imported".format(parent, name))
+                finders[parent] = _finders(hooks, package_path)
+        futures.append(loop.run_in_executor(executor, _fetch, name,
+                                            finders[parent]))
+    loaders = await asyncio.gather(*futures)
+    return dict(zip(names, loaders))
+
+
+def load(loaders):
+    """Complete the imports of the modules prefetched by prefetch(),
+    returning a dict mapping names to modules.
+
+    Modules are loaded in the order of the dict. ImportError is raised for a
+    module which was not found.
+
+    """
+    modules = {}
+    for name, loader in loaders.items():
+        if loader is None:
+            raise ImportError("no module named {}".format(name))
+        module = loader.load_module(name)
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+        modules[name] = module
+    return modules
+
+
+async def import_modules(names, hooks, path=None, executor=None):
+    """Import the modules (and any of their parent packages not yet imported)
+    from the archives handled by the hooks, returning a dict mapping the
+    names to the modules.
+
+    Modules already in sys.modules are not imported again. See prefetch() for
+    'path' and 'executor'.
+
+    """
+    names = list(names)
+    pending = set()
+    for name in names:
+        parts = name.split('.')
+        for index in range(1, len(parts) + 1):
+            package = '.'.join(parts[:index])
+            if package not in sys.modules:
+                pending.add(package)
+    for depth in sorted({name.count('.') for name in pending}):
+        level = sorted(name for name in pending if name.count('.') == depth)
+        load(await prefetch(level, hooks, path, executor))
+    return {name: sys.modules[name] for name in names}
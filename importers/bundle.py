@@ -0,0 +1,293 @@
+"""Importer for read-only bundle files.
+
+A bundle is a single file laid out for importing straight from a memory map,
+without the parsing zip files (central directory) and sqlite3 databases (SQL,
+transactions) require::
+
+  header      MAGIC, format version and number of files
+  path table  one fixed-size entry per file, sorted by path
+  paths       the UTF-8 encoded, '/'-separated paths
+  data        the contents of every file
+
+Every path table entry holds the offset and length of the file's path and
+data as well as the file's mtime. Bytecode files are aligned to the page
+size; everything else to 8 bytes. Opening a bundle maps it into memory
+without reading the path table, a lookup is a binary search over the table
+and up-to-date bytecode is unmarshalled directly from the mapped memory.
+
+Bundles are built with importers.pack (--format bundle) or write_bundle().
+They are read-only so importers never write bytecode to them; build them
+with bytecode.
+
+"""
+from . import ArchivePrefix
+from . import abc as importers_abc
+import imp
+import marshal
+import mmap
+import os
+import struct
+
+
+MAGIC = b'PYBUNDL\x00'
+
+VERSION = 1
+
+# Magic, version, number of files.
+_HEADER = struct.Struct('<8sII')
+# Path offset, data offset, data length, path length, mtime.
+_ENTRY = struct.Struct('<QQQIq')
+
+_MAGIC = imp.get_magic()
+
+_BYTECODE_SUFFIX = next(x[0] for x in imp.get_suffixes()
+                            if x[2] == imp.PY_COMPILED)
+
+
+def _align(offset, alignment):
+    """Round the offset up to a multiple of the alignment."""
+    return -(-offset // alignment) * alignment
+
+
+def write_bundle(path, files, alignment=mmap.PAGESIZE):
+    """Write the (relative path, mtime, data) triples as a bundle to the path,
+    returning the number of files written.
+
+    Bytecode files are aligned to 'alignment' bytes. Later triples for the
+    same path replace earlier ones.
+
+    """
+    by_path = {}
+    for relative, mtime, data in files:
+        by_path[relative.encode('utf-8')] = mtime, data
+    names = sorted(by_path)
+    table_offset = _HEADER.size
+    name_offset = table_offset + _ENTRY.size * len(names)
+    name_offsets = []
+    for name in names:
+        name_offsets.append(name_offset)
+        name_offset += len(name)
+    offset = name_offset
+    data_offsets = []
+    for name in names:
+        data = by_path[name][1]
+        if name.endswith(_BYTECODE_SUFFIX.encode('ascii')):
+            offset = _align(offset, alignment)
+        else:
+            offset = _align(offset, 8)
+        data_offsets.append(offset)
+        offset += len(data)
+    with open(path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, len(names)))
+        for name, name_offset, data_offset in zip(names, name_offsets,
+                                                  data_offsets):
+            mtime, data = by_path[name]
+            file.write(_ENTRY.pack(name_offset, data_offset, len(data),
+                                   len(name), mtime))
+        for name in names:
+            file.write(name)
+        for name, data_offset in zip(names, data_offsets):
+            file.write(b'\x00' * (data_offset - file.tell()))
+            file.write(by_path[name][1])
+    return len(names)
+
+
+class Bundle:
+
+    """An open, memory-mapped bundle file."""
+
+    def __init__(self, path):
+        """Map the bundle at the path into memory, raising ValueError if it is
+        not a bundle."""
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                raise ValueError("{} is not a bundle".format(path))
+        if len(self._map) < _HEADER.size:
+            self._map.close()
+            raise ValueError("{} is not a bundle".format(path))
+        magic, version, self._count = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError("{} is not a bundle of version {}".format(
+                                path, VERSION))
+
+    def close(self):
+        """Unmap the bundle."""
+        self._map.close()
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._map,
+                                  _HEADER.size + index * _ENTRY.size)
+
+    def find(self, path):
+        """Return (data offset, data length, mtime) for the relative,
+        '/'-separated path or None if the bundle does not contain it."""
+        name = path.encode('utf-8')
+        mapped = self._map
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            (name_offset, data_offset, data_length, name_length,
+                mtime) = self._entry(middle)
+            candidate = mapped[name_offset:name_offset + name_length]
+            if candidate < name:
+                low = middle + 1
+            elif candidate > name:
+                high = middle
+            else:
+                return data_offset, data_length, mtime
+        return None
+
+    def data(self, offset, length):
+        """Return the bytes stored at the offset."""
+        return self._map[offset:offset + length]
+
+    def loads(self, offset, length):
+        """Unmarshal the object stored at the offset directly from the
+        map."""
+        view = memoryview(self._map)[offset:offset + length]
+        try:
+            return marshal.loads(view)
+        finally:
+            view.release()
+
+    def _name(self, index):
+        name_offset, _, _, name_length, _ = self._entry(index)
+        return self._map[name_offset:name_offset + name_length]
+
+    def paths(self, prefix=''):
+        """Return the paths of the files in the bundle starting with the
+        prefix, sorted.
+
+        The first path is found with a binary search, so listing a directory
+        only reads the table entries of the files below it.
+
+        """
+        prefix = prefix.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        paths = []
+        for index in range(low, self._count):
+            name = self._name(index)
+            if not name.startswith(prefix):
+                break
+            paths.append(name.decode('utf-8'))
+        return paths
+
+
+class Hook(importers_abc.ArchiveHook):
+
+    """Import hook for bundle files."""
+
+    def open(self, path):
+        """Map the bundle into memory."""
+        return Bundle(path)
+
+    def finder(self, archive, archive_path, location):
+        return Importer(archive, archive_path, location,
+                        state=self.shared_state(archive, archive_path,
+                                                _BundleState))
+
+    def reopen(self, path, archive):
+        """Keep using the bundle; a read-only mapping can be shared with a
+        forked child process."""
+        return archive
+
+    def paths(self, archive):
+        """Return the paths of all files in the bundle."""
+        return archive.paths()
+
+
+class _BundleState(importers_abc.ArchiveState):
+
+    """State shared by all importers for the same open bundle."""
+
+    __slots__ = ('prefix',)
+
+    def __init__(self, archive, archive_path):
+        super().__init__(archive, archive_path)
+        self.prefix = ArchivePrefix(archive_path)
+
+
+class Importer(importers_abc.PyFileFinder, importers_abc.PyPycFileLoader):
+
+    """Importer for bundles.
+
+    The bundle and its path are kept in a state object which the hook shares
+    between all importers for the same bundle ('state').
+
+    """
+
+    def __init__(self, archive, archive_path, location, state=None):
+        self._state = (state if state is not None
+                        else _BundleState(archive, archive_path))
+        super().__init__(os.path.join(archive_path, location))
+
+    def _find(self, path):
+        """Return the bundle's entry for the absolute path or None."""
+        state = self._state
+        try:
+            path = state.prefix.relative(path)
+        except ValueError:
+            return None
+        return state.archive.find(path)
+
+    def loader(self, *args, **kwargs):
+        return self
+
+    def location_paths(self):
+        """Return the paths of the files below the location."""
+        state = self._state
+        try:
+            directory = state.prefix.relative(os.path.join(self.location, ''))
+        except ValueError:
+            return []
+        start = len(directory)
+        return [path[start:] for path in state.archive.paths(directory)]
+
+    def file_exists(self, path):
+        """Check if the file is in the bundle."""
+        return self._find(path) is not None
+
+    def get_data(self, path):
+        """Return the contents of the file at the path."""
+        entry = self._find(path)
+        if entry is None:
+            raise IOError("{!r} does not exist".format(path))
+        offset, length, _ = entry
+        return self._state.archive.data(offset, length)
+
+    def path_mtime(self, path):
+        """Return the mtime stored for the path."""
+        entry = self._find(path)
+        if entry is None:
+            raise IOError("{} does not exist".format(path))
+        return entry[2]
+
+    def write_data(self, path, data):
+        """Bundles are read-only."""
+        return False
+
+    def get_code(self, fullname):
+        """Unmarshal up-to-date bytecode from the mapped bundle, falling back
+        on the inherited implementation otherwise."""
+        bytecode_path = self.bytecode_path(fullname)
+        if bytecode_path is not None:
+            bundle = self._state.archive
+            offset, length, _ = self._find(bytecode_path)
+            header = bundle.data(offset, 8)
+            if len(header) == 8 and header[:4] == _MAGIC:
+                timestamp = int.from_bytes(header[4:], 'little')
+                source_path = self.source_path(fullname)
+                if (source_path is None or
+                        timestamp >= self.path_mtime(source_path)):
+                    return bundle.loads(offset + 8, length - 8)
+        return super().get_code(fullname)
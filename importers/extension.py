@@ -0,0 +1,125 @@
+"""Extension modules from archives.
+
+The dynamic linker can only load extension modules from files, so an
+extension module stored in an archive is extracted before it is loaded. Only
+the member being imported is extracted, into a cache directory keyed on the
+SHA-256 hex digest of its contents::
+
+  <cache directory>/<digest>/<file name>
+
+A member is written to a temporary file in the digest's directory and then
+atomically renamed into place, so processes extracting the same member
+concurrently never see a partially written file and whichever rename comes
+last replaces an identical file. Later runs (and other archives containing
+the same file) reuse the extracted file; files are never removed from the
+cache.
+
+Archive hooks find extension modules when given an ExtensionCache::
+
+    cache = importers.extension.ExtensionCache()
+    hook = importers.zip.Hook(extension_cache=cache)
+
+Extension modules are then preferred over source and bytecode for the same
+name, as with the default import machinery.
+
+"""
+from . import cache_directory
+from . import abc as importers_abc
+import hashlib
+import imp
+import importlib.abc
+import os
+import sys
+import tempfile
+
+
+def default_directory():
+    """Return the default directory for extracted extension modules:
+    'importers/extensions' in $XDG_CACHE_HOME (~/.cache by default)."""
+    return cache_directory('extensions')
+
+
+class ExtensionCache:
+
+    """A directory of extracted extension modules keyed on their contents."""
+
+    def __init__(self, directory=None):
+        """Store the cache directory (default_directory() if None); it is
+        created when the first file is extracted."""
+        self.directory = (directory if directory is not None
+                            else default_directory())
+
+    def extract(self, data, file_name):
+        """Return the path of a file named 'file_name' with the data in the
+        cache, writing it if it is not already there."""
+        directory = os.path.join(self.directory,
+                                 hashlib.sha256(data).hexdigest())
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path):
+            return path
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.' + file_name,
+                                         dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        return path
+
+    def loader(self, finder, path):
+        """Return the loader for the extension module the finder found at the
+        path."""
+        return ExtensionLoader(finder, path, self)
+
+
+class ExtensionLoader(importlib.abc.Loader):
+
+    """Loader for an extension module stored in an archive.
+
+    The data is read with the get_data() method of the finder which found the
+    module and extracted to the cache on load.
+
+    """
+
+    def __init__(self, finder, path, cache):
+        self._finder = finder
+        self._path = path
+        self._cache = cache
+
+    def is_package(self, fullname):
+        return importers_abc._is_package_file(self._path)
+
+    def get_code(self, fullname):
+        return None
+
+    def get_source(self, fullname):
+        return None
+
+    def extract(self):
+        """Extract the module to the cache, returning the extracted path."""
+        return self._cache.extract(self._finder.get_data(self._path),
+                                   os.path.basename(self._path))
+
+    def load_module(self, fullname):
+        """Extract and load the extension module.
+
+        The module's __file__ is the extracted file; __path__ (for packages)
+        is the module's directory within the archive.
+
+        """
+        try:
+            path = self.extract()
+        except IOError as exc:
+            raise ImportError("cannot extract {}: {}".format(fullname, exc))
+        module = imp.load_dynamic(fullname, path)
+        module.__file__ = path
+        module.__loader__ = self
+        if self.is_package(fullname):
+            module.__path__ = [os.path.dirname(self._path)]
+        return sys.modules.setdefault(fullname, module)
@@ -0,0 +1,165 @@
+"""Importer for Python source and bytecode stored in directories on the file
+system.
+
+Each directory is listed once with os.scandir() and its contents are cached.
+The cache for a directory is only refreshed when the directory's own mtime
+changes, which is checked at most once per find_module()/load_module() call.
+This means file_exists() and path_mtime() are answered from the cached
+listing instead of a stat call per probe, which matters when stat calls are
+expensive (e.g. NFS-mounted code).
+
+The trade-off is that a file modified in place (which does not touch the
+mtime of the directory containing it) keeps its cached mtime until something
+is added to, removed from or renamed within the directory.
+
+"""
+from . import abc as importers_abc
+import os
+
+
+class Hook:
+
+    """Path hook for directories.
+
+    All importers created by the hook share the same directory listing cache.
+
+    """
+
+    def __init__(self):
+        """Initialize the shared directory listing cache."""
+        self._listings = {}
+
+    def __call__(self, path):
+        """Return an importer if the path is a directory."""
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            raise ImportError("{} is not a directory".format(path))
+        return Importer(path, self._listings)
+
+
+class Importer(importers_abc.PyFileFinder, importers_abc.PyPycFileLoader):
+
+    """Importer for directories."""
+
+    def __init__(self, location, listings=None):
+        """Store the location and the directory listing cache to use.
+
+        The listing cache maps directory paths to a pair of the directory's
+        mtime and a dict of os.DirEntry instances keyed on file name.
+
+        """
+        super().__init__(location)
+        self._listings = listings if listings is not None else {}
+        # Directories whose cached listing has been validated during the
+        # current find_module()/load_module() call.
+        self._checked = set()
+
+    def _entries(self, directory):
+        """Return the cached listing for the directory, refreshing it if the
+        directory's mtime has changed since it was last listed."""
+        if directory in self._checked:
+            return self._listings.get(directory, (None, {}))[1]
+        parent, name = os.path.split(directory)
+        if parent == self.location and directory != parent:
+            # Avoid statting a package directory the location's listing says
+            # is not there.
+            entry = self._entries(parent).get(name)
+            if entry is None or not entry.is_dir():
+                self._checked.add(directory)
+                self._listings.pop(directory, None)
+                return {}
+        self._checked.add(directory)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._listings.pop(directory, None)
+            return {}
+        cached = self._listings.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with os.scandir(directory) as scan:
+                entries = {entry.name: entry for entry in scan}
+        except OSError:
+            self._listings.pop(directory, None)
+            return {}
+        self._listings[directory] = mtime, entries
+        return entries
+
+    def _entry(self, path):
+        """Return the os.DirEntry for the path or None if it does not
+        exist."""
+        directory, name = os.path.split(path)
+        return self._entries(directory).get(name)
+
+    def invalidate_caches(self):
+        """Force the directory listings to be validated again."""
+        self._checked.clear()
+
+    def find_module(self, fullname):
+        """Find the module, validating cached listings once."""
+        self._checked.clear()
+        return super().find_module(fullname)
+
+    def load_module(self, fullname):
+        """Load the module, validating cached listings once."""
+        self._checked.clear()
+        return super().load_module(fullname)
+
+    def loader(self, *args, **kwargs):
+        return self
+
+    def location_paths(self):
+        """Return the names of the files in the location and the paths of the
+        __init__ files of the directories in it, from the cached
+        listings."""
+        self._checked.clear()
+        paths = []
+        for name, entry in self._entries(self.location).items():
+            if entry.is_dir():
+                directory = os.path.join(self.location, name)
+                paths.extend(name + '/' + child
+                             for child in self._entries(directory)
+                             if child.startswith('__init__.'))
+            else:
+                paths.append(name)
+        return paths
+
+    def file_exists(self, path):
+        """Check the cached directory listing for the file."""
+        entry = self._entry(path)
+        return entry is not None and entry.is_file()
+
+    def get_data(self, path):
+        """Return the bytes of the file."""
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def open_data(self, path):
+        """Open the file for reading."""
+        return open(path, 'rb')
+
+    def path_mtime(self, path):
+        """Return the mtime for the path from the cached directory
+        listing."""
+        entry = self._entry(path)
+        if entry is None:
+            raise IOError("{} does not exist".format(path))
+        try:
+            return int(entry.stat().st_mtime)
+        except OSError:
+            raise IOError("{} does not exist".format(path))
+
+    def write_data(self, path, data):
+        """Write the data to the path, returning False if it could not be
+        written."""
+        try:
+            with open(path, 'wb') as file:
+                file.write(data)
+        except IOError:
+            return False
+        # Make the new file visible on the next lookup.
+        directory = os.path.dirname(path)
+        self._listings.pop(directory, None)
+        self._checked.discard(directory)
+        return True
@@ -0,0 +1,295 @@
+"""Static import graphs of archives.
+
+Every source module in an archive is parsed with ast and the imports run
+when its body executes (those at the top level, including inside if/try
+blocks and class bodies but not inside functions) are recorded as edges to
+the modules of the archive they name. Importing 'a.b.c' depends on 'a',
+'a.b' and 'a.b.c'; 'from a import b' depends on 'a' and, if it is a module of
+the archive, 'a.b'. Relative imports are resolved against the importing
+module's package.
+
+The graph is stored in the archive itself, keeping the path (without its
+suffix) of the file of every dependency so that importers can read the files
+of a module's dependencies without searching for them:
+
+* sqlite3 databases get an Imports table (see sql_creation)::
+
+    {}
+
+* zip files get a JSON member named GRAPH_NAME::
+
+    {{"version": 1,
+     "modules": {{"<name>": {{"path": "<path without suffix>",
+                            "imports": ["<name>", ...]}}, ...}}}}
+
+When an importer of importers.sqlite3 or importers.zip loads a module from
+an archive with a graph, it reads the files of the module's dependencies
+which are not imported yet in one batch (a single query, or one read per run
+of neighbouring zip members) before executing the module, so their imports
+are served from memory. The import order also follows from the graph
+(import_order()) without tracing a process.
+
+From the command line, the graph of an existing archive is stored with::
+
+  python -m importers.graph ARCHIVE
+
+and importers.pack stores it when packing with --graph.
+
+"""
+from . import sqlite3 as importers_sqlite3
+from . import zip as importers_zip
+import ast
+import imp
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+
+sql_creation = """CREATE TABLE Imports
+                    (module TEXT, dependency TEXT, path TEXT,
+                     PRIMARY KEY (module, dependency)) WITHOUT ROWID"""
+
+__doc__ = __doc__.format(sql_creation)
+
+GRAPH_NAME = importers_zip.GRAPH_NAME
+
+VERSION = importers_zip.GRAPH_VERSION
+
+_SOURCE_SUFFIXES = [x[0] for x in imp.get_suffixes() if x[2] == imp.PY_SOURCE]
+_BYTECODE_SUFFIXES = [x[0] for x in imp.get_suffixes()
+                        if x[2] == imp.PY_COMPILED]
+
+
+def module_paths(paths):
+    """Return a dict mapping the names of the modules stored at the relative,
+    OS-neutral paths to the path of their files without the suffix (e.g.
+    'pkg/__init__' for 'pkg')."""
+    modules = {}
+    for path in paths:
+        base, ext = os.path.splitext(path)
+        if ext in _BYTECODE_SUFFIXES:
+            base = importers_sqlite3.split_optimization_tag(path)[0]
+        elif ext not in _SOURCE_SUFFIXES:
+            continue
+        parts = base.split('/')
+        if parts[-1] == '__init__':
+            parts.pop()
+        if parts and '.' not in parts[-1]:
+            modules['.'.join(parts)] = base
+    return modules
+
+
+class _ImportVisitor(ast.NodeVisitor):
+
+    """Collect the names of the modules imported when a module's body
+    executes."""
+
+    def __init__(self, package):
+        self.package = package
+        # Names in the order they are first imported.
+        self.names = {}
+
+    def _add(self, name):
+        parts = name.split('.')
+        for index in range(1, len(parts) + 1):
+            self.names.setdefault('.'.join(parts[:index]))
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._add(alias.name)
+
+    def visit_ImportFrom(self, node):
+        if node.level:
+            bits = self.package.rsplit('.', node.level - 1)
+            if not self.package or len(bits) < node.level:
+                # Beyond the top-level package.
+                return
+            module = bits[0]
+            if node.module:
+                module += '.' + node.module
+        else:
+            module = node.module
+        self._add(module)
+        for alias in node.names:
+            if alias.name != '*':
+                self.names.setdefault(module + '.' + alias.name)
+
+    def _skip(self, node):
+        # Function bodies only run when called.
+        pass
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_Lambda = _skip
+
+
+def imports(source, fullname, is_package=False):
+    """Return the names of the modules (and candidate submodules) the source
+    of the module imports when its body executes, in the order they are first
+    imported.
+
+    SyntaxError is raised if the source does not parse.
+
+    """
+    package = fullname if is_package else fullname.rpartition('.')[0]
+    visitor = _ImportVisitor(package)
+    visitor.visit(ast.parse(source, fullname))
+    return list(visitor.names)
+
+
+def import_graph(files):
+    """Return the import graph of the (relative path, mtime, data) triples as
+    a dict mapping the name of every module with source to the names of the
+    other modules among the files it imports, in import order.
+
+    Sources that do not parse are left out.
+
+    """
+    modules = module_paths(entry[0] for entry in files)
+    graph = {}
+    for relative, _, data in files:
+        base, ext = os.path.splitext(relative)
+        if ext not in _SOURCE_SUFFIXES:
+            continue
+        name = '.'.join(base.split('/'))
+        is_package = base.rpartition('/')[2] == '__init__'
+        if is_package:
+            name = name.rpartition('.')[0]
+        if modules.get(name) != base:
+            continue
+        try:
+            imported = imports(data, name, is_package)
+        except (SyntaxError, ValueError):
+            continue
+        graph[name] = [dependency for dependency in imported
+                        if dependency in modules and dependency != name]
+    return graph
+
+
+def import_order(graph, roots=None):
+    """Return the modules of the graph in the order importing the roots (every
+    module, sorted, if None) would first import them."""
+    order = {}
+    pending = list(reversed(sorted(graph) if roots is None else roots))
+    while pending:
+        name = pending.pop()
+        if name in order:
+            continue
+        order[name] = None
+        pending.extend(reversed(graph.get(name, ())))
+    return list(order)
+
+
+def write_sqlite3(cxn, graph, paths):
+    """Replace the Imports table of the database with the graph, 'paths'
+    mapping module names to their paths (see module_paths()), returning the
+    number of edges stored."""
+    rows = [(name, dependency, paths[dependency])
+            for name, dependencies in graph.items()
+            for dependency in dependencies]
+    with cxn:
+        cxn.execute('DROP TABLE IF EXISTS Imports')
+        cxn.execute(sql_creation)
+        cxn.executemany('INSERT INTO Imports VALUES (?, ?, ?)', rows)
+    return len(rows)
+
+
+def graph_member(graph, paths):
+    """Return the contents of the GRAPH_NAME member for the graph, 'paths'
+    being as for write_sqlite3()."""
+    modules = {name: {'path': path, 'imports': graph.get(name, [])}
+               for name, path in paths.items()}
+    return json.dumps({'version': VERSION, 'modules': modules}, indent=1,
+                      sort_keys=True).encode('utf-8')
+
+
+def _sqlite3_files(cxn):
+    """Return (path, mtime, data) triples for the files of the database in
+    either layout of importers.sqlite3."""
+    if importers_sqlite3._has_tables(cxn, 'FS'):
+        query = 'SELECT path, mtime, {}, data FROM FS'.format(
+                    'codec' if importers_sqlite3._has_codec_column(cxn)
+                    else 'NULL')
+    else:
+        query = """SELECT path, mtime, codec, data FROM Paths
+                   JOIN Blobs USING (hash)"""
+    return [(path, mtime, importers_sqlite3._decompress(codec, data))
+            for path, mtime, codec, data in cxn.execute(query)]
+
+
+def store_sqlite3(db_path):
+    """Store the import graph of the sqlite3 database in its Imports table,
+    returning the number of edges stored."""
+    cxn = sqlite3.connect(db_path)
+    try:
+        try:
+            usable = (importers_sqlite3._has_tables(cxn, 'FS') or
+                      importers_sqlite3._has_tables(cxn, 'Paths', 'Blobs'))
+        except sqlite3.DatabaseError:
+            usable = False
+        if not usable:
+            raise ValueError("{} is not a sqlite3 database importers can "
+                             "use".format(db_path))
+        files = _sqlite3_files(cxn)
+        return write_sqlite3(cxn, import_graph(files),
+                             module_paths(entry[0] for entry in files))
+    finally:
+        cxn.close()
+
+
+def store_zip(zip_path):
+    """Store the import graph of the zip file as its GRAPH_NAME member,
+    returning the number of edges stored.
+
+    The zip file is rewritten (to a temporary file with the same mode renamed
+    over it) so that an existing graph is replaced.
+
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        infos = [info for info in archive.infolist()
+                    if info.filename != GRAPH_NAME]
+        files = [(info.filename, 0, archive.read(info)) for info in infos]
+        graph = import_graph(files)
+        paths = module_paths(entry[0] for entry in files)
+        fd, temp_path = tempfile.mkstemp(prefix='.graph',
+                                         dir=os.path.dirname(zip_path))
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                with zipfile.ZipFile(file, 'w') as new_archive:
+                    for info, (_, _, data) in zip(infos, files):
+                        new_archive.writestr(info, data)
+                    new_archive.writestr(GRAPH_NAME,
+                                         graph_member(graph, paths))
+            # mkstemp() creates the file readable by its owner alone.
+            shutil.copymode(zip_path, temp_path)
+            os.replace(temp_path, zip_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+    return sum(len(dependencies) for dependencies in graph.values())
+
+
+def store(archive_path):
+    """Store the import graph in the zip file or sqlite3 database, returning
+    the number of edges stored."""
+    if zipfile.is_zipfile(archive_path):
+        return store_zip(archive_path)
+    return store_sqlite3(archive_path)
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m importers.graph',
+                description='Store the import graph of an archive in it.')
+    parser.add_argument('archive', help='zip file or sqlite3 database')
+    options = parser.parse_args(args)
+    count = store(options.archive)
+    print('{} imports stored in {}'.format(count, options.archive))
+
+
+if __name__ == '__main__':
+    main()
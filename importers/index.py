@@ -0,0 +1,204 @@
+"""Meta path finder which indexes the top-level names of many archives.
+
+With one finder per archive on sys.path, importing a top-level module probes
+every archive in turn for every possible file suffix. IndexFinder instead
+merges the top-level names provided by all registered archives into a single
+dict so that finding a top-level module is one lookup which routes directly to
+the finder of the archive providing it. Submodules are routed by the archive
+their package's __path__ entry is in.
+
+Usage::
+
+    finder = importers.index.IndexFinder()
+    finder.add_path([importers.zip.Hook(), importers.sqlite3.Hook()],
+                    sys.path)
+    sys.meta_path.insert(0, finder)
+
+The index only answers for the run of registered archives at the front of
+sys.path, as an earlier entry could provide a module of the same name. Within
+that run the archive first on sys.path wins. A name none of them provides is
+left to the finders after IndexFinder on sys.meta_path, which search all of
+sys.path as usual (the archives included, through whatever sys.path_hooks
+handles them). The archives must support ArchiveHook.paths().
+
+If the hooks were created with a 'check_interval', top-level lookups also
+check (at most once per interval) whether any archive was replaced; the index
+and cached finders are rebuilt when one was.
+
+"""
+from . import abc as importers_abc
+import importlib.util
+import os
+import sys
+
+
+class IndexFinder:
+
+    """Meta path finder for a set of archives, each handled by an
+    importers.abc.ArchiveHook."""
+
+    def __init__(self):
+        """Initialize the (empty) index."""
+        # Top-level name -> archive path.
+        self._index = {}
+        # Archive path -> hook, in registration order.
+        self._hooks = {}
+        # Archive path -> top-level names.
+        self._names = {}
+        # The sys.path the leading index was built for and the index of the
+        # top-level names of the run of archives at its front.
+        self._leading_path = None
+        self._leading_index = {}
+        # Path (archive path plus any location) -> finder.
+        self._finders = {}
+        # Distinct hooks, in registration order.
+        self._distinct_hooks = []
+
+    def add(self, hook, archive_path):
+        """Register the archive at the path with the hook that handles it,
+        returning the set of top-level names it provides.
+
+        ValueError is raised if the hook cannot open the archive.
+
+        """
+        archive_path = os.path.abspath(archive_path)
+        archive = hook.archive(archive_path)
+        names = importers_abc.top_level_names(hook.paths(archive))
+        self._hooks[archive_path] = hook
+        self._names[archive_path] = names
+        self._leading_path = None
+        if hook not in self._distinct_hooks:
+            self._distinct_hooks.append(hook)
+            hook.add_listener(self._archive_changed)
+        for name in names:
+            self._index.setdefault(name, archive_path)
+        return names
+
+    def add_path(self, hooks, paths):
+        """Register every path which one of the hooks can handle as an archive,
+        returning the paths that were registered.
+
+        Paths are tried in order (e.g. sys.path) and each path is handed to
+        the hooks in order until one accepts it.
+
+        """
+        added = []
+        for path in paths:
+            if not path or not os.path.isfile(path):
+                continue
+            for hook in hooks:
+                try:
+                    self.add(hook, path)
+                except (ValueError, NotImplementedError):
+                    continue
+                added.append(path)
+                break
+        return added
+
+    def remove(self, archive_path):
+        """Unregister the archive and rebuild the index from the remaining
+        archives."""
+        archive_path = os.path.abspath(archive_path)
+        del self._hooks[archive_path]
+        del self._names[archive_path]
+        self.invalidate_caches()
+
+    def invalidate_caches(self):
+        """Drop all cached finders and re-read the names provided by every
+        registered archive."""
+        self._finders.clear()
+        self._index.clear()
+        self._leading_path = None
+        for archive_path, hook in list(self._hooks.items()):
+            archive = hook.archive(archive_path)
+            names = importers_abc.top_level_names(hook.paths(archive))
+            self._names[archive_path] = names
+            for name in names:
+                self._index.setdefault(name, archive_path)
+
+    def _archive_changed(self, hook, archive_path, event):
+        """Rebuild the index when a registered archive was reopened and drop
+        the finders for one that was closed (it is reopened on demand)."""
+        if self._hooks.get(archive_path) is not hook:
+            return
+        if event == 'reopened':
+            self.invalidate_caches()
+        else:
+            prefix = archive_path + os.sep
+            for path in list(self._finders):
+                if path == archive_path or path.startswith(prefix):
+                    del self._finders[path]
+
+    def archive_for(self, name):
+        """Return the path of the archive providing the top-level name or None
+        if no registered archive does."""
+        return self._index.get(name)
+
+    def _leading(self):
+        """Return the index of the top-level names provided by the run of
+        registered archives at the front of sys.path (the archive first on
+        sys.path winning)."""
+        if self._leading_path != sys.path:
+            index = {}
+            for entry in sys.path:
+                archive_path = os.path.abspath(entry)
+                names = self._names.get(archive_path)
+                if names is None:
+                    break
+                for name in names:
+                    index.setdefault(name, archive_path)
+            self._leading_path = list(sys.path)
+            self._leading_index = index
+        return self._leading_index
+
+    def _finder(self, hook, path):
+        """Return the (cached) finder for the path."""
+        try:
+            return self._finders[path]
+        except KeyError:
+            finder = hook(path)
+            self._finders[path] = finder
+            return finder
+
+    def _hook_for(self, path):
+        """Return the hook for the registered archive the path is within or
+        None."""
+        for pre_path, _ in importers_abc._super_paths(os.path.abspath(path)):
+            hook = self._hooks.get(pre_path)
+            if hook is not None:
+                return hook
+        return None
+
+    def find_module(self, fullname, path=None):
+        """Find the module in the registered archives.
+
+        Top-level modules are looked up in the index of the archives at the
+        front of sys.path; None is returned if none of them provides the
+        module. For submodules each entry of the parent package's 'path'
+        within a registered archive is searched.
+
+        """
+        if path is None:
+            for hook in self._distinct_hooks:
+                hook.check()
+            archive_path = self._leading().get(fullname)
+            if archive_path is None:
+                return None
+            return self._finder(self._hooks[archive_path],
+                                archive_path).find_module(fullname)
+        for entry in path:
+            hook = self._hook_for(entry)
+            if hook is None:
+                continue
+            loader = self._finder(hook, entry).find_module(fullname)
+            if loader is not None:
+                return loader
+        return None
+
+    def find_spec(self, fullname, path=None, target=None):
+        """Return a spec for the loader find_module() finds or None (the
+        finder interface of Python 3.4 and later)."""
+        loader = self.find_module(fullname, path)
+        if loader is None:
+            return None
+        return importlib.util.spec_from_loader(fullname, loader)
@@ -26,11 +26,94 @@ No lazy finder is provided as it breaks the common pattern of::
 
 by delaying the ImportError until execution has past the try/except block.
 
+Every lazy module that is created is tracked in a registry so that the effect
+of lazy loading can be measured. The records() function returns what was
+created, whether (and when) each module was actually loaded, the attribute
+that triggered the load and how long the real load took. Call dump_at_exit()
+to have a report written when the interpreter exits.
+
 """
+import atexit
 import sys
+import time
 import types
 
 
+class LoadRecord:
+
+    """Accounting for a single lazy module.
+
+    The 'created' and 'materialized' attributes are timestamps as returned by
+    time.time(); 'materialized' is None if the module was never actually
+    loaded. 'trigger' is the name of the attribute whose access caused the
+    load and 'load_time' is the number of seconds the real load took.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.created = time.time()
+        self.materialized = None
+        self.trigger = None
+        self.load_time = None
+
+    def __repr__(self):
+        if self.materialized is None:
+            state = 'never materialized'
+        else:
+            state = 'materialized by {!r} in {:.6f}s'.format(self.trigger,
+                                                             self.load_time)
+        return '<LoadRecord {!r}: {}>'.format(self.name, state)
+
+
+# Module name -> LoadRecord, in the order the lazy modules were created.
+_registry = {}
+
+
+def records():
+    """Return a list of the LoadRecord instances for all lazy modules created
+    so far, in creation order."""
+    return list(_registry.values())
+
+
+def unmaterialized():
+    """Return the names of the lazy modules that have never been loaded."""
+    return [record.name for record in _registry.values()
+                if record.materialized is None]
+
+
+def clear():
+    """Forget about all lazy modules recorded so far."""
+    _registry.clear()
+
+
+def report(file=None):
+    """Write a summary of lazy module usage to the file (sys.stderr by
+    default)."""
+    if file is None:
+        file = sys.stderr
+    loaded = [record for record in _registry.values()
+                if record.materialized is not None]
+    never = unmaterialized()
+    total = sum(record.load_time for record in loaded)
+    print('lazy modules: {} created, {} materialized ({:.6f}s), '
+          '{} never materialized'.format(len(_registry), len(loaded), total,
+                                         len(never)),
+          file=file)
+    for record in sorted(loaded, key=lambda x: x.load_time, reverse=True):
+        delay = record.materialized - record.created
+        print('  {}: {!r} after {:.6f}s, load took {:.6f}s'.format(
+                record.name, record.trigger, delay, record.load_time),
+              file=file)
+    for name in never:
+        print('  {}: never materialized'.format(name), file=file)
+
+
+def dump_at_exit(file=None):
+    """Register report() to be called when the interpreter exits."""
+    atexit.register(report, file)
+
+
 class Module(types.ModuleType):
 
     """Module class to use when setting __class__ after a load.
@@ -75,8 +158,15 @@ class LazyModule(types.ModuleType):
         state = self.__dict__.copy()
         # Make sure to not load under the wrong pretenses.
         original_name = state['__original_name__']
-        # Actually load the module.
+        # Actually load the module, keeping track of how long it takes; a
+        # load which fails leaves the module unmaterialized.
+        record = _registry.get(original_name)
+        start = time.perf_counter()
         self.__loader__.load_module(original_name)
+        if record is not None:
+            record.load_time = time.perf_counter() - start
+            record.materialized = time.time()
+            record.trigger = attr
         # Restore mutations.
         self.__dict__.update(state)
         # Return the requested attribute.
@@ -103,5 +193,6 @@ class Mixin:
         module.__loader__ = self
         # Insert the module into sys.modules.
         sys.modules[name] = module
+        _registry[name] = LoadRecord(name)
         return module
 
@@ -0,0 +1,445 @@
+"""Tools for packing a directory tree into an archive that can be imported
+from.
+
+From the command line::
+
+  python -m importers.pack DIRECTORY ARCHIVE
+                                             [--format {sqlite3,zip,bundle}]
+                                             [--codec zlib] [--level N]
+                                             [--threshold BYTES]
+                                             [--compile] [--workers N]
+                                             [--order FILE] [--manifest]
+                                             [--hash] [--optimize N]
+                                             [--graph]
+
+For sqlite3 archives the files are stored in the FS table of the database at
+ARCHIVE (created as importers.sqlite3.indexed_sql_creation, or rebuilt into
+that layout, if needed) in a single transaction.
+Files at least --threshold bytes long are compressed with --codec; smaller
+files are stored raw as compression does not pay for itself on them.
+
+For zip archives every member is stored uncompressed so that reading it is a
+plain read of the archive. Bundles (see importers.bundle) are read-only, so
+pack them with --compile.
+
+--compile compiles all source files to bytecode in a process pool and stores
+the bytecode next to the source. --order names a file listing module names
+(one per line, e.g. in the order a traced process imported them); those
+modules are stored first and in that order so that reads at startup are
+sequential. --manifest stores a JSON description of the archive as
+MANIFEST_NAME at the root of the archive. --hash stores the hash of every
+source file (and of the source the bytecode was compiled from) in sqlite3
+archives so that bytecode is validated by content rather than by mtime.
+--optimize (which may be repeated) names the optimization levels to compile
+sqlite3 archives for (0, 1 for -O and 2 for -OO; the level of the packing
+interpreter by default), each stored under its own tag (see
+importers.sqlite3) so that optimized processes never compile. Zip archives
+and bundles always hold unoptimized bytecode. --graph stores the static
+import graph of the modules in sqlite3 and zip archives (see importers.graph)
+and, without --order, stores modules in the order they import each other.
+
+"""
+from . import neutral_path
+from . import bundle as importers_bundle
+from . import graph as importers_graph
+from . import sqlite3 as importers_sqlite3
+import concurrent.futures
+import imp
+import json
+import marshal
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+
+
+DEFAULT_THRESHOLD = 4096
+
+MANIFEST_NAME = '__manifest__.json'
+
+_SOURCE_SUFFIXES = [x[0] for x in imp.get_suffixes() if x[2] == imp.PY_SOURCE]
+_BYTECODE_SUFFIX = next(x[0] for x in imp.get_suffixes()
+                            if x[2] == imp.PY_COMPILED)
+
+
+def choose_codec(data, codec, threshold=DEFAULT_THRESHOLD):
+    """Return the codec to store the data with based on its size."""
+    if codec is None or len(data) < threshold:
+        return None
+    return codec
+
+
+def walk(directory):
+    """Yield pairs of the absolute path and the relative, OS-neutral path for
+    every file in the tree, skipping __pycache__ directories."""
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(name for name in dirnames
+                                if name != '__pycache__')
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            relative = os.path.relpath(path, directory)
+            yield path, neutral_path(relative)
+
+
+def module_name(relative):
+    """Return the name of the module stored at the relative, OS-neutral path
+    or None if the path is not for a module."""
+    base, ext = os.path.splitext(relative)
+    if ext == _BYTECODE_SUFFIX:
+        base = importers_sqlite3.split_optimization_tag(relative)[0]
+    elif ext not in _SOURCE_SUFFIXES:
+        return None
+    parts = base.split('/')
+    if parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts) or None
+
+
+def read_order(path):
+    """Read the module names, one per line, listed in the file."""
+    with open(path) as file:
+        return [line.strip() for line in file
+                    if line.strip() and not line.startswith('#')]
+
+
+def collect(directory, order=None):
+    """Return a list of (relative path, mtime, data) triples for the files in
+    the directory tree.
+
+    Modules named in the 'order' sequence come first in that order (the name
+    of a package standing for its __init__ file); everything else follows
+    sorted by path.
+
+    """
+    files = []
+    for path, relative in walk(directory):
+        with open(path, 'rb') as file:
+            data = file.read()
+        files.append((relative, int(os.stat(path).st_mtime), data))
+    return _ordered(files, order)
+
+
+def _ordered(files, order):
+    """Return the file triples sorted as described for collect()."""
+    rank = {name: index for index, name in enumerate(order or ())}
+    def key(entry):
+        name = module_name(entry[0])
+        return (rank.get(name, len(rank)), entry[0])
+    return sorted(files, key=key)
+
+
+def _compile(args):
+    """Compile the source under the file name, returning the bytecode file
+    contents or None if the source could not be compiled.
+
+    The format is the one importlib.abc.PyPycLoader reads: the magic number,
+    the source mtime as a 4-byte little-endian integer and the marshalled code
+    object.
+
+    """
+    filename, mtime, source, optimize = args
+    try:
+        code = compile(source, filename, 'exec', dont_inherit=True,
+                       optimize=optimize)
+    except (SyntaxError, ValueError):
+        return None
+    data = bytearray(imp.get_magic())
+    data.extend((mtime & 0xFFFFFFFF).to_bytes(4, 'little'))
+    data.extend(marshal.dumps(code))
+    return bytes(data)
+
+
+def source_filename(archive_path, relative):
+    """Return the file name the code compiled from the source at the relative
+    path in the archive has, as when an importer compiles it: the path of the
+    source below the absolute archive path (the relative path itself if the
+    archive path is None)."""
+    if archive_path is None:
+        return relative
+    return os.path.join(os.path.abspath(archive_path), *relative.split('/'))
+
+
+def compile_sources(files, workers=None, optimize=None, archive_path=None):
+    """Compile every source file in the (relative path, mtime, data) triples
+    across a pool of worker processes.
+
+    A list of triples for the bytecode files is returned, in the same order as
+    their source. Sources that fail to compile are skipped (the importer will
+    report the error when the module is imported). A 'workers' value of 1
+    compiles in the current process. The source is compiled at the
+    'optimize' level (sys.flags.optimize if None) and the bytecode paths carry
+    its tag (see importers.sqlite3.optimization_tag()). The code objects get
+    the file names of the sources in the archive at 'archive_path' (see
+    source_filename()), so that tracebacks are the same whether the bytecode
+    was compiled when packing or when importing.
+
+    """
+    if optimize is None:
+        optimize = sys.flags.optimize
+    suffix = importers_sqlite3.optimization_tag(optimize) + _BYTECODE_SUFFIX
+    sources = [entry for entry in files
+                if os.path.splitext(entry[0])[1] in _SOURCE_SUFFIXES]
+    jobs = [(source_filename(archive_path, relative), mtime, data, optimize)
+            for relative, mtime, data in sources]
+    if workers == 1:
+        results = map(_compile, jobs)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_compile, jobs, chunksize=16))
+    bytecode = []
+    for (relative, mtime, _), data in zip(sources, results):
+        if data is not None:
+            base = os.path.splitext(relative)[0]
+            bytecode.append((base + suffix, mtime, data))
+    return bytecode
+
+
+def _with_bytecode(files, bytecode):
+    """Merge the bytecode triples into the file triples, placing the bytecode
+    files directly after their source."""
+    compiled = {}
+    for entry in bytecode:
+        base = importers_sqlite3.split_optimization_tag(entry[0])[0]
+        compiled.setdefault(base, []).append(entry)
+    names = {entry[0] for entry in bytecode}
+    merged = []
+    for entry in files:
+        if entry[0] in names:
+            # Bytecode already in the tree is superseded.
+            continue
+        merged.append(entry)
+        base, ext = os.path.splitext(entry[0])
+        if ext in _SOURCE_SUFFIXES:
+            merged.extend(compiled.get(base, ()))
+    return merged
+
+
+def manifest(files):
+    """Return the JSON manifest (as bytes) describing the files."""
+    entries = [{'path': relative, 'mtime': mtime, 'size': len(data),
+                'module': module_name(relative)}
+               for relative, mtime, data in files]
+    return json.dumps({'magic': imp.get_magic().hex(), 'files': entries},
+                      indent=1, sort_keys=True).encode('utf-8')
+
+
+def _prepare(directory, archive_path, bytecode, workers, order,
+             with_manifest, optimize=(0,), with_graph=False):
+    """Collect the files to pack into the archive at 'archive_path'
+    (including bytecode for the 'optimize' levels and manifest as
+    requested), returning the file triples, the set
+    of paths of the bytecode files compiled from the source in them and, if
+    'with_graph' is true, their import graph (else None).
+
+    With an import graph and no 'order', modules are ordered as
+    importers.graph.import_order() imports them.
+
+    """
+    files = collect(directory, order)
+    graph = None
+    if with_graph:
+        graph = importers_graph.import_graph(files)
+        if order is None:
+            files = _ordered(files, importers_graph.import_order(graph))
+    compiled = set()
+    if bytecode:
+        compiled_files = []
+        for level in sorted(set(optimize)):
+            compiled_files.extend(compile_sources(files, workers, level,
+                                                  archive_path))
+        compiled = {entry[0] for entry in compiled_files}
+        files = _with_bytecode(files, compiled_files)
+    if with_manifest:
+        files.append((MANIFEST_NAME, int(time.time()), manifest(files)))
+    return files, compiled, graph
+
+
+def _module_paths(files):
+    """Return importers.graph.module_paths() for the file triples."""
+    return importers_graph.module_paths(entry[0] for entry in files)
+
+
+def _source_hashes(files, compiled):
+    """Return a dict mapping the paths of the source files and the compiled
+    bytecode files to the hash of their source."""
+    hashes = {}
+    by_base = {}
+    for relative, _, data in files:
+        base, ext = os.path.splitext(relative)
+        if ext in _SOURCE_SUFFIXES:
+            hashes[relative] = importers_sqlite3.hash_source(data)
+            by_base[base] = hashes[relative]
+    for relative in compiled:
+        base = importers_sqlite3.split_optimization_tag(relative)[0]
+        if base in by_base:
+            hashes[relative] = by_base[base]
+    return hashes
+
+
+def pack_sqlite3(directory, db_path, codec=None, level=None,
+                 threshold=DEFAULT_THRESHOLD, bytecode=False, workers=None,
+                 order=None, with_manifest=False, hashes=False,
+                 optimize=None, with_graph=False):
+    """Store every file in the directory tree in the FS table of the sqlite3
+    database, returning the number of files stored.
+
+    Files whose size is at least 'threshold' are compressed with 'codec' at
+    'level'. If 'bytecode' is true then bytecode is generated for all source
+    using 'workers' processes. 'order' is as for collect() and if
+    'with_manifest' is true then the manifest() is stored as MANIFEST_NAME.
+    All rows are written in a single transaction, with the module columns
+    of importers.sqlite3.indexed_sql_creation filled in and in the order
+    of collect().
+
+    If 'hashes' is true (or the database already has the source_hash column)
+    then source is stored with its hash and the bytecode compiled from it
+    with the same hash, so that importers validate bytecode by hash (see
+    importers.sqlite3.add_hash_column()).
+
+    Bytecode is compiled for every optimization level in 'optimize' (the
+    interpreter's level if None) and stored under the level's tag, so that
+    importers running at any of those levels find their bytecode.
+
+    If 'with_graph' is true then the import graph of the modules is stored in
+    the Imports table (see importers.graph).
+
+    """
+    if optimize is None:
+        optimize = (sys.flags.optimize,)
+    files, compiled, graph = _prepare(directory, db_path, bytecode, workers,
+                                      order, with_manifest, optimize,
+                                      with_graph)
+    cxn = sqlite3.connect(db_path)
+    try:
+        with cxn:
+            if not importers_sqlite3._has_tables(cxn, 'FS'):
+                cxn.executescript(importers_sqlite3.indexed_sql_creation)
+        importers_sqlite3.add_module_columns(cxn)
+        if hashes:
+            importers_sqlite3.add_hash_column(cxn)
+        columns = ['path', 'mtime', 'data', 'codec', 'module_dir', 'stem',
+                   'kind', 'is_package']
+        source_hashes = None
+        if 'source_hash' in importers_sqlite3._columns(cxn):
+            columns.append('source_hash')
+            source_hashes = _source_hashes(files, compiled)
+        # Nothing is lost if the build is interrupted; just pack again.
+        cxn.execute('PRAGMA synchronous=OFF')
+        def rows():
+            for relative, mtime, data in files:
+                row_codec = choose_codec(data, codec, threshold)
+                row = ((relative, mtime,
+                        importers_sqlite3._compress(data, row_codec, level),
+                        row_codec) +
+                       importers_sqlite3.module_columns(relative))
+                if source_hashes is not None:
+                    row += (source_hashes.get(relative),)
+                yield row
+        insert = 'INSERT OR REPLACE INTO FS ({}) VALUES ({})'.format(
+                    ', '.join(columns), ', '.join('?' * len(columns)))
+        with cxn:
+            cxn.executemany(insert, rows())
+        if graph is not None:
+            importers_graph.write_sqlite3(cxn, graph, _module_paths(files))
+        return len(files)
+    finally:
+        cxn.close()
+
+
+def pack_zip(directory, zip_path, bytecode=False, workers=None, order=None,
+             with_manifest=False, with_graph=False):
+    """Store every file in the directory tree uncompressed in a new zip file,
+    returning the number of files stored.
+
+    The remaining arguments are the same as for pack_sqlite3(); the import
+    graph is stored as the importers.graph.GRAPH_NAME member.
+
+    """
+    files, _, graph = _prepare(directory, zip_path, bytecode, workers, order,
+                               with_manifest, with_graph=with_graph)
+    if graph is not None:
+        files.append((importers_graph.GRAPH_NAME, int(time.time()),
+                      importers_graph.graph_member(graph,
+                                                   _module_paths(files))))
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_:
+        for relative, mtime, data in files:
+            date_time = time.localtime(max(mtime, 315532800))[:6]
+            info = zipfile.ZipInfo(relative, date_time)
+            info.compress_type = zipfile.ZIP_STORED
+            zip_.writestr(info, data)
+    return len(files)
+
+
+def pack_bundle(directory, bundle_path, bytecode=False, workers=None,
+                order=None, with_manifest=False):
+    """Store every file in the directory tree in a new bundle file, returning
+    the number of files stored.
+
+    The remaining arguments are the same as for pack_sqlite3(); 'order' has
+    no effect as bundles are sorted by path.
+
+    """
+    files, _, _ = _prepare(directory, bundle_path, bytecode, workers, order,
+                           with_manifest)
+    return importers_bundle.write_bundle(bundle_path, files)
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m importers.pack',
+                description='Pack a directory tree into an archive.')
+    parser.add_argument('directory', help='root of the tree to pack')
+    parser.add_argument('archive', help='archive to write')
+    parser.add_argument('--format', choices=['sqlite3', 'zip', 'bundle'],
+                        default=None,
+                        help='archive format (default: zip for *.zip, '
+                             'bundle for *.bundle, else sqlite3)')
+    parser.add_argument('--codec', choices=['zlib', 'lzma'], default=None,
+                        help='compress files with the codec (sqlite3 only)')
+    parser.add_argument('--level', type=int, default=None,
+                        help='compression level/preset for the codec')
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                        help='only compress files at least this many bytes')
+    parser.add_argument('--compile', action='store_true',
+                        help='store bytecode for all source')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes to compile with')
+    parser.add_argument('--order', default=None,
+                        help='file listing module names in import order')
+    parser.add_argument('--manifest', action='store_true',
+                        help='store a JSON manifest in the archive')
+    parser.add_argument('--hash', action='store_true',
+                        help='validate bytecode by source hash (sqlite3 '
+                             'only)')
+    parser.add_argument('--optimize', type=int, choices=[0, 1, 2],
+                        action='append', default=None,
+                        help='optimization level to compile for; may be '
+                             'repeated (sqlite3 only)')
+    parser.add_argument('--graph', action='store_true',
+                        help='store the import graph (sqlite3 and zip only)')
+    options = parser.parse_args(args)
+    archive_format = options.format
+    if archive_format is None:
+        archive_format = {'.zip': 'zip', '.bundle': 'bundle'}.get(
+                            os.path.splitext(options.archive)[1], 'sqlite3')
+    order = read_order(options.order) if options.order else None
+    if archive_format == 'zip':
+        count = pack_zip(options.directory, options.archive, options.compile,
+                         options.workers, order, options.manifest,
+                         options.graph)
+    elif archive_format == 'bundle':
+        count = pack_bundle(options.directory, options.archive,
+                            options.compile, options.workers, order,
+                            options.manifest)
+    else:
+        count = pack_sqlite3(options.directory, options.archive,
+                             options.codec, options.level, options.threshold,
+                             options.compile, options.workers, order,
+                             options.manifest, options.hash,
+                             options.optimize, options.graph)
+    print('{} files packed into {}'.format(count, options.archive))
+
+
+if __name__ == '__main__':
+    main()
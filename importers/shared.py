@@ -0,0 +1,225 @@
+"""Archive indexes shared between processes.
+
+Every process opening an archive normally builds its own view of it: a zip
+file's central directory is parsed into ZipInfo objects and a sqlite3
+database is queried for every probe. With many worker processes using the
+same archives that work (and the memory holding its result) is repeated in
+each of them. The first process to open an archive can instead publish a
+flat, read-only index of its members to a side file which the other
+processes map into memory (sharing the pages) and search in place::
+
+  header      MAGIC, format version, number of entries and the archive's key
+  entry table one fixed-size entry per member, sorted by path
+  paths       the UTF-8 encoded, '/'-separated paths
+
+Every entry holds the offset and length of the member's path, the member's
+mtime (for zip files, the DOS date and time as (date << 16) | time) and,
+for zip files, what reading the member requires: the offset of its local
+header, its compressed and uncompressed sizes, CRC, compression method and
+flags.
+
+Index files are named after the key of the archive they index -- the device,
+inode, mtime (in nanoseconds) and size of the file -- so an archive which is
+replaced or modified gets a new index instead of a stale one being used.
+Index files are written to a temporary file and atomically renamed into
+place. Publishing an index removes those of earlier versions of the same
+file (same device and inode); processes which mapped one keep using it.
+
+Side files are used rather than multiprocessing.shared_memory as segments
+have to outlive the process publishing them (the resource tracker unlinks
+them when it exits) and a mapped file is shared through the page cache all
+the same.
+
+"""
+from . import cache_directory
+import mmap
+import os
+import struct
+import tempfile
+
+
+MAGIC = b'PYINDEX\x00'
+
+VERSION = 1
+
+# Magic, version, number of entries, device, inode, mtime in ns, size.
+_HEADER = struct.Struct('<8sIIQQqQ')
+# Path offset, path length, mtime, header offset, compressed size, size,
+# CRC, compression method, flags.
+_ENTRY = struct.Struct('<QIqQQQIHH')
+
+
+def file_key(stat):
+    """Return the key identifying an archive from the result of os.stat() or
+    os.fstat() on it."""
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def write_index(path, key, entries):
+    """Write the index of the archive with the key to the path, returning the
+    number of entries written.
+
+    'entries' is an iterable of (path, mtime, header offset, compressed size,
+    size, CRC, compression method, flags) tuples; only the path and mtime are
+    required to be meaningful for archives other than zip files. The index is
+    written to a temporary file first and renamed to the path.
+
+    """
+    by_name = {}
+    for entry in entries:
+        by_name[entry[0].encode('utf-8')] = entry[1:]
+    names = sorted(by_name)
+    name_offset = _HEADER.size + _ENTRY.size * len(names)
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(prefix='.index', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(_HEADER.pack(MAGIC, VERSION, len(names), *key))
+            for name in names:
+                file.write(_ENTRY.pack(name_offset, len(name),
+                                       *by_name[name]))
+                name_offset += len(name)
+            for name in names:
+                file.write(name)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return len(names)
+
+
+class SharedIndex:
+
+    """A memory-mapped archive index."""
+
+    def __init__(self, path, key):
+        """Map the index at the path, raising ValueError if it is not an index
+        for the archive with the key and IOError if it cannot be read."""
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                raise ValueError("{} is not an index".format(path))
+        if len(self._map) < _HEADER.size:
+            self._map.close()
+            raise ValueError("{} is not an index".format(path))
+        magic, version, self._count, *index_key = _HEADER.unpack_from(
+                                                        self._map)
+        if (magic != MAGIC or version != VERSION or
+                tuple(index_key) != tuple(key)):
+            self._map.close()
+            raise ValueError("{} is not an index of version {} for "
+                             "{}".format(path, VERSION, key))
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        """Unmap the index."""
+        self._map.close()
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._map,
+                                  _HEADER.size + index * _ENTRY.size)
+
+    def _name(self, index):
+        name_offset, name_length = self._entry(index)[:2]
+        return self._map[name_offset:name_offset + name_length]
+
+    def _lower_bound(self, name):
+        """Return the index of the first entry whose path is not less than the
+        encoded name."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, path):
+        """Return (mtime, header offset, compressed size, size, CRC,
+        compression method, flags) for the path or None if the archive has no
+        such member."""
+        name = path.encode('utf-8')
+        index = self._lower_bound(name)
+        if index < self._count:
+            entry = self._entry(index)
+            name_offset, name_length = entry[:2]
+            if self._map[name_offset:name_offset + name_length] == name:
+                return entry[2:]
+        return None
+
+    def paths(self, prefix=''):
+        """Return the paths of the members starting with the prefix,
+        sorted."""
+        prefix = prefix.encode('utf-8')
+        paths = []
+        for index in range(self._lower_bound(prefix), self._count):
+            name = self._name(index)
+            if not name.startswith(prefix):
+                break
+            paths.append(name.decode('utf-8'))
+        return paths
+
+
+class SharedIndexes:
+
+    """A directory of index files shared by processes (see the module
+    docstring)."""
+
+    def __init__(self, directory=None):
+        """Store the directory (cache_directory('indexes') if None); it is
+        created when the first index is published."""
+        self.directory = (directory if directory is not None
+                            else cache_directory('indexes'))
+
+    def index_path(self, key):
+        """Return the path of the index file for the archive with the key."""
+        return os.path.join(self.directory,
+                            '{:x}-{:x}-{:x}-{:x}.index'.format(*key))
+
+    def attach(self, key):
+        """Return the published index for the archive with the key or None if
+        there is none."""
+        try:
+            return SharedIndex(self.index_path(key), key)
+        except (IOError, ValueError):
+            return None
+
+    def publish(self, key, entries):
+        """Write the index of the archive with the key from the entries (see
+        write_index()) and return it, removing the indexes of earlier
+        versions of the same file."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.index_path(key)
+        write_index(path, key, entries)
+        index = SharedIndex(path, key)
+        self._remove_superseded(key)
+        return index
+
+    def _remove_superseded(self, key):
+        """Remove the index files for the same device and inode as the key
+        but another mtime or size."""
+        prefix = '{:x}-{:x}-'.format(*key[:2])
+        current = os.path.basename(self.index_path(key))
+        for name in os.listdir(self.directory):
+            if (name.startswith(prefix) and name.endswith('.index') and
+                    name != current):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass  # Removed by another process or still mapped.
+
+    def get(self, key, entries):
+        """Return the index for the archive with the key, publishing it from
+        entries() first if there is none."""
+        index = self.attach(key)
+        if index is None:
+            index = self.publish(key, entries())
+        return index
@@ -1,6 +1,22 @@
 sql_creation = """CREATE TABLE FS
                     (path TEXT PRIMARY KEY, mtime INTEGER, data BLOB);"""
 
+compressed_sql_creation = """CREATE TABLE FS
+                    (path TEXT PRIMARY KEY, mtime INTEGER, data BLOB,
+                     codec TEXT);"""
+
+indexed_sql_creation = """CREATE TABLE FS
+                    (path TEXT PRIMARY KEY, mtime INTEGER, data BLOB,
+                     codec TEXT, module_dir TEXT, stem TEXT, kind TEXT,
+                     is_package INTEGER);
+                  CREATE INDEX FS_module ON FS
+                    (module_dir, stem, kind, is_package, mtime, path);"""
+
+dedup_sql_creation = """CREATE TABLE Paths
+                    (path TEXT PRIMARY KEY, mtime INTEGER, hash TEXT);
+                  CREATE TABLE Blobs
+                    (hash TEXT PRIMARY KEY, codec TEXT, data BLOB);"""
+
 __doc__ = """
 Import machinery for using a sqlite3 database as the storage mechanism for
 Python source and bytecode.
@@ -14,70 +30,1000 @@ The 'path' column contains the relative, OS-neutral path (i.e. '/' path
 separator only) of the files stored in the database. The 'data' column is the
 raw bytes for that file.
 
-""".format(sql_creation)
+The FS table may optionally have a 'codec' column to allow for compressed
+rows::
+
+  {}
+
+A NULL codec means 'data' is stored raw, otherwise it names the codec ('zlib'
+or 'lzma') 'data' was compressed with. An existing table can be given the
+column with add_codec_column().
+
+Large databases should describe the module each row holds so that finding a
+module (its source and bytecode paths, their mtimes and whether it is a
+package) is a single query on a covering index::
+
+  {}
+
+'module_dir' is the directory part of 'path' ('' at the root), 'stem' the file
+name without its extension, 'kind' is 'source', 'bytecode' or NULL for other
+files and 'is_package' is 1 for the __init__ file of a package. Existing
+tables are rebuilt into this layout by add_module_columns().
+
+Bytecode compiled with optimizations (-O or -OO) is stored apart from
+unoptimized bytecode, with the optimization level tagged before the suffix
+('module.opt-1.pyc', 'module.opt-2.pyc'; the kind is 'bytecode.opt-1' or
+'bytecode.opt-2'), so each level can be stored in the same database.
+Importers use the bytecode for the interpreter's optimization level and
+write the bytecode they compile under its tag; modules without source fall
+back to unoptimized bytecode.
+
+By default bytecode is used if the mtime recorded in it is not older than the
+source's. Adding a 'source_hash TEXT' column to FS (add_hash_column()) makes
+importers validate bytecode by content instead: source rows store the SHA-256
+hex digest of their data and bytecode rows the digest of the source they were
+compiled from, and bytecode is used whenever the two match. Repacking a
+database (which changes every mtime) then only causes modified modules to be
+compiled again.
+
+If the database has the Imports table of importers.graph, loading a module
+first reads the up-to-date bytecode (or else the source) of its dependencies
+which are not imported yet in a few queries; get_data() returns that data
+once and what the module did not import is dropped once it is loaded.
+
+Many processes starting at once against the same database all write the
+bytecode they compile. With SQLite's default rollback journal every write
+locks out readers as well as the other writers, so a hook can instead put
+the database in write-ahead logging (WAL) mode (Hook(wal=True)), where
+readers never wait for writers. Its importers then wait only briefly on a
+locked database (WAL_BUSY_TIMEOUT), do not store bytecode another process
+already stored for the same source, and retry a locked write after backing
+off (WRITE_RETRIES, WRITE_BACKOFF), giving up on bytecode (which is only a
+cache) rather than failing the import.
+
+Databases shared by many near-identical builds can instead use a
+content-addressed layout (see DedupHook/DedupImporter) where each distinct file
+content is stored only once::
+
+  {}
+
+'Paths.hash' is the SHA-256 hex digest of the uncompressed contents of the
+file, keying into 'Blobs'. 'Blobs.codec' is NULL for raw data or the name of
+the codec ('zlib' or 'lzma') used to compress 'Blobs.data'. Running this
+module as a script migrates a database from the FS layout::
+
+  python -m importers.sqlite3 source.db destination.db [--codec zlib]
+
+""".format(sql_creation, compressed_sql_creation, indexed_sql_creation,
+           dedup_sql_creation)
 
-from . import remove_file
+from . import ArchivePrefix, neutral_path, split_optimization_tag
 from . import abc as importers_abc
+from . import shared
+import contextlib
+import copy
+import hashlib
+import imp
+import importlib.abc
+import io
+import marshal
 import os
+import random
 import sqlite3
+import sys
 import time
+import weakref
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 
-def _neutralpath(path):
-    """Convert a path to only use forward slashes."""
-    if os.sep != '/':
-        return path.replace(os.sep, '/')
-    else:
-        return path
+
+def _compress(data, codec, level=None):
+    """Compress the data with the named codec (None meaning no
+    compression)."""
+    if codec is None:
+        return data
+    elif codec == 'zlib':
+        return zlib.compress(data, -1 if level is None else level)
+    elif codec == 'lzma' and lzma is not None:
+        return lzma.compress(data, preset=level)
+    raise ValueError("unsupported codec {!r}".format(codec))
+
+
+def _decompress(codec, data):
+    """Decompress the data stored with the named codec."""
+    if codec is None:
+        return data
+    elif codec == 'zlib':
+        return zlib.decompress(data)
+    elif codec == 'lzma' and lzma is not None:
+        return lzma.decompress(data)
+    raise IOError("unsupported codec {!r}".format(codec))
+
+
+class _BlobIO(io.RawIOBase):
+
+    """Raw binary stream over an incremental blob handle."""
+
+    def __init__(self, blob):
+        self._blob = blob
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._blob.seek(offset, whence)
+        return self._blob.tell()
+
+    def tell(self):
+        return self._blob.tell()
+
+    def close(self):
+        if not self.closed:
+            self._blob.close()
+        super().close()
+
+
+def _open_blob(cxn, table, rowid, codec):
+    """Return a stream over the 'data' column of the row in the table.
+
+    Raw data is read incrementally if sqlite3 supports blob handles;
+    otherwise the (decompressed) data is read in full.
+
+    """
+    if codec is None and hasattr(cxn, 'blobopen'):
+        blob = cxn.blobopen(table, 'data', rowid, readonly=True)
+        return io.BufferedReader(_BlobIO(blob))
+    data, = cxn.execute('SELECT data FROM {} WHERE rowid=?'.format(table),
+                        [rowid]).fetchone()
+    return io.BytesIO(_decompress(codec, data))
+
+
+# The seconds a connection waits on a locked database by default (that of
+# sqlite3.connect()) and in WAL mode.
+BUSY_TIMEOUT = 5.0
+WAL_BUSY_TIMEOUT = 0.25
+# The number of times a write finding the database locked is retried in WAL
+# mode, and the seconds backed off before the first retry (doubled for every
+# further one, with jitter).
+WRITE_RETRIES = 4
+WRITE_BACKOFF = 0.01
+
+
+def _connect(path, timeout=BUSY_TIMEOUT):
+    """Connect to the database for use by a hook and its importers, waiting
+    up to 'timeout' seconds on locks.
+
+    The connection may be used from other threads (e.g. by importers.aio);
+    SQLite serializes the use of a single connection itself.
+
+    """
+    return sqlite3.connect(path, timeout=timeout,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+
+
+def _use_wal(cxn):
+    """Put the database in WAL mode, returning true if it is in it (a
+    read-only database or one on a filesystem without shared memory cannot
+    be).
+
+    Commits are not synced to disk in WAL mode (synchronous=NORMAL): the
+    database stays consistent, only the last writes can be lost on power
+    failure.
+
+    """
+    try:
+        mode, = cxn.execute('PRAGMA journal_mode=WAL').fetchone()
+    except sqlite3.OperationalError:
+        return False
+    if mode.lower() != 'wal':
+        return False
+    cxn.execute('PRAGMA synchronous=NORMAL')
+    return True
+
+
+def _locked(exc):
+    """Return true if the sqlite3.OperationalError is due to a lock held by
+    another connection."""
+    return 'locked' in str(exc)
+
+
+# Live database states, so that their connections can be replaced in forked
+# child processes.
+_states = weakref.WeakSet()
+# Connections inherited from a parent process. They are never used or closed
+# (closing one could disturb the parent's use of the database) so they are
+# kept alive here.
+_inherited = []
+# id() of an inherited connection -> its replacement, for the current fork.
+_replacements = {}
+
+
+def _reconnect(cxn, db_path, timeout=BUSY_TIMEOUT, wal=False):
+    """Return the connection to use in a forked child process in place of the
+    one inherited from the parent."""
+    try:
+        return _replacements[id(cxn)]
+    except KeyError:
+        new_cxn = _connect(db_path, timeout)
+        if wal:
+            _use_wal(new_cxn)
+        _inherited.append(cxn)
+        _replacements[id(cxn)] = new_cxn
+        return new_cxn
+
+
+def _after_fork_in_child():
+    """Point every importer at a connection of the child's own.
+
+    This runs after importers.abc has had the hooks reopen their archives so
+    that importers and hooks end up sharing the same new connections. A
+    database which can no longer be connected to is left to be reopened
+    through the hook when used.
+
+    """
+    for state in list(_states):
+        if state._archive is not None:
+            try:
+                state.archive = _reconnect(state._archive, state.path)
+            except sqlite3.Error:
+                state.detach()
+    _replacements.clear()
+
+
+class _DBState(importers_abc.ArchiveState):
+
+    """State shared by all importers for the same open database."""
+
+    __slots__ = ('prefix', 'columns', 'in_batch', 'index', 'has_graph',
+                 'prefetched')
+
+    def __init__(self, cxn, db_path):
+        super().__init__(cxn, db_path)
+        self.prefix = ArchivePrefix(db_path)
+        # The names of the columns of the FS table; None until checked.
+        self.columns = None
+        # Whether writes are part of a transaction opened by batch().
+        self.in_batch = False
+        # The importers.shared.SharedIndex of the database's paths and mtimes
+        # if the hook uses shared indexes; dropped for good once data is
+        # written.
+        self.index = None
+        # Whether the database has an Imports table (see importers.graph);
+        # None until checked.
+        self.has_graph = None
+        # Path -> data read ahead by Importer._prefetch().
+        self.prefetched = {}
+        _states.add(self)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _database_key(db_path):
+    """Return the key of the database's shared index: the key of the file
+    (see importers.shared.file_key()) with the mtime and size covering its
+    write-ahead log, which commits go to in WAL mode, leaving the database
+    file unchanged until a checkpoint."""
+    dev, ino, mtime, size = shared.file_key(os.stat(db_path))
+    try:
+        wal = os.stat(db_path + '-wal')
+    except OSError:
+        return dev, ino, mtime, size
+    return dev, ino, max(mtime, wal.st_mtime_ns), size + wal.st_size
+
+
+def _columns(cxn):
+    """Return the set of the names of the columns of the FS table."""
+    return frozenset(row[1] for row in cxn.execute('PRAGMA table_info(FS)'))
+
+
+def _has_codec_column(cxn):
+    """Return true if the FS table has a codec column."""
+    return 'codec' in _columns(cxn)
+
+
+def add_codec_column(cxn):
+    """Add the codec column to the FS table if it is not already there."""
+    with cxn:
+        if not _has_codec_column(cxn):
+            cxn.execute('ALTER TABLE FS ADD COLUMN codec TEXT')
+
+
+def hash_source(data):
+    """Return the hash stored in the source_hash column for the source."""
+    return hashlib.sha256(data).hexdigest()
+
+
+@contextlib.contextmanager
+def _transaction(cxn):
+    """Run the block in a transaction committed if it succeeds, schema changes
+    included (the sqlite3 module only begins transactions itself before
+    INSERT, UPDATE, DELETE and REPLACE statements)."""
+    with cxn:
+        if not cxn.in_transaction:
+            cxn.execute('BEGIN')
+        yield
+
+
+def add_hash_column(cxn):
+    """Add the source_hash column to the FS table if it is not already there,
+    returning the number of source rows hashed.
+
+    Existing bytecode is left without a hash, so it is compiled again the
+    first time it is used. The migration is a single transaction.
+
+    """
+    with _transaction(cxn):
+        columns = _columns(cxn)
+        if 'source_hash' in columns:
+            return 0
+        cxn.execute('ALTER TABLE FS ADD COLUMN source_hash TEXT')
+        codec = 'codec' if 'codec' in columns else 'NULL'
+        hashes = []
+        for path, row_codec, data in cxn.execute(
+                'SELECT path, {}, data FROM FS'.format(codec)).fetchall():
+            if _KINDS.get(os.path.splitext(path)[1]) == 'source':
+                hashes.append((hash_source(_decompress(row_codec, data)),
+                               path))
+        cxn.executemany('UPDATE FS SET source_hash=? WHERE path=?', hashes)
+        return len(hashes)
+
+
+_SOURCE_SUFFIXES = [x[0] for x in imp.get_suffixes() if x[2] == imp.PY_SOURCE]
+_BYTECODE_SUFFIXES = [x[0] for x in imp.get_suffixes()
+                        if x[2] == imp.PY_COMPILED]
+_KINDS = dict([(suffix, 'source') for suffix in _SOURCE_SUFFIXES] +
+              [(suffix, 'bytecode') for suffix in _BYTECODE_SUFFIXES])
+# The most paths read by one query when prefetching.
+_PREFETCH_BATCH = 500
+
+
+def _batched(read, cxn, paths):
+    """Yield what read(cxn, paths) yields for the paths, a batch at a time to
+    stay within SQLITE_MAX_VARIABLE_NUMBER of older versions."""
+    for start in range(0, len(paths), _PREFETCH_BATCH):
+        yield from read(cxn, paths[start:start + _PREFETCH_BATCH])
+
+
+def _up_to_date(bytecode, source_mtime, source_hash):
+    """Return true if the bytecode is for this interpreter and, unless it
+    was matched to its source by 'source_hash', not older than source last
+    modified at 'source_mtime', as get_code() checks."""
+    if bytecode[:4] != imp.get_magic():
+        return False
+    return (source_hash is not None or not source_mtime or
+            int.from_bytes(bytecode[4:8], 'little') >= source_mtime)
+
+
+def optimization_tag(optimize=None):
+    """Return the tag put before the suffix of bytecode compiled at the
+    optimization level (sys.flags.optimize if None): '' for level 0, else
+    '.opt-<level>'."""
+    if optimize is None:
+        optimize = sys.flags.optimize
+    return '.opt-{}'.format(optimize) if optimize else ''
+
+
+def bytecode_suffixes(optimize=None):
+    """Return the suffixes of bytecode compiled at the optimization level (see
+    optimization_tag()), in the order of imp.get_suffixes()."""
+    tag = optimization_tag(optimize)
+    return [tag + suffix for suffix in _BYTECODE_SUFFIXES]
+
+
+def module_columns(path):
+    """Return the values of the module_dir, stem, kind and is_package columns
+    for the relative, OS-neutral path.
+
+    The kind of bytecode compiled with optimizations is 'bytecode' followed
+    by its optimization tag (e.g. 'bytecode.opt-2' for 'module.opt-2.pyc',
+    whose stem is 'module').
+
+    """
+    module_dir, _, name = path.rpartition('/')
+    stem, ext = os.path.splitext(name)
+    kind = _KINDS.get(ext)
+    if kind == 'bytecode':
+        stem, optimize = split_optimization_tag(stem + ext)
+        kind += optimization_tag(optimize)
+    return module_dir, stem, kind, int(kind is not None and
+                                       stem == '__init__')
+
+
+def _module_index_columns(cxn):
+    """Return the list of the columns of the FS_module index."""
+    return [row[2] for row in cxn.execute("PRAGMA index_info('FS_module')")]
+
+
+def add_module_columns(cxn):
+    """Rebuild the FS table into the layout of indexed_sql_creation if it is
+    not already in it, returning the number of rows migrated. A table which
+    has the module columns but not the covering FS_module index only has the
+    index rebuilt. The migration is a single transaction."""
+    with _transaction(cxn):
+        columns = _columns(cxn)
+        if 'module_dir' in columns:
+            if 'path' not in _module_index_columns(cxn):
+                cxn.execute('DROP INDEX IF EXISTS FS_module')
+                cxn.execute(indexed_sql_creation.split(';')[1])
+            return 0
+        codec = 'codec' if 'codec' in columns else 'NULL'
+        cxn.execute('ALTER TABLE FS RENAME TO FS_old')
+        for statement in indexed_sql_creation.split(';'):
+            if statement.strip():
+                cxn.execute(statement)
+        rows = cxn.execute('SELECT path, mtime, data, {} FROM FS_old'.format(
+                                codec)).fetchall()
+        cxn.executemany('INSERT INTO FS VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (row + module_columns(row[0]) for row in rows))
+        if 'source_hash' in columns:
+            cxn.execute('ALTER TABLE FS ADD COLUMN source_hash TEXT')
+            cxn.execute("""UPDATE FS SET source_hash=
+                            (SELECT source_hash FROM FS_old
+                             WHERE FS_old.path=FS.path)""")
+        cxn.execute('DROP TABLE FS_old')
+        return len(rows)
+
+
+def _has_tables(cxn, *names):
+    """Return true if all of the tables exist in the database."""
+    cursor = cxn.execute("""SELECT count(*) FROM sqlite_master
+                            WHERE type='table' AND name IN ({})""".format(
+                                ', '.join('?' * len(names))),
+                         names)
+    return cursor.fetchone()[0] == len(names)
 
 
 class Hook(importers_abc.ArchiveHook):
 
-    """Archive hook for sqlite3 databases"""
+    """Archive hook for sqlite3 databases.
+
+    The codec and compression level are passed on to the importers for
+    compressing the data they write. See importers.abc.ArchiveHook for
+    'check_interval' and 'max_archives'.
+
+    If 'wal' is true, databases are put in WAL mode when opened and the
+    importers write as described in the module docstring. Connections wait
+    'busy_timeout' seconds on locks (WAL_BUSY_TIMEOUT in WAL mode and
+    BUSY_TIMEOUT otherwise if None).
+
+    """
+
+    # The table holding the paths and mtimes of the files.
+    _table = 'FS'
+
+    def __init__(self, codec=None, level=None, check_interval=None,
+                 max_archives=None, extension_cache=None, shared_index=None,
+                 wal=False, busy_timeout=None):
+        """Record the codec and compression level to use for written
+        data and how to handle other processes writing."""
+        super().__init__(check_interval, max_archives, extension_cache,
+                         shared_index)
+        self._codec = codec
+        self._level = level
+        self._wal = wal
+        if busy_timeout is None:
+            busy_timeout = WAL_BUSY_TIMEOUT if wal else BUSY_TIMEOUT
+        self._busy_timeout = busy_timeout
 
     def open(self, path):
         """Verify that a path points to a sqlite3 database."""
-        cxn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        cxn = _connect(path, self._busy_timeout)
         try:
             with cxn:
                 cursor = cxn.execute("""SELECT name FROM sqlite_master
                                         WHERE type='table' and name='FS'""")
                 if len(list(cursor)) == 1:
                     # XXX Verify table structure?
+                    if self._wal:
+                        _use_wal(cxn)
                     return cxn
                 else:
                     raise ValueError
         except sqlite3.DatabaseError:
             raise ValueError  # Path is not a sqlite3 file.
 
+    def signature(self, path, archive):
+        """Return the device and inode of the database file along with its
+        data version.
+
+        The data version only changes when another connection commits,
+        including in WAL mode where the database file itself is not written
+        to before a checkpoint, so the importers' own writes do not make the
+        database look changed.
+
+        """
+        stat = os.stat(path)
+        try:
+            version, = archive.execute('PRAGMA data_version').fetchone()
+        except sqlite3.Error:
+            raise ValueError  # Locked by another process.
+        return stat.st_dev, stat.st_ino, version
+
+    def _shared_state(self, archive, archive_path):
+        """Return the shared state for the database, created with the shared
+        index of its paths if the hook uses shared indexes.
+
+        The index is not rebuilt once the importers drop it after writing:
+        the database is then queried (and reopened with a new index only if
+        the hook finds that another process changed it).
+
+        """
+        return self.shared_state(archive, archive_path, self._new_state)
+
+    def _new_state(self, archive, archive_path):
+        """Return a new state for the database (see _shared_state())."""
+        state = _DBState(archive, archive_path)
+        if self.shared_index is not None:
+            def entries():
+                return [(path, mtime, 0, 0, 0, 0, 0, 0) for path, mtime in
+                        archive.execute('SELECT path, mtime FROM {}'.format(
+                                            self._table))]
+            state.index = self.shared_index.get(_database_key(archive_path),
+                                                entries)
+        return state
+
     def finder(self, archive, archive_path, location):
         """Return a sqlite3 importer."""
-        return Importer(archive, archive_path, location)
+        return Importer(archive, archive_path, location, codec=self._codec,
+                        level=self._level,
+                        state=self._shared_state(archive, archive_path),
+                        wal=self._wal)
+
+    def reopen(self, path, archive):
+        """Connect to the database again; the inherited connection is left
+        untouched."""
+        try:
+            return _reconnect(archive, path, self._busy_timeout, self._wal)
+        except sqlite3.Error:
+            raise ValueError  # The database is gone.
+
+    def paths(self, archive):
+        """Return every path in the FS table."""
+        return [row[0] for row in archive.execute('SELECT path FROM FS')]
 
 
 class Importer(importers_abc.PyFileFinder, importers_abc.PyPycFileLoader):
 
-    """Importer for sqlite3 databases."""
+    """Importer for sqlite3 databases.
+
+    If the FS table has a codec column then data is decompressed as needed
+    and written data is compressed with 'codec' at 'level'.
+
+    The connection and database path are kept in a state object which the
+    hook shares between all importers for the same database ('state').
+
+    If 'wal' is true the database is expected to be in WAL mode and written
+    to concurrently by other processes (see write_data()).
 
-    def __init__(self, db, db_path, location):
+    """
+
+    def __init__(self, db, db_path, location, codec=None, level=None,
+                 state=None, wal=False):
         super().__init__(os.path.join(db_path, location))
-        self._cxn = db
-        self._db_path = db_path
+        self._state = state if state is not None else _DBState(db, db_path)
+        self._codec = codec
+        self._level = level
+        self._wal = wal
+        # Module name -> (source path, source mtime, bytecode path,
+        # is package) as found by find_module() for load_module(). Only the
+        # copy find_module() returns as the loader holds an entry, so nothing
+        # found outlives that loader.
+        self._resolved = {}
+
+    def _columns(self):
+        """Return the (cached) names of the columns of the FS table."""
+        state = self._state
+        if state.columns is None:
+            state.columns = _columns(state.archive)
+        return state.columns
+
+    def _compressed(self):
+        """Return true if the FS table has the codec column."""
+        return 'codec' in self._columns()
+
+    def _indexed(self):
+        """Return true if the FS table has the module columns."""
+        return 'module_dir' in self._columns()
+
+    def _hashed(self):
+        """Return true if the FS table has the source_hash column."""
+        return 'source_hash' in self._columns()
+
+    def _resolve(self, fullname):
+        """Find the source and bytecode for the module with a single query,
+        returning what is stored in self._resolved or None if neither
+        exists."""
+        state = self._state
+        try:
+            directory = state.prefix.relative(self.location).rstrip('/')
+        except ValueError:
+            return None
+        tail = fullname.rpartition('.')[2]
+        package_dir = directory + '/' + tail if directory else tail
+        bytecode_kind = 'bytecode' + optimization_tag()
+        with state.archive as cxn:
+            rows = cxn.execute("""SELECT path, mtime, kind, is_package FROM FS
+                                  WHERE kind IN ('source', 'bytecode', ?) AND
+                                    ((module_dir=? AND stem=?) OR
+                                     (module_dir=? AND stem='__init__'))""",
+                               [bytecode_kind, directory, tail,
+                                package_dir]).fetchall()
+        found = {}
+        for path, mtime, kind, is_package in rows:
+            suffixes = (_SOURCE_SUFFIXES if kind == 'source'
+                            else _BYTECODE_SUFFIXES)
+            ext = os.path.splitext(path)[1]
+            if ext not in suffixes:
+                continue
+            # Packages come first, then the order of imp.get_suffixes().
+            rank = (not is_package, suffixes.index(ext))
+            if kind not in found or rank < found[kind][0]:
+                found[kind] = rank, path, mtime, bool(is_package)
+        if not found:
+            return None
+        source = found.get('source')
+        bytecode = found.get(bytecode_kind)
+        if bytecode is None and source is None:
+            # Modules without source use whatever bytecode there is.
+            bytecode = found.get('bytecode')
+        return (source and os.path.join(state.path, source[1]),
+                source and source[2],
+                bytecode and os.path.join(state.path, bytecode[1]),
+                (source or bytecode)[3])
+
+    def find_module(self, fullname):
+        """Find the module, with a single query if the FS table has the
+        module columns.
+
+        With a single query the loader returned is a copy of the importer
+        holding what was found for load_module(), which forgets it once the
+        module is loaded.
+
+        """
+        if not self._indexed() or self._state.index is not None:
+            return super().find_module(fullname)
+        loader = self._find_extension(fullname)
+        if loader is not None:
+            return loader
+        resolved = self._resolve(fullname)
+        if resolved is None:
+            return None
+        loader = copy.copy(self)
+        loader._resolved = {fullname: resolved}
+        return loader
+
+    def _read_paths(self, cxn, paths):
+        """Yield (path, data) for those of the paths which exist with a single
+        query."""
+        query = 'SELECT path, {}, data FROM FS WHERE path IN ({})'.format(
+                    'codec' if self._compressed() else 'NULL',
+                    ', '.join('?' * len(paths)))
+        for path, codec, data in cxn.execute(query, paths):
+            yield path, _decompress(codec, data)
+
+    def _read_details(self, cxn, paths):
+        """Yield (path, (mtime, source_hash)) for those of the paths which
+        exist with a single query, without reading their data."""
+        query = 'SELECT path, mtime, {} FROM FS WHERE path IN ({})'.format(
+                    'source_hash' if self._hashed() else 'NULL',
+                    ', '.join('?' * len(paths)))
+        for path, mtime, source_hash in cxn.execute(query, paths):
+            yield path, (mtime, source_hash)
+
+    def _prefetch(self, fullname):
+        """Read the data of the module's dependencies which are not imported
+        yet for get_data() to return, if the database has an import graph,
+        returning the paths read.
+
+        The bytecode of a dependency is read if it is up-to-date (as checked
+        by get_code()) and its source otherwise, with a query for the details
+        of the paths and one for each kind of data read.
+
+        """
+        state = self._state
+        with state.archive as cxn:
+            if state.has_graph is None:
+                state.has_graph = bool(cxn.execute(
+                                    'PRAGMA table_info(Imports)').fetchall())
+            if not state.has_graph:
+                return []
+            rows = cxn.execute('SELECT dependency, path FROM Imports '
+                               'WHERE module=?', [fullname]).fetchall()
+            candidates = []
+            paths = []
+            for dependency, path in rows:
+                sources = [path + suffix for suffix in _SOURCE_SUFFIXES]
+                compiled = [path + suffix for suffix in bytecode_suffixes()]
+                if dependency in sys.modules or any(
+                        candidate in state.prefetched
+                        for candidate in sources + compiled):
+                    continue
+                candidates.append((sources, compiled))
+                paths.extend(sources + compiled)
+            details = dict(_batched(self._read_details, cxn, paths))
+            found = []
+            for sources, compiled in candidates:
+                source = next((path for path in sources if path in details),
+                              None)
+                bytecode = next((path for path in compiled
+                                    if path in details), None)
+                if (source is not None and bytecode is not None and
+                        details[source][1] is not None and
+                        details[bytecode][1] != details[source][1]):
+                    # Compiled from other source.
+                    bytecode = None
+                found.append((source, bytecode))
+            read = dict(_batched(self._read_paths, cxn,
+                                 [bytecode for source, bytecode in found
+                                    if bytecode is not None]))
+            prefetched = {}
+            stale = []
+            for source, bytecode in found:
+                data = read.get(bytecode)
+                if data is not None and (source is None or _up_to_date(
+                                            data, *details[source])):
+                    prefetched[bytecode] = data
+                elif source is not None:
+                    stale.append(source)
+            prefetched.update(_batched(self._read_paths, cxn, stale))
+        state.prefetched.update(prefetched)
+        return list(prefetched)
+
+    def load_module(self, fullname):
+        """Load the module, using what find_module() found, after
+        prefetching its dependencies.
+
+        Prefetched data the module did not import is dropped once it is
+        loaded.
+
+        """
+        prefetched = self._prefetch(fullname)
+        try:
+            return super().load_module(fullname)
+        finally:
+            self.forget(fullname)
+            for path in prefetched:
+                self._state.prefetched.pop(path, None)
+
+    def forget(self, fullname):
+        """Drop what find_module() found for the module, for callers which
+        complete its import themselves (see importers.aio)."""
+        self._resolved.pop(fullname, None)
+
+    def source_path(self, fullname):
+        resolved = self._resolved.get(fullname)
+        if resolved is None:
+            return super().source_path(fullname)
+        return resolved[0]
+
+    def bytecode_path(self, fullname):
+        """Return the path of the bytecode for the interpreter's optimization
+        level, falling back to unoptimized bytecode for modules without
+        source."""
+        resolved = self._resolved.get(fullname)
+        if resolved is not None:
+            return resolved[2]
+        path = importers_abc._suffix_search(self.location, fullname,
+                                            self.file_exists,
+                                            bytecode_suffixes())
+        if (path is None and sys.flags.optimize and
+                self.source_path(fullname) is None):
+            # Modules without source use whatever bytecode there is.
+            path = super().bytecode_path(fullname)
+        return path
+
+    def write_bytecode(self, fullname, data):
+        """Write the bytecode under the suffix for the interpreter's
+        optimization level."""
+        bytecode_path = self.bytecode_path(fullname)
+        if bytecode_path is None:
+            source_path = self.source_path(fullname)
+            if source_path is None:
+                raise ImportError("cannot find a path to {}".format(fullname))
+            bytecode_path = (os.path.splitext(source_path)[0] +
+                             bytecode_suffixes()[0])
+        return self.write_data(bytecode_path, data)
+
+    def source_mtime(self, fullname):
+        resolved = self._resolved.get(fullname)
+        if resolved is None or resolved[0] is None:
+            return super().source_mtime(fullname)
+        return resolved[1]
+
+    def is_package(self, fullname):
+        resolved = self._resolved.get(fullname)
+        if resolved is None:
+            return super().is_package(fullname)
+        return resolved[3]
+
+    def _stored_hash(self, path):
+        """Return the source_hash stored for the absolute path (None if there
+        is none)."""
+        state = self._state
+        with state.archive as cxn:
+            row = cxn.execute('SELECT source_hash FROM FS WHERE path=?',
+                              [state.prefix.relative(path)]).fetchone()
+        return row[0] if row else None
+
+    def get_code(self, fullname):
+        """Return the code object for the module.
+
+        If the FS table has the source_hash column, bytecode is used when it
+        was compiled from source with the same hash as the stored source,
+        regardless of mtimes; newly compiled bytecode is stored with the hash
+        of its source. Otherwise (or for source without a stored hash) the
+        mtimes are compared.
+
+        """
+        if not self._hashed():
+            return super().get_code(fullname)
+        source_path = self.source_path(fullname)
+        if source_path is None:
+            return super().get_code(fullname)
+        expected_hash = self._stored_hash(source_path)
+        if expected_hash is None:
+            return super().get_code(fullname)
+        bytecode_path = self.bytecode_path(fullname)
+        if (bytecode_path is not None and
+                self._stored_hash(bytecode_path) == expected_hash):
+            data = self.get_data(bytecode_path)
+            if data[:4] == imp.get_magic():
+                return marshal.loads(data[8:])
+        # Compiled as source-only loaders do, so that the code does not
+        # depend on whether the table has the source_hash column.
+        code = importlib.abc.PyLoader.get_code(self, fullname)
+        if not sys.dont_write_bytecode:
+            if bytecode_path is None:
+                bytecode_path = (os.path.splitext(source_path)[0] +
+                                 bytecode_suffixes()[0])
+            data = bytearray(imp.get_magic())
+            data.extend((self.source_mtime(fullname) & 0xFFFFFFFF).to_bytes(
+                            4, 'little'))
+            data.extend(marshal.dumps(code))
+            self.write_data(bytecode_path, bytes(data), expected_hash)
+        return code
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Make all data written to the database within the block (by any
+        importer sharing this importer's state) a single transaction."""
+        state = self._state
+        if state.in_batch:
+            yield
+            return
+        state.in_batch = True
+        try:
+            with state.archive:
+                yield
+        finally:
+            state.in_batch = False
+
+    def _writing(self):
+        """Return the context manager to write to the database in."""
+        state = self._state
+        if state.in_batch:
+            return contextlib.nullcontext(state.archive)
+        return state.archive
+
+    def _bytecode_stored(self, cxn, path, data, source_hash):
+        """Return true if bytecode compiled from the same source as 'data'
+        (with the same magic number and source mtime and, if the FS table has
+        the source_hash column, source hash) is stored at the relative
+        path."""
+        stored = dict(self._read_paths(cxn, [path])).get(path)
+        if stored is None or stored[:8] != data[:8]:
+            return False
+        if not self._hashed():
+            return True
+        row = cxn.execute('SELECT source_hash FROM FS WHERE path=?',
+                          [path]).fetchone()
+        return row[0] == source_hash
+
+    def _write(self, path, data, source_hash, write):
+        """Call write() with the connection to store the data at the relative
+        path in a transaction, returning whether it was written.
+
+        In WAL mode bytecode which another process already stored for the
+        same source is not written, and a write finding the database locked
+        is retried up to WRITE_RETRIES times, backing off exponentially from
+        WRITE_BACKOFF seconds; bytecode is then given up on while other data
+        raises the sqlite3.OperationalError. Writes within batch() are never
+        retried.
+
+        """
+        state = self._state
+        if not self._wal or state.in_batch:
+            with self._writing() as cxn:
+                write(cxn)
+            return True
+        is_bytecode = _KINDS.get(os.path.splitext(path)[1]) == 'bytecode'
+        delay = WRITE_BACKOFF
+        for attempt in range(WRITE_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(delay / 2, delay))
+                delay *= 2
+            try:
+                with state.archive as cxn:
+                    if is_bytecode and self._bytecode_stored(cxn, path, data,
+                                                             source_hash):
+                        return False
+                    write(cxn)
+                return True
+            except sqlite3.OperationalError as exc:
+                if not _locked(exc):
+                    raise
+                error = exc
+        if is_bytecode:
+            return False
+        raise error
 
     def loader(self, *args, **kwargs):
         return self
 
+    def _paths_below(self, table):
+        """Return the paths below the location in the table with a single
+        range query on its path index."""
+        state = self._state
+        try:
+            directory = state.prefix.relative(os.path.join(self.location, ''))
+        except ValueError:
+            return []
+        if state.index is not None:
+            start = len(directory)
+            return [path[start:] for path in state.index.paths(directory)]
+        query = 'SELECT path FROM {}'.format(table)
+        with state.archive as cxn:
+            if not directory:
+                cursor = cxn.execute(query)
+            else:
+                # Every path starting with 'directory/' sorts before
+                # 'directory0' ('0' follows '/').
+                cursor = cxn.execute(query + ' WHERE path >= ? AND path < ?',
+                                     [directory, directory[:-1] + '0'])
+            start = len(directory)
+            return [row[0][start:] for row in cursor]
+
+    def location_paths(self):
+        return self._paths_below('FS')
+
     def file_exists(self, path):
+        state = self._state
         try:
-            path = remove_file(self._db_path, path)
+            path = state.prefix.relative(path)
         except ValueError:
             return False
-        path = _neutralpath(path)
-        with self._cxn:
-            cursor = self._cxn.execute('SELECT path FROM FS WHERE path=?',
-                                        [path])
+        if state.index is not None:
+            return state.index.find(path) is not None
+        with state.archive as cxn:
+            cursor = cxn.execute('SELECT path FROM FS WHERE path=?', [path])
             return bool(cursor.fetchone())
 
+    def _data_path(self, path):
+        """Return the neutral path in the database for a path passed to
+        get_data()."""
+        if os.path.isabs(path):
+            try:
+                return self._state.prefix.relative(path)
+            except ValueError:
+                raise IOError("{} not pointing to {}".format(path,
+                                                            self._state.path))
+        return neutral_path(path)
+
     def get_data(self, path):
         """Return data for the path.
 
@@ -85,36 +1031,298 @@ class Importer(importers_abc.PyFileFinder, importers_abc.PyPycFileLoader):
         database.
 
         """
-        if os.path.isabs(path):
-            if not path.startswith(self._db_path + os.sep):
-                raise IOError("{} not pointing to {}".format(path,
-                                                             self._db_path))
-            path = path[len(self._db_path)+1:]
-        path = _neutralpath(path)
-        with self._cxn:
-            cursor = self._cxn.execute('SELECT data FROM FS WHERE path=?',
+        path = self._data_path(path)
+        data = self._state.prefetched.pop(path, None)
+        if data is not None:
+            return data
+        with self._state.archive as cxn:
+            if self._compressed():
+                cursor = cxn.execute('SELECT codec, data FROM FS WHERE path=?',
                                         [path])
+                result = cursor.fetchone()
+                if result:
+                    return _decompress(*result)
+            else:
+                cursor = cxn.execute('SELECT data FROM FS WHERE path=?',
+                                        [path])
+                result = cursor.fetchone()
+                if result:
+                    return result[0]
+        # Fall-through failure case.
+        raise IOError("the path {!r} does not exist".format(path))
+
+    def open_data(self, path):
+        """Return a file-like object for the data of the path.
+
+        Raw data is read incrementally through a blob handle
+        (Connection.blobopen(), Python 3.11+) so that large resources are not
+        read into memory in one go. Compressed rows and older versions of
+        Python read the data in full.
+
+        """
+        path = self._data_path(path)
+        query = 'SELECT rowid, {} FROM FS WHERE path=?'.format(
+                    'codec' if self._compressed() else 'NULL')
+        with self._state.archive as cxn:
+            row = cxn.execute(query, [path]).fetchone()
+            if row is None:
+                raise IOError("the path {!r} does not exist".format(path))
+            return _open_blob(cxn, 'FS', *row)
+
+    def path_mtime(self, path):
+        """Return the modification time for the path."""
+        state = self._state
+        path = state.prefix.relative(path)
+        if state.index is not None:
+            entry = state.index.find(path)
+            if entry is None:
+                raise IOError("{} does not exist".format(path))
+            return entry[0]
+        with state.archive as cxn:
+            cursor = cxn.execute('SELECT mtime FROM FS WHERE path=?', [path])
+            result = cursor.fetchone()
+            if not result:
+                raise IOError("{} does not exist".format(path))
+            return result[0]
+
+    def write_data(self, path, data, source_hash=None):
+        """Write the data to the path, returning whether it was written (see
+        _write() for WAL mode).
+
+        If the FS table has the source_hash column then source is stored with
+        its hash and bytecode with 'source_hash', the hash of the source it
+        was compiled from.
+
+        """
+        state = self._state
+        path = state.prefix.relative(path)
+        columns = ['path', 'mtime', 'data']
+        values = [path, int(time.time()), data]
+        if self._compressed():
+            values[2] = _compress(data, self._codec, self._level)
+            columns.append('codec')
+            values.append(self._codec)
+        if self._indexed():
+            columns.extend(['module_dir', 'stem', 'kind', 'is_package'])
+            values.extend(module_columns(path))
+        if self._hashed():
+            if _KINDS.get(os.path.splitext(path)[1]) == 'source':
+                source_hash = hash_source(data)
+            columns.append('source_hash')
+            values.append(source_hash)
+        def write(cxn):
+            cxn.execute('INSERT OR REPLACE INTO FS ({}) VALUES ({})'.format(
+                            ', '.join(columns), ', '.join('?' * len(columns))),
+                        values)
+        state.prefetched.pop(path, None)
+        if not self._write(path, data, source_hash, write):
+            return False
+        # The shared index no longer describes the database.
+        state.index = None
+        return True
+
+
+class DedupHook(Hook):
+
+    """Archive hook for sqlite3 databases using the content-addressed
+    layout."""
+
+    _table = 'Paths'
+
+    def open(self, path):
+        """Verify that a path points to a content-addressed sqlite3
+        database."""
+        cxn = _connect(path, self._busy_timeout)
+        try:
+            with cxn:
+                if _has_tables(cxn, 'Paths', 'Blobs'):
+                    if self._wal:
+                        _use_wal(cxn)
+                    return cxn
+                else:
+                    raise ValueError
+        except sqlite3.DatabaseError:
+            raise ValueError  # Path is not a sqlite3 file.
+
+    def finder(self, archive, archive_path, location):
+        """Return a content-addressed sqlite3 importer."""
+        return DedupImporter(archive, archive_path, location,
+                             codec=self._codec, level=self._level,
+                             state=self._shared_state(archive, archive_path),
+                             wal=self._wal)
+
+    def paths(self, archive):
+        """Return every path in the Paths table."""
+        return [row[0] for row in archive.execute('SELECT path FROM Paths')]
+
+
+class DedupImporter(Importer):
+
+    """Importer for sqlite3 databases using the content-addressed layout.
+
+    Written data is compressed with 'codec' at 'level'; blobs already stored
+    under the same hash are not written again.
+
+    """
+
+    def location_paths(self):
+        return self._paths_below('Paths')
+
+    def file_exists(self, path):
+        state = self._state
+        try:
+            path = state.prefix.relative(path)
+        except ValueError:
+            return False
+        if state.index is not None:
+            return state.index.find(path) is not None
+        with state.archive as cxn:
+            cursor = cxn.execute('SELECT 1 FROM Paths WHERE path=?', [path])
+            return bool(cursor.fetchone())
+
+    def get_data(self, path):
+        """Return the (decompressed) data for the path.
+
+        If the path is relative it is assumed to be anchored to the root of the
+        database.
+
+        """
+        path = self._data_path(path)
+        data = self._state.prefetched.pop(path, None)
+        if data is not None:
+            return data
+        with self._state.archive as cxn:
+            cursor = cxn.execute("""SELECT codec, data FROM Paths
+                                    JOIN Blobs USING (hash)
+                                    WHERE path=?""",
+                                 [path])
             result = cursor.fetchone()
             if result:
-                return result[0]
+                return _decompress(*result)
         # Fall-through failure case.
         raise IOError("the path {!r} does not exist".format(path))
 
+    def open_data(self, path):
+        """Return a file-like object for the data of the path, reading raw
+        blobs incrementally."""
+        path = self._data_path(path)
+        with self._state.archive as cxn:
+            row = cxn.execute("""SELECT Blobs.rowid, codec FROM Paths
+                                 JOIN Blobs USING (hash) WHERE path=?""",
+                              [path]).fetchone()
+            if row is None:
+                raise IOError("the path {!r} does not exist".format(path))
+            return _open_blob(cxn, 'Blobs', *row)
+
     def path_mtime(self, path):
         """Return the modification time for the path."""
-        path = _neutralpath(remove_file(self._db_path, path))
-        with self._cxn:
-            cursor = self._cxn.execute('SELECT mtime FROM FS WHERE path=?',
-                                        [path])
+        state = self._state
+        path = state.prefix.relative(path)
+        if state.index is not None:
+            entry = state.index.find(path)
+            if entry is None:
+                raise IOError("{} does not exist".format(path))
+            return entry[0]
+        with state.archive as cxn:
+            cursor = cxn.execute('SELECT mtime FROM Paths WHERE path=?',
+                                    [path])
             result = cursor.fetchone()
             if not result:
                 raise IOError("{} does not exist".format(path))
             return result[0]
 
-    def write_data(self, path, data):
-        """Write the data to the path."""
-        path = _neutralpath(remove_file(self._db_path, path))
-        with self._cxn:
-            self._cxn.execute('INSERT OR REPLACE INTO FS VALUES (?, ?, ?)',
-                                [path, int(time.time()), data])
+    def write_data(self, path, data, source_hash=None):
+        """Write the data to the path, only storing the blob if its contents
+        are not already in the database ('source_hash' is ignored)."""
+        state = self._state
+        path = state.prefix.relative(path)
+        def write(cxn):
+            _store(cxn, path, int(time.time()), data, self._codec,
+                   self._level)
+        state.prefetched.pop(path, None)
+        if not self._write(path, data, None, write):
+            return False
+        state.index = None
         return True
+
+    def _read_details(self, cxn, paths):
+        query = 'SELECT path, mtime, NULL FROM Paths WHERE path IN ({})'
+        query = query.format(', '.join('?' * len(paths)))
+        for path, mtime, source_hash in cxn.execute(query, paths):
+            yield path, (mtime, source_hash)
+
+    def _read_paths(self, cxn, paths):
+        query = """SELECT path, codec, data FROM Paths JOIN Blobs USING (hash)
+                   WHERE path IN ({})""".format(', '.join('?' * len(paths)))
+        for path, codec, data in cxn.execute(query, paths):
+            yield path, _decompress(codec, data)
+
+
+def _store(cxn, path, mtime, data, codec=None, level=None):
+    """Store the data for the path in the content-addressed tables."""
+    digest = hashlib.sha256(data).hexdigest()
+    cursor = cxn.execute('SELECT 1 FROM Blobs WHERE hash=?', [digest])
+    if not cursor.fetchone():
+        cxn.execute('INSERT INTO Blobs VALUES (?, ?, ?)',
+                    [digest, codec, _compress(data, codec, level)])
+    cxn.execute('INSERT OR REPLACE INTO Paths VALUES (?, ?, ?)',
+                [path, mtime, digest])
+
+
+def prune_blobs(cxn):
+    """Delete the blobs no longer referenced by any path, returning how many
+    were removed."""
+    with cxn:
+        cursor = cxn.execute("""DELETE FROM Blobs WHERE hash NOT IN
+                                (SELECT hash FROM Paths)""")
+        return cursor.rowcount
+
+
+def migrate_to_dedup(source, destination, codec=None, level=None):
+    """Copy the FS table of the database at the source path into the
+    content-addressed layout of the database at the destination path.
+
+    The destination tables are created if they do not exist. Rows compressed
+    in the source are decompressed and stored compressed with 'codec' at
+    'level' like any other. A pair of the number of paths and the number of
+    distinct blobs in the destination is returned.
+
+    """
+    source_cxn = sqlite3.connect(source)
+    dest_cxn = sqlite3.connect(destination)
+    try:
+        query = 'SELECT path, mtime, {}, data FROM FS'.format(
+                    'codec' if _has_codec_column(source_cxn) else 'NULL')
+        with dest_cxn:
+            if not _has_tables(dest_cxn, 'Paths', 'Blobs'):
+                dest_cxn.executescript(dedup_sql_creation)
+            for path, mtime, row_codec, data in source_cxn.execute(query):
+                _store(dest_cxn, path, mtime,
+                       _decompress(row_codec, bytes(data)), codec, level)
+        paths = dest_cxn.execute('SELECT count(*) FROM Paths').fetchone()[0]
+        blobs = dest_cxn.execute('SELECT count(*) FROM Blobs').fetchone()[0]
+        return paths, blobs
+    finally:
+        source_cxn.close()
+        dest_cxn.close()
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m importers.sqlite3',
+                description='Migrate a database from the FS layout to the '
+                            'content-addressed layout.')
+    parser.add_argument('source', help='database using the FS table')
+    parser.add_argument('destination', help='database to write to')
+    parser.add_argument('--codec', choices=['zlib', 'lzma'], default=None,
+                        help='compress stored blobs')
+    parser.add_argument('--level', type=int, default=None,
+                        help='compression level/preset for the codec')
+    options = parser.parse_args(args)
+    paths, blobs = migrate_to_dedup(options.source, options.destination,
+                                    options.codec, options.level)
+    print('{} paths stored in {} blobs'.format(paths, blobs))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from .. import abc as importers_abc
+import gc
 import os
+import sys
 import tempfile
 from test import support
 import unittest
@@ -9,9 +11,9 @@ class MockArchiveHook(importers_abc.ArchiveHook):
 
     """A mock ArchiveHook implementation."""
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, check_interval=None):
         self._file_path = file_path
-        super().__init__()
+        super().__init__(check_interval)
 
     def open(self, path):
         if path != self._file_path:
@@ -88,6 +90,16 @@ class ArchiveHookTest(unittest.TestCase):
         with self.assertRaises(ImportError):
             hook(self.file_path)
 
+    def test_archive(self):
+        # The archive for a path is opened once and then cached.
+        hook = MockArchiveHook(self.file_path)
+        archive = hook.archive(self.file_path)
+        self.assertEqual(archive, [self.file_path])
+        self.assertIs(hook.archive(self.file_path), archive)
+        self.assertIs(hook(self.file_path)[0], archive)
+        with self.assertRaises(ValueError):
+            hook.archive(os.path.dirname(self.file_path))
+
     def test_relative_path(self):
         # A relative path should be made absolute for passing to the finder.
         self.addCleanup(support.unlink, support.TESTFN)
@@ -100,6 +112,266 @@ class ArchiveHookTest(unittest.TestCase):
         self.assertEqual(finder[1], abs_path)
 
 
+class ArchiveCheckTest(unittest.TestCase):
+
+    """Test change detection in importers.abc.ArchiveHook."""
+
+    def setUp(self):
+        self.file_path = tempfile.mkstemp()[1]
+        self.addCleanup(support.unlink, self.file_path)
+
+    def modify(self):
+        with open(self.file_path, 'a') as file:
+            file.write('more data')
+
+    def test_no_interval(self):
+        # Without an interval archives are never checked.
+        hook = MockArchiveHook(self.file_path)
+        archive = hook.archive(self.file_path)
+        self.modify()
+        self.assertEqual(hook.check(), [])
+        self.assertIs(hook.archive(self.file_path), archive)
+
+    def test_unchanged(self):
+        # An unchanged archive is kept.
+        hook = MockArchiveHook(self.file_path, check_interval=0)
+        archive = hook.archive(self.file_path)
+        self.assertEqual(hook.check(), [])
+        self.assertIs(hook.archive(self.file_path), archive)
+
+    def test_changed(self):
+        # A modified archive is reopened and dependent caches are dropped.
+        hook = MockArchiveHook(self.file_path, check_interval=0)
+        archive = hook.archive(self.file_path)
+        changed = []
+        hook.add_listener(lambda *args: changed.append(args))
+        entry = os.path.join(self.file_path, 'pkg')
+        sys.path_importer_cache[entry] = None
+        self.addCleanup(sys.path_importer_cache.pop, entry, None)
+        self.modify()
+        self.assertEqual(hook.check(), [self.file_path])
+        self.assertIsNot(hook.archive(self.file_path), archive)
+        self.assertEqual(changed, [(hook, self.file_path, 'reopened')])
+        self.assertNotIn(entry, sys.path_importer_cache)
+
+    def test_changed_through_call(self):
+        # Using the hook checks the archive.
+        hook = MockArchiveHook(self.file_path, check_interval=0)
+        archive = hook(self.file_path)[0]
+        self.modify()
+        self.assertIsNot(hook(self.file_path)[0], archive)
+
+    def test_interval(self):
+        # Archives are not checked more often than the interval.
+        hook = MockArchiveHook(self.file_path, check_interval=3600)
+        archive = hook.archive(self.file_path)
+        self.modify()
+        self.assertEqual(hook.check(), [])
+        self.assertIs(hook.archive(self.file_path), archive)
+
+    def test_missing_file(self):
+        # An archive in the middle of being replaced is kept.
+        hook = MockArchiveHook(self.file_path, check_interval=0)
+        archive = hook.archive(self.file_path)
+        os.unlink(self.file_path)
+        self.assertEqual(hook.check(), [])
+        self.assertIs(hook._archives[self.file_path], archive)
+
+
+class MockArchive:
+
+    """An archive which records being closed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ClosingArchiveHook(importers_abc.ArchiveHook):
+
+    """An ArchiveHook whose archives can be closed."""
+
+    def open(self, path):
+        return MockArchive(path)
+
+    def finder(self, *args):
+        return args
+
+
+class MockFinder:
+
+    """A finder holding the shared state of its archive."""
+
+    def __init__(self, state):
+        self._state = state
+
+
+class StateArchiveHook(ClosingArchiveHook):
+
+    """A ClosingArchiveHook whose finders share a state."""
+
+    def finder(self, archive, archive_path, location):
+        return MockFinder(self.shared_state(archive, archive_path,
+                                            importers_abc.ArchiveState))
+
+
+class ArchiveCacheTest(unittest.TestCase):
+
+    """Test the bounded cache of importers.abc.ArchiveHook."""
+
+    def setUp(self):
+        self.paths = []
+        for _ in range(3):
+            path = tempfile.mkstemp()[1]
+            self.addCleanup(support.unlink, path)
+            self.paths.append(path)
+
+    def test_close(self):
+        # close() closes every archive and empties the cache.
+        hook = ClosingArchiveHook()
+        archives = [hook.archive(path) for path in self.paths]
+        hook.close()
+        self.assertTrue(all(archive.closed for archive in archives))
+        self.assertEqual(len(hook._archives), 0)
+
+    def test_context_manager(self):
+        # Leaving the with statement closes the archives.
+        with ClosingArchiveHook() as hook:
+            archive = hook(self.paths[0])[0]
+            self.assertFalse(archive.closed)
+        self.assertTrue(archive.closed)
+
+    def test_del(self):
+        # Deleting the hook closes the archives.
+        hook = ClosingArchiveHook()
+        archive = hook.archive(self.paths[0])
+        del hook
+        self.assertTrue(archive.closed)
+
+    def test_eviction(self):
+        # The least recently used archive is closed when over the limit.
+        hook = ClosingArchiveHook(max_archives=2)
+        events = []
+        hook.add_listener(lambda *args: events.append(args[1:]))
+        first = hook.archive(self.paths[0])
+        second = hook.archive(self.paths[1])
+        hook.archive(self.paths[0])  # Most recently used now.
+        hook.archive(self.paths[2])
+        self.assertFalse(first.closed)
+        self.assertTrue(second.closed)
+        self.assertEqual(events, [(self.paths[1], 'closed')])
+        # Reopened on demand.
+        reopened = hook.archive(self.paths[1])
+        self.assertIsNot(reopened, second)
+        self.assertFalse(reopened.closed)
+        self.assertEqual(len(hook._archives), 2)
+
+    def test_reopened_for_finders(self):
+        # Finders still using a closed or evicted archive reopen it through
+        # the hook.
+        hook = StateArchiveHook(max_archives=1)
+        state = hook(self.paths[0])._state
+        archive = state.archive
+        hook.archive(self.paths[1])
+        self.assertTrue(archive.closed)
+        reopened = state.archive
+        self.assertFalse(reopened.closed)
+        self.assertIs(reopened, hook.archive(self.paths[0]))
+        hook.close()
+        self.assertTrue(reopened.closed)
+        self.assertFalse(state.archive.closed)
+
+    def test_adopted(self):
+        # States of finders created without the shared state are adopted.
+        class Hook(ClosingArchiveHook):
+            def finder(self, archive, archive_path, location):
+                return MockFinder(importers_abc.ArchiveState(archive,
+                                                             archive_path))
+        hook = Hook()
+        state = hook(self.paths[0])._state
+        self.assertIs(state.hook, hook)
+        hook.close()
+        self.assertFalse(state.archive.closed)
+
+    def test_kept_alive(self):
+        # The hook lives as long as the finders using its archives.
+        finder = StateArchiveHook()(self.paths[0])
+        gc.collect()
+        self.assertFalse(finder._state.archive.closed)
+
+    def test_del_at_exit(self):
+        # Deleting a hook at interpreter exit does not touch
+        # sys.path_importer_cache.
+        hook = ClosingArchiveHook()
+        archive = hook.archive(self.paths[0])
+        path_importer_cache = sys.path_importer_cache
+        sys.path_importer_cache = None
+        try:
+            hook.__del__()
+        finally:
+            sys.path_importer_cache = path_importer_cache
+        self.assertTrue(archive.closed)
+
+
+class ArchiveForkTest(unittest.TestCase):
+
+    """Test the handling of forked processes by importers.abc.ArchiveHook."""
+
+    def setUp(self):
+        self.file_path = tempfile.mkstemp()[1]
+        self.addCleanup(support.unlink, self.file_path)
+
+    def test_after_fork(self):
+        # Archives are replaced by what reopen() returns.
+        hook = MockArchiveHook(self.file_path)
+        archive = hook.archive(self.file_path)
+        events = []
+        hook.add_listener(lambda *args: events.append(args[1:]))
+        hook._after_fork()
+        self.assertIsNot(hook.archive(self.file_path), archive)
+        self.assertEqual(events, [(self.file_path, 'forked')])
+
+    def test_after_fork_same_archive(self):
+        # An archive reopened in place is not invalidated.
+        hook = MockArchiveHook(self.file_path)
+        hook.reopen = lambda path, archive: archive
+        archive = hook.archive(self.file_path)
+        events = []
+        hook.add_listener(lambda *args: events.append(args[1:]))
+        hook._after_fork()
+        self.assertIs(hook.archive(self.file_path), archive)
+        self.assertEqual(events, [])
+
+    def test_registered(self):
+        # Every hook is reachable by the at-fork handler.
+        hook = MockArchiveHook(self.file_path)
+        self.assertIn(hook, importers_abc._hooks)
+
+
+class TopLevelNamesTest(unittest.TestCase):
+
+    """Test importers.abc.top_level_names."""
+
+    def test_names(self):
+        # Modules and packages at the root count, nothing else does.
+        paths = ['module.py', 'bytecode.py' + BC, 'pkg/__init__.py',
+                 'pkg/sub.py', 'other/sub.py', 'data.txt',
+                 'deep/a/__init__.py']
+        self.assertEqual(importers_abc.top_level_names(paths),
+                         {'module', 'bytecode', 'pkg'})
+
+    def test_optimization_tags(self):
+        # Optimized bytecode is named after its module, not the file.
+        paths = ['opt.opt-2.py' + BC, 'tagged/__init__.opt-1.py' + BC]
+        self.assertEqual(importers_abc.top_level_names(paths),
+                         {'opt', 'tagged'})
+        self.assertEqual(importers_abc._location_modules(paths),
+                         {'opt': False, 'tagged': True})
+
+
 class MockPyFileFinder(importers_abc.PyFileFinder):
 
     """Mock PyFileFinder implementation."""
@@ -162,6 +434,27 @@ class PyFileFinderTest(unittest.TestCase):
         loader = finder.find_module('module')
         self.assertIsNone(loader)
 
+    def test_iter_modules(self):
+        # Modules and packages directly in the location are listed, sorted,
+        # with packages shadowing modules of the same name.
+        finder = MockPyFileFinder('/')
+        finder.location_paths = lambda: [
+                'module.py', 'bytecode.py' + BC, 'pkg/__init__.py',
+                'pkg/sub.py', 'both.py', 'both/__init__.py', 'dir/sub.py',
+                'deep/a/__init__.py', 'data.txt', '__init__.py',
+                'dotted.name.py']
+        self.assertEqual(list(finder.iter_modules()),
+                         [('both', True), ('bytecode', False),
+                          ('module', False), ('pkg', True)])
+        self.assertEqual(list(finder.iter_modules('top.'))[0],
+                         ('top.both', True))
+
+    def test_iter_modules_unsupported(self):
+        # Finders which cannot list their location do not enumerate.
+        finder = MockPyFileFinder('/')
+        with self.assertRaises(NotImplementedError):
+            list(finder.iter_modules())
+
 
 class MockPyFileLoader(importers_abc.PyFileLoader):
 
@@ -279,6 +572,10 @@ class PyPycFileLoaderTest(unittest.TestCase):
 def test_main():
     support.run_unittest(
                             ArchiveHookTest,
+                            ArchiveCheckTest,
+                            ArchiveCacheTest,
+                            ArchiveForkTest,
+                            TopLevelNamesTest,
                             PyFileFinderTest,
                             PyFileLoaderTest,
                             PyPycFileLoaderTest,
@@ -0,0 +1,169 @@
+from .. import aio
+from .. import pack
+from .. import sqlite3 as importers_sqlite3
+from .. import zip as importers_zip
+import asyncio
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import weakref
+
+
+class ThreadRecordingImporter(importers_sqlite3.Importer):
+
+    """Record the threads get_data() is called in."""
+
+    threads = set()
+
+    def get_data(self, path):
+        self.threads.add(threading.get_ident())
+        return super().get_data(path)
+
+
+class ThreadRecordingHook(importers_sqlite3.Hook):
+
+    def finder(self, archive, archive_path, location):
+        return ThreadRecordingImporter(archive, archive_path, location)
+
+
+class RecordingHook(importers_sqlite3.Hook):
+
+    """Record the finders returned."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.finders = []
+
+    def finder(self, archive, archive_path, location):
+        finder = super().finder(archive, archive_path, location)
+        self.finders.append(finder)
+        return finder
+
+
+class AioTest(unittest.TestCase):
+
+    """Test importers.aio with both zip and sqlite3 archives."""
+
+    files = {'aio_pkg/__init__.py': b'value = "package"',
+             'aio_pkg/sub.py': b'value = "submodule"',
+             'aio_top.py': b'value = "top"'}
+
+    names = ['aio_pkg', 'aio_pkg.sub', 'aio_top']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, 'aio_pkg'))
+        for relative, data in self.files.items():
+            with open(os.path.join(tree, *relative.split('/')), 'wb') as file:
+                file.write(data)
+        self.db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(tree, self.db_path)
+        self.zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(tree, self.zip_path)
+        self.addCleanup(self.forget)
+
+    def forget(self):
+        for name in self.names:
+            sys.modules.pop(name, None)
+
+    def check_modules(self, modules):
+        self.assertEqual(modules['aio_pkg'].value, 'package')
+        self.assertEqual(modules['aio_pkg.sub'].value, 'submodule')
+        self.assertEqual(modules['aio_top'].value, 'top')
+        self.assertIs(modules['aio_pkg'].sub, modules['aio_pkg.sub'])
+        for name in self.names:
+            self.assertIs(sys.modules[name], modules[name])
+
+    def test_sqlite3(self):
+        hooks = [importers_sqlite3.Hook()]
+        modules = asyncio.run(aio.import_modules(['aio_pkg.sub', 'aio_top'],
+                                                 hooks, [self.db_path]))
+        self.assertEqual(set(modules), {'aio_pkg.sub', 'aio_top'})
+        modules['aio_pkg'] = sys.modules['aio_pkg']
+        self.check_modules(modules)
+
+    def test_zip(self):
+        hooks = [importers_sqlite3.Hook(), importers_zip.Hook()]
+        modules = asyncio.run(aio.import_modules(self.names, hooks,
+                                                 [self.zip_path]))
+        self.check_modules(modules)
+
+    def test_data_read_in_executor(self):
+        # No data is read on the event loop's thread.
+        ThreadRecordingImporter.threads = set()
+        async def prefetch():
+            return (threading.get_ident(),
+                    await aio.prefetch(['aio_top'], [ThreadRecordingHook()],
+                                       [self.db_path]))
+        loop_thread, loaders = asyncio.run(prefetch())
+        self.assertTrue(ThreadRecordingImporter.threads)
+        self.assertNotIn(loop_thread, ThreadRecordingImporter.threads)
+        ThreadRecordingImporter.threads = set()
+        modules = aio.load(loaders)
+        self.assertEqual(modules['aio_top'].value, 'top')
+        self.assertEqual(ThreadRecordingImporter.threads, set())
+
+    def test_hook_kept_alive(self):
+        loaders = asyncio.run(aio.prefetch(['aio_top'],
+                                           [importers_sqlite3.Hook()],
+                                           [self.db_path]))
+        hook = weakref.ref(loaders['aio_top']._hook)
+        gc.collect()
+        self.assertIsNotNone(hook())
+        self.assertEqual(aio.load(loaders)['aio_top'].value, 'top')
+
+    def test_source_hash(self):
+        # Bytecode is written by the wrapped importer, with the hash of its
+        # source.
+        pack.pack_sqlite3(os.path.join(self.directory, 'tree'), self.db_path,
+                          hashes=True)
+        dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        self.addCleanup(setattr, sys, 'dont_write_bytecode',
+                        dont_write_bytecode)
+        with importers_sqlite3.Hook() as hook:
+            modules = asyncio.run(aio.import_modules(['aio_top'], [hook],
+                                                     [self.db_path]))
+            self.assertEqual(modules['aio_top'].value, 'top')
+            hashes = dict(hook.archive(self.db_path).execute(
+                            "SELECT stem || ' ' || kind, source_hash FROM FS "
+                            "WHERE stem='aio_top'"))
+        self.assertEqual(hashes['aio_top bytecode'], hashes['aio_top source'])
+
+    def test_resolved_forgotten(self):
+        # The importers do not keep what they found for the modules, whether
+        # or not they are loaded.
+        with RecordingHook() as hook:
+            loaders = asyncio.run(aio.prefetch(['aio_pkg', 'aio_top'], [hook],
+                                               [self.db_path]))
+            aio.load({'aio_top': loaders['aio_top']})
+            for finder in hook.finders:
+                self.assertEqual(finder._resolved, {})
+
+    def test_not_found(self):
+        hooks = [importers_sqlite3.Hook()]
+        loaders = asyncio.run(aio.prefetch(['aio_missing'], hooks,
+                                           [self.db_path]))
+        self.assertEqual(loaders, {'aio_missing': None})
+        with self.assertRaises(ImportError):
+            aio.load(loaders)
+
+    def test_parent_not_imported(self):
+        hooks = [importers_sqlite3.Hook()]
+        with self.assertRaises(ImportError):
+            asyncio.run(aio.prefetch(['aio_pkg.sub'], hooks, [self.db_path]))
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(AioTest)
+
+
+if __name__ == '__main__':
+    main()
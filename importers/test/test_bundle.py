@@ -0,0 +1,203 @@
+from .. import bundle as importer
+from .. import pack
+from . import util
+import imp
+import marshal
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+BC = next(x[0] for x in imp.get_suffixes() if x[2] == imp.PY_COMPILED)
+
+
+def create_bundle(files):
+    """Create a bundle containing the (path, mtime, data) triples."""
+    directory = tempfile.mkdtemp()
+    base_path = os.path.join(directory, 'archive.bundle')
+    importer.write_bundle(base_path, files)
+    return base_path
+
+
+def bytecode(source, mtime):
+    """Return the bytecode file contents for the source."""
+    data = bytearray(imp.get_magic())
+    data.extend(mtime.to_bytes(4, 'little'))
+    data.extend(marshal.dumps(compile(source, '<bundle>', 'exec')))
+    return bytes(data)
+
+
+class BundleTest(unittest.TestCase):
+
+    """Test importers.bundle.Bundle and write_bundle."""
+
+    files = [('b.py', 1, b'b'), ('a/__init__.py', 2, b''),
+             ('a/c' + BC, 3, b'bytecode'), ('z.txt', 4, b'text')]
+
+    def setUp(self):
+        self.path = create_bundle(self.files)
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+        self.bundle = importer.Bundle(self.path)
+        self.addCleanup(self.bundle.close)
+
+    def test_paths(self):
+        # Paths are sorted.
+        self.assertEqual(self.bundle.paths(),
+                         sorted(path for path, _, _ in self.files))
+        self.assertEqual(self.bundle.paths('a/'),
+                         ['a/__init__.py', 'a/c' + BC])
+        self.assertEqual(self.bundle.paths('b'), ['b.py'])
+        self.assertEqual(self.bundle.paths('c'), [])
+
+    def test_find(self):
+        # Every file is found with its data and mtime.
+        for path, mtime, data in self.files:
+            offset, length, found_mtime = self.bundle.find(path)
+            self.assertEqual(self.bundle.data(offset, length), data)
+            self.assertEqual(found_mtime, mtime)
+        for path in ('', 'a', 'a/', 'c.py', 'zz'):
+            self.assertIsNone(self.bundle.find(path))
+
+    def test_alignment(self):
+        # Bytecode starts on a page boundary.
+        offset, _, _ = self.bundle.find('a/c' + BC)
+        self.assertEqual(offset % mmap.PAGESIZE, 0)
+
+    def test_empty(self):
+        path = os.path.join(os.path.dirname(self.path), 'empty.bundle')
+        importer.write_bundle(path, [])
+        bundle = importer.Bundle(path)
+        try:
+            self.assertEqual(bundle.paths(), [])
+            self.assertIsNone(bundle.find('a.py'))
+        finally:
+            bundle.close()
+
+    def test_not_a_bundle(self):
+        path = os.path.join(os.path.dirname(self.path), 'other')
+        for data in (b'', b'not a bundle at all'):
+            with open(path, 'wb') as file:
+                file.write(data)
+            with self.assertRaises(ValueError):
+                importer.Bundle(path)
+
+
+class BundleHookTest(unittest.TestCase):
+
+    """Test importers.bundle.Hook."""
+
+    def setUp(self):
+        self.path = create_bundle([('pkg/module.py', 0, b'')])
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+        self.hook = importer.Hook()
+        self.addCleanup(self.hook.close)
+
+    def test_bundle(self):
+        finder = self.hook(os.path.join(self.path, 'pkg'))
+        self.assertTrue(isinstance(finder, importer.Importer))
+        self.assertEqual(self.hook.paths(self.hook.archive(self.path)),
+                         ['pkg/module.py'])
+
+    def test_not_bundle(self):
+        path = os.path.join(os.path.dirname(self.path), 'file')
+        with open(path, 'w') as file:
+            file.write('not a bundle')
+        with self.assertRaises(ImportError):
+            self.hook(path)
+
+
+class BundleImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest):
+
+    """Test importers.bundle.Importer."""
+
+    mtime = 42
+    mutable = False
+
+    def setUp(self):
+        self.base_path = create_bundle([(self.relative_file_path, self.mtime,
+                                         self.data)])
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.base_path))
+        self.bundle = importer.Bundle(self.base_path)
+        self.addCleanup(self.bundle.close)
+        self.importer = importer.Importer(self.bundle, self.base_path,
+                                          self.location)
+
+    def test_loader(self):
+        # Should return self.
+        self.assertIs(self.importer, self.importer.loader())
+
+    def test_read_only(self):
+        path = os.path.join(self.base_path, self.relative_file_path)
+        self.assertFalse(self.importer.write_data(path, b''))
+
+
+class BundleBytecodeTest(unittest.TestCase):
+
+    """Test loading bytecode from bundles."""
+
+    def load(self, files):
+        path = create_bundle(files)
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        bundle = importer.Bundle(path)
+        self.addCleanup(bundle.close)
+        finder = importer.Importer(bundle, path, '')
+        self.addCleanup(sys.modules.pop, 'bundled', None)
+        return finder.find_module('bundled').load_module('bundled')
+
+    def test_bytecode(self):
+        # Up-to-date bytecode is used.
+        module = self.load([('bundled.py', 10, b'value = "source"'),
+                            ('bundled' + BC, 10,
+                             bytecode('value = "bytecode"', 10))])
+        self.assertEqual(module.value, 'bytecode')
+
+    def test_bytecode_only(self):
+        module = self.load([('bundled' + BC, 10,
+                             bytecode('value = "bytecode"', 10))])
+        self.assertEqual(module.value, 'bytecode')
+
+    def test_stale_bytecode(self):
+        # Stale bytecode is ignored in favour of the source.
+        module = self.load([('bundled.py', 20, b'value = "source"'),
+                            ('bundled' + BC, 20,
+                             bytecode('value = "bytecode"', 10))])
+        self.assertEqual(module.value, 'source')
+
+
+class PackBundleTest(unittest.TestCase):
+
+    """Test importers.pack.pack_bundle."""
+
+    def test_pack(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        tree = os.path.join(directory, 'tree')
+        os.makedirs(os.path.join(tree, 'pkg'))
+        for name in ('__init__.py', 'module.py'):
+            with open(os.path.join(tree, 'pkg', name), 'wb') as file:
+                file.write(b'fake = True')
+        path = os.path.join(directory, 'archive.bundle')
+        self.assertEqual(pack.pack_bundle(tree, path, bytecode=True,
+                                          workers=1), 4)
+        with importer.Hook() as hook:
+            self.assertEqual(hook.paths(hook.archive(path)),
+                             sorted(['pkg/__init__' + BC, 'pkg/__init__.py',
+                                     'pkg/module' + BC, 'pkg/module.py']))
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(
+            BundleTest,
+            BundleHookTest,
+            BundleImporterTest,
+            BundleBytecodeTest,
+            PackBundleTest,
+            )
+
+
+if __name__ == '__main__':
+    main()
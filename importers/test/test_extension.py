@@ -0,0 +1,121 @@
+from .. import extension
+from .. import pack
+from .. import sqlite3 as importers_sqlite3
+from .. import zip as importers_zip
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+class ExtensionCacheTest(unittest.TestCase):
+
+    """Test importers.extension.ExtensionCache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = extension.ExtensionCache(self.directory)
+
+    def test_extract(self):
+        # The file is written under the hash of its contents.
+        path = self.cache.extract(b'data', 'module.so')
+        self.assertEqual(os.path.basename(path), 'module.so')
+        self.assertEqual(os.path.dirname(os.path.dirname(path)),
+                         self.directory)
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'data')
+        # No temporary file is left behind.
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['module.so'])
+
+    def test_reuse(self):
+        # Extracting the same contents again reuses the file.
+        path = self.cache.extract(b'data', 'module.so')
+        os.utime(path, (42, 42))
+        self.assertEqual(self.cache.extract(b'data', 'module.so'), path)
+        self.assertEqual(os.stat(path).st_mtime, 42)
+
+    def test_different_contents(self):
+        # Different contents are kept apart.
+        path1 = self.cache.extract(b'data', 'module.so')
+        path2 = self.cache.extract(b'other data', 'module.so')
+        self.assertNotEqual(path1, path2)
+        with open(path1, 'rb') as file:
+            self.assertEqual(file.read(), b'data')
+
+    def test_default_directory(self):
+        cache = extension.ExtensionCache()
+        self.assertEqual(cache.directory, extension.default_directory())
+
+
+class ExtensionImportTest(unittest.TestCase):
+
+    """Test importing an extension module from archives."""
+
+    name = 'xxlimited'
+
+    def setUp(self):
+        try:
+            file, self.extension_path, _ = imp.find_module(self.name)
+        except ImportError:
+            self.skipTest("no {} extension module".format(self.name))
+        if file is not None:
+            file.close()
+        if not self.extension_path.endswith(tuple(
+                x[0] for x in imp.get_suffixes() if x[2] == imp.C_EXTENSION)):
+            self.skipTest("{} is not an extension module".format(self.name))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tree = os.path.join(self.directory, 'tree')
+        os.mkdir(tree)
+        shutil.copy(self.extension_path, tree)
+        with open(os.path.join(tree, self.name + '.py'), 'w') as file:
+            file.write('source = True\n')
+        self.tree = tree
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.cache = extension.ExtensionCache(self.cache_dir)
+        self.addCleanup(sys.modules.pop, self.name, None)
+
+    def check_import(self, hook, archive_path):
+        with hook:
+            finder = hook(archive_path)
+            loader = finder.find_module(self.name)
+            self.assertIsInstance(loader, extension.ExtensionLoader)
+            module = loader.load_module(self.name)
+        self.assertIs(sys.modules[self.name], module)
+        self.assertFalse(hasattr(module, 'source'))
+        self.assertEqual(module.foo(1, 2), 3)
+        self.assertTrue(module.__file__.startswith(self.cache_dir))
+        self.assertEqual(os.path.basename(module.__file__),
+                         os.path.basename(self.extension_path))
+
+    def test_zip(self):
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path)
+        self.check_import(importers_zip.Hook(extension_cache=self.cache),
+                          zip_path)
+
+    def test_sqlite3(self):
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, codec='zlib')
+        self.check_import(importers_sqlite3.Hook(extension_cache=self.cache),
+                          db_path)
+
+    def test_no_cache(self):
+        # Without an extension cache, extension modules are not found.
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path)
+        with importers_zip.Hook() as hook:
+            loader = hook(zip_path).find_module(self.name)
+            self.assertIsInstance(loader, importers_zip.Importer)
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(ExtensionCacheTest, ExtensionImportTest)
+
+
+if __name__ == '__main__':
+    main()
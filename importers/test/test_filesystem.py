@@ -0,0 +1,99 @@
+from .. import filesystem as importer
+from . import util
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class FilesystemHookTest(unittest.TestCase):
+
+    """Test importers.filesystem.Hook."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.hook = importer.Hook()
+
+    def test_directory(self):
+        # A directory should lead to an importer.
+        finder = self.hook(self.directory)
+        self.assertTrue(isinstance(finder, importer.Importer))
+        self.assertEqual(finder.location, self.directory)
+
+    def test_file(self):
+        # A file is not a directory.
+        path = os.path.join(self.directory, 'file')
+        with open(path, 'w') as file:
+            file.write('data')
+        with self.assertRaises(ImportError):
+            self.hook(path)
+
+    def test_shared_cache(self):
+        # Importers from the same hook share their listings.
+        finder1 = self.hook(self.directory)
+        finder2 = self.hook(self.directory)
+        self.assertIs(finder1._listings, finder2._listings)
+
+
+class FilesystemImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest):
+
+    """Test importers.filesystem.Importer."""
+
+    mutable = True
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        path = os.path.join(self.base_path, self.relative_file_path)
+        os.mkdir(os.path.dirname(path))
+        with open(path, 'wb') as file:
+            file.write(self.data)
+        self.mtime = 42
+        os.utime(path, (self.mtime, self.mtime))
+        self.importer = importer.Importer(os.path.join(self.base_path,
+                                                       self.location))
+
+    def test_loader(self):
+        # Should return self.
+        self.assertIs(self.importer, self.importer.loader())
+
+    def test_cached_listing(self):
+        # Once listed, a directory is not listed again until its mtime
+        # changes.
+        path = os.path.join(self.base_path, self.relative_file_path)
+        self.assertTrue(self.importer.file_exists(path))
+        scandir = importer.os.scandir
+        calls = []
+        def counting_scandir(path):
+            calls.append(path)
+            return scandir(path)
+        importer.os.scandir = counting_scandir
+        try:
+            self.assertIsNotNone(self.importer.find_module('pkg.module'))
+            self.assertTrue(self.importer.file_exists(path))
+            self.assertEqual(calls, [])
+        finally:
+            importer.os.scandir = scandir
+
+    def test_new_file(self):
+        # A file added to a directory is found once the directory's mtime
+        # changes.
+        self.assertIsNone(self.importer.find_module('pkg.new'))
+        directory = os.path.join(self.base_path, self.location)
+        with open(os.path.join(directory, 'new.py'), 'w') as file:
+            file.write('new = True')
+        os.utime(directory, (0, 0))
+        self.assertIsNotNone(self.importer.find_module('pkg.new'))
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(
+            FilesystemHookTest,
+            FilesystemImporterTest,
+            )
+
+
+if __name__ == '__main__':
+    main()
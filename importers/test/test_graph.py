@@ -0,0 +1,348 @@
+from .. import graph
+from .. import pack
+from .. import sqlite3 as importers_sqlite3
+from .. import zip as importers_zip
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import unittest
+import zipfile
+
+
+class ImportsTest(unittest.TestCase):
+
+    """Test importers.graph.imports."""
+
+    def test_import(self):
+        # Importing a submodule imports its parents.
+        self.assertEqual(graph.imports(b'import a.b.c, d', 'mod'),
+                         ['a', 'a.b', 'a.b.c', 'd'])
+
+    def test_from_import(self):
+        # Names imported from a module may be submodules.
+        source = b'from a.b import c\nfrom a import *'
+        self.assertEqual(graph.imports(source, 'mod'), ['a', 'a.b', 'a.b.c'])
+
+    def test_relative(self):
+        source = b'from . import x\nfrom ..y import z'
+        self.assertEqual(graph.imports(source, 'pkg.sub.mod'),
+                         ['pkg', 'pkg.sub', 'pkg.sub.x', 'pkg.y', 'pkg.y.z'])
+        # A package's own directory is its package.
+        self.assertEqual(graph.imports(b'from . import x', 'pkg', True),
+                         ['pkg', 'pkg.x'])
+        # Relative imports beyond the top-level package are ignored.
+        self.assertEqual(graph.imports(b'from .. import x', 'pkg.mod'), [])
+        self.assertEqual(graph.imports(b'from . import x', 'mod'), [])
+
+    def test_executed_imports(self):
+        # Imports in functions only run when called; those in blocks and
+        # class bodies run with the module.
+        source = b'''
+try:
+    import a
+except ImportError:
+    import b
+class C:
+    import c
+def f():
+    import d
+g = lambda: __import__('e')
+'''
+        self.assertEqual(graph.imports(source, 'mod'), ['a', 'b', 'c'])
+
+    def test_syntax_error(self):
+        with self.assertRaises(SyntaxError):
+            graph.imports(b'def', 'mod')
+
+
+class ImportGraphTest(unittest.TestCase):
+
+    """Test importers.graph.import_graph and friends."""
+
+    files = [('graph_pkg/__init__.py', 0,
+              b'from . import a\nimport graph_pkg.b\nimport os\n'),
+             ('graph_pkg/a.py', 0, b'from .b import value\n'),
+             ('graph_pkg/b.py', 0, b'value = 1\n'),
+             ('graph_pkg/c.pyc', 0, b''),
+             ('graph_pkg/broken.py', 0, b'def'),
+             ('graph_pkg/data.txt', 0, b'import graph_pkg.a')]
+
+    def test_module_paths(self):
+        self.assertEqual(graph.module_paths(entry[0] for entry in self.files),
+                         {'graph_pkg': 'graph_pkg/__init__',
+                          'graph_pkg.a': 'graph_pkg/a',
+                          'graph_pkg.b': 'graph_pkg/b',
+                          'graph_pkg.c': 'graph_pkg/c',
+                          'graph_pkg.broken': 'graph_pkg/broken'})
+
+    def test_import_graph(self):
+        # Only edges to modules in the files are kept.
+        self.assertEqual(graph.import_graph(self.files),
+                         {'graph_pkg': ['graph_pkg.a', 'graph_pkg.b'],
+                          'graph_pkg.a': ['graph_pkg', 'graph_pkg.b'],
+                          'graph_pkg.b': []})
+
+    def test_import_order(self):
+        import_graph = graph.import_graph(self.files)
+        self.assertEqual(graph.import_order(import_graph),
+                         ['graph_pkg', 'graph_pkg.a', 'graph_pkg.b'])
+        self.assertEqual(graph.import_order(import_graph, ['graph_pkg.b']),
+                         ['graph_pkg.b'])
+
+    def test_member(self):
+        import_graph = graph.import_graph(self.files)
+        paths = graph.module_paths(entry[0] for entry in self.files)
+        data = graph.graph_member(import_graph, paths)
+        read = importers_zip.read_graph(data)
+        self.assertEqual(read['graph_pkg'],
+                         [('graph_pkg.a', 'graph_pkg/a'),
+                          ('graph_pkg.b', 'graph_pkg/b')])
+        self.assertEqual(read['graph_pkg.c'], [])
+        with self.assertRaises(ValueError):
+            importers_zip.read_graph(b'{"version": 0}')
+        with self.assertRaises(ValueError):
+            importers_zip.read_graph(b'[]')
+
+
+class PrefetchTest(unittest.TestCase):
+
+    """Test that importers read the dependencies of a module in one batch
+    from archives with an import graph."""
+
+    files = {'graph_pkg/__init__.py': b'from . import a\nfrom . import b\n',
+             'graph_pkg/a.py': b'from .b import value\n',
+             'graph_pkg/b.py': b'value = 42\n',
+             'graph_pkg/c.py': b'from . import a\n'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, 'graph_pkg'))
+        for relative, data in self.files.items():
+            with open(os.path.join(tree, *relative.split('/')), 'wb') as file:
+                file.write(data)
+        self.tree = tree
+        for name in ('graph_pkg', 'graph_pkg.a', 'graph_pkg.b'):
+            self.addCleanup(sys.modules.pop, name, None)
+
+    def load(self, hook, archive_path):
+        """Import graph_pkg (and so its submodules) from the archive."""
+        package_path = os.path.join(archive_path, 'graph_pkg')
+        sys.path_importer_cache[package_path] = hook(package_path)
+        self.addCleanup(sys.path_importer_cache.pop, package_path, None)
+        importer = hook(archive_path)
+        module = importer.find_module('graph_pkg').load_module('graph_pkg')
+        self.assertEqual(module.a.value, 42)
+        return importer
+
+    def test_sqlite3(self):
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, with_graph=True)
+        with importers_sqlite3.Hook() as hook:
+            cxn = hook.archive(db_path)
+            self.assertEqual(
+                sorted(cxn.execute('SELECT module, dependency, path '
+                                   'FROM Imports')),
+                [('graph_pkg', 'graph_pkg.a', 'graph_pkg/a'),
+                 ('graph_pkg', 'graph_pkg.b', 'graph_pkg/b'),
+                 ('graph_pkg.a', 'graph_pkg', 'graph_pkg/__init__'),
+                 ('graph_pkg.a', 'graph_pkg.b', 'graph_pkg/b'),
+                 ('graph_pkg.c', 'graph_pkg', 'graph_pkg/__init__'),
+                 ('graph_pkg.c', 'graph_pkg.a', 'graph_pkg/a')])
+            queries = []
+            cxn.set_trace_callback(queries.append)
+            importer = self.load(hook, db_path)
+            cxn.set_trace_callback(None)
+        # Only the package's own source is read by itself.
+        self.assertEqual(sum(1 for query in queries
+                                if 'data FROM FS WHERE path=' in query), 1)
+        self.assertEqual(sum(1 for query in queries
+                                if 'data FROM FS WHERE path IN' in query), 1)
+        self.assertEqual(importer._state.prefetched, {})
+
+    def reads(self, hook, db_path):
+        """Load graph_pkg from the database, returning the importer and the
+        queries reading data."""
+        cxn = hook.archive(db_path)
+        queries = []
+        cxn.set_trace_callback(queries.append)
+        try:
+            importer = self.load(hook, db_path)
+        finally:
+            cxn.set_trace_callback(None)
+        return importer, [query for query in queries
+                            if 'data FROM FS WHERE' in query]
+
+    def test_sqlite3_bytecode(self):
+        # Up-to-date bytecode is prefetched without the source.
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, bytecode=True, with_graph=True)
+        with importers_sqlite3.Hook() as hook:
+            importer, reads = self.reads(hook, db_path)
+        self.assertFalse(any("'graph_pkg/a.py'" in query or
+                             "'graph_pkg/b.py'" in query for query in reads))
+        self.assertEqual(importer._state.prefetched, {})
+
+    def test_sqlite3_stale_bytecode(self):
+        # The source is prefetched in place of stale bytecode.
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, bytecode=True, with_graph=True)
+        cxn = sqlite3.connect(db_path)
+        with cxn:
+            cxn.execute("UPDATE FS SET mtime=mtime + 1 WHERE kind='source'")
+        cxn.close()
+        with importers_sqlite3.Hook() as hook:
+            importer, reads = self.reads(hook, db_path)
+        # The bytecode is read first to check its mtime.
+        prefetches = [query for query in reads if 'path IN' in query]
+        self.assertEqual(len(prefetches), 2)
+        self.assertIn("'graph_pkg/a.py'", prefetches[1])
+        self.assertEqual(importer._state.prefetched, {})
+
+    def test_sqlite3_newer_bytecode(self):
+        # Bytecode newer than its source is up-to-date, as for get_code().
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, bytecode=True, with_graph=True)
+        cxn = sqlite3.connect(db_path)
+        with cxn:
+            cxn.execute("UPDATE FS SET mtime=mtime - 1 WHERE kind='source'")
+        cxn.close()
+        with importers_sqlite3.Hook() as hook:
+            importer, reads = self.reads(hook, db_path)
+        self.assertFalse(any("'graph_pkg/a.py'" in query or
+                             "'graph_pkg/b.py'" in query for query in reads))
+        self.assertEqual(importer._state.prefetched, {})
+
+    def test_not_imported(self):
+        # Prefetched dependencies which are not imported are dropped once
+        # the module importing them is loaded.
+        with open(os.path.join(self.tree, 'graph_pkg', '__init__.py'),
+                  'ab') as file:
+            file.write(b'if False:\n    from . import c\n')
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, with_graph=True)
+        with importers_sqlite3.Hook() as hook:
+            importer = self.load(hook, db_path)
+            self.assertEqual(importer._state.prefetched, {})
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path, with_graph=True)
+        for name in ('graph_pkg', 'graph_pkg.a', 'graph_pkg.b'):
+            sys.modules.pop(name, None)
+        with importers_zip.Hook() as hook:
+            importer = self.load(hook, zip_path)
+            self.assertEqual(importer._state.prefetched, {})
+
+    def test_sqlite3_without_graph(self):
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path)
+        with importers_sqlite3.Hook() as hook:
+            importer = self.load(hook, db_path)
+            self.assertFalse(importer._state.has_graph)
+
+    def test_zip(self):
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path, with_graph=True)
+        with importers_zip.Hook() as hook:
+            archive = hook.archive(zip_path)
+            read = []
+            archive_read = archive.read
+            def recording_read(name, *args):
+                read.append(name)
+                return archive_read(name, *args)
+            archive.read = recording_read
+            importer = self.load(hook, zip_path)
+        self.assertEqual(read, [graph.GRAPH_NAME, 'graph_pkg/__init__.py'])
+        self.assertEqual(importer._state.prefetched, {})
+
+    def test_read_members(self):
+        # Stored members are read directly; others are left out.
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            archive.writestr('stored', b'stored data')
+            archive.writestr('deflated', b'deflated data',
+                             zipfile.ZIP_DEFLATED)
+            archive.writestr('extra', b'x' * (importers_zip.PREFETCH_GAP + 1))
+            archive.writestr('far', b'far data')
+        with zipfile.ZipFile(zip_path) as archive:
+            data = importers_zip._read_members(archive, archive.infolist())
+        self.assertEqual(data, {'stored': b'stored data',
+                                'extra': b'x' * (importers_zip.PREFETCH_GAP
+                                                 + 1),
+                                'far': b'far data'})
+
+
+class StoreTest(unittest.TestCase):
+
+    """Test importers.graph.store."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, 'graph_pkg'))
+        for name, data in (('__init__.py', b'from . import a'),
+                           ('a.py', b'')):
+            with open(os.path.join(tree, 'graph_pkg', name), 'wb') as file:
+                file.write(data)
+        self.tree = tree
+
+    def test_sqlite3(self):
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path, codec='zlib', threshold=0)
+        self.assertEqual(graph.store(db_path), 1)
+        self.assertEqual(graph.store(db_path), 1)
+        cxn = sqlite3.connect(db_path)
+        try:
+            rows = list(cxn.execute('SELECT * FROM Imports'))
+        finally:
+            cxn.close()
+        self.assertEqual(rows, [('graph_pkg', 'graph_pkg.a', 'graph_pkg/a')])
+
+    def test_dedup(self):
+        source = os.path.join(self.directory, 'source.db')
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, source)
+        importers_sqlite3.migrate_to_dedup(source, db_path)
+        self.assertEqual(graph.store(db_path), 1)
+
+    def test_zip(self):
+        # An existing graph is replaced.
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path, with_graph=True)
+        self.assertEqual(graph.store(zip_path), 1)
+        with zipfile.ZipFile(zip_path) as archive:
+            names = archive.namelist()
+            self.assertEqual(names.count(graph.GRAPH_NAME), 1)
+            self.assertEqual(archive.read('graph_pkg/__init__.py'),
+                             b'from . import a')
+            graph_data = archive.read(graph.GRAPH_NAME)
+        self.assertEqual(importers_zip.read_graph(graph_data)['graph_pkg'],
+                         [('graph_pkg.a', 'graph_pkg/a')])
+
+    def test_zip_mode(self):
+        # The rewritten zip file keeps the mode of the original.
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path)
+        os.chmod(zip_path, 0o644)
+        graph.store(zip_path)
+        self.assertEqual(stat.S_IMODE(os.stat(zip_path).st_mode), 0o644)
+
+    def test_not_an_archive(self):
+        path = os.path.join(self.directory, 'archive.db')
+        with open(path, 'w') as file:
+            file.write('not an archive')
+        with self.assertRaises(ValueError):
+            graph.store(path)
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(ImportsTest, ImportGraphTest, PrefetchTest, StoreTest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+from .. import index
+from .. import sqlite3 as importers_sqlite3
+from .. import zip as importers_zip
+import importlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import zipfile
+
+
+class IndexFinderTest(unittest.TestCase):
+
+    """Test importers.index.IndexFinder."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.zip_hook = importers_zip.Hook()
+        self.sqlite3_hook = importers_sqlite3.Hook()
+        self.first = self.create_zip('first.zip',
+                                     {'_index_mod.py': b'where = "first"',
+                                      '_index_pkg/__init__.py': b'',
+                                      '_index_pkg/sub.py': b'sub = True',
+                                      'data/file.txt': b'not a module'})
+        self.second = self.create_db('second.db',
+                                     {'_index_mod.py': b'where = "second"',
+                                      '_index_other.py': b'other = True'})
+        self.finder = index.IndexFinder()
+        # The archives lead sys.path.
+        self.addCleanup(setattr, sys, 'path', sys.path)
+        sys.path = [self.first, self.second] + sys.path
+        self.addCleanup(sys.path_importer_cache.pop, self.directory, None)
+
+    def tearDown(self):
+        for name in ('_index_mod', '_index_pkg', '_index_pkg.sub',
+                     '_index_other', '_index_dir'):
+            sys.modules.pop(name, None)
+
+    def install(self):
+        """Put the finder first on sys.meta_path for the test."""
+        sys.meta_path.insert(0, self.finder)
+        self.addCleanup(sys.meta_path.remove, self.finder)
+
+    def create_zip(self, name, files):
+        path = os.path.join(self.directory, name)
+        with zipfile.ZipFile(path, 'w') as zip_:
+            for member, data in files.items():
+                zip_.writestr(member, data)
+        return path
+
+    def create_db(self, name, files):
+        path = os.path.join(self.directory, name)
+        cxn = sqlite3.connect(path)
+        with cxn:
+            cxn.execute(importers_sqlite3.sql_creation)
+            cxn.executemany('INSERT INTO FS VALUES (?, 1, ?)', files.items())
+        cxn.close()
+        return path
+
+    def test_add(self):
+        # The top-level names of an archive are returned.
+        self.assertEqual(self.finder.add(self.zip_hook, self.first),
+                         {'_index_mod', '_index_pkg'})
+
+    def test_add_path(self):
+        # Only paths to archives a hook can handle are registered.
+        paths = [self.directory, self.first, self.second, 'nonexistent']
+        added = self.finder.add_path([self.zip_hook, self.sqlite3_hook], paths)
+        self.assertEqual(added, [self.first, self.second])
+        self.assertEqual(self.finder.archive_for('_index_other'), self.second)
+
+    def test_first_wins(self):
+        # The first archive registered providing a name is used.
+        self.finder.add(self.zip_hook, self.first)
+        self.finder.add(self.sqlite3_hook, self.second)
+        self.assertEqual(self.finder.archive_for('_index_mod'), self.first)
+        loader = self.finder.find_module('_index_mod')
+        module = loader.load_module('_index_mod')
+        self.assertEqual(module.where, 'first')
+        self.assertIsNotNone(self.finder.find_module('_index_other'))
+
+    def test_missing(self):
+        # Unknown names are not found.
+        sys.path = [self.first]
+        self.finder.add(self.zip_hook, self.first)
+        self.assertIsNone(self.finder.find_module('_index_nothing'))
+        self.assertIsNone(self.finder.find_module('data'))
+
+    def test_sys_path_order(self):
+        # Of the archives leading sys.path, the first to provide a name wins.
+        self.finder.add(self.sqlite3_hook, self.second)
+        self.finder.add(self.zip_hook, self.first)
+        self.assertEqual(self.finder.archive_for('_index_mod'), self.second)
+        loader = self.finder.find_module('_index_mod')
+        self.assertEqual(loader.load_module('_index_mod').where, 'first')
+
+    def test_shadowed(self):
+        # An entry before the archives on sys.path may provide the name.
+        with open(os.path.join(self.directory, '_index_mod.py'), 'w') as file:
+            file.write('where = "directory"')
+        sys.path.insert(0, self.directory)
+        self.finder.add(self.zip_hook, self.first)
+        self.assertIsNone(self.finder.find_module('_index_mod'))
+
+    def test_miss(self):
+        # A name the leading archives lack is left to the other finders
+        # without the index asking the archives for it.
+        with open(os.path.join(self.directory, '_index_dir.py'), 'w') as file:
+            file.write('where = "directory"')
+        sys.path.insert(2, self.directory)
+        self.finder.add(self.zip_hook, self.first)
+        self.finder.add(self.sqlite3_hook, self.second)
+        with mock.patch.object(importers_zip.Importer,
+                               'find_module') as zip_find, \
+             mock.patch.object(importers_sqlite3.Importer,
+                               'find_module') as sqlite3_find:
+            self.assertIsNone(self.finder.find_module('_index_dir'))
+            self.assertIsNone(self.finder.find_spec('_index_nothing'))
+        self.assertFalse(zip_find.called)
+        self.assertFalse(sqlite3_find.called)
+        self.install()
+        module = importlib.import_module('_index_dir')
+        self.assertEqual(module.where, 'directory')
+
+    def test_find_spec(self):
+        # Specs wrap the loader find_module() returns.
+        self.finder.add(self.zip_hook, self.first)
+        spec = self.finder.find_spec('_index_pkg')
+        self.assertEqual(spec.name, '_index_pkg')
+        self.assertIsInstance(spec.loader, importers_zip.Importer)
+        self.install()
+        module = importlib.import_module('_index_pkg.sub')
+        self.assertTrue(module.sub)
+
+    def test_submodule(self):
+        # Submodules are found through the package's __path__.
+        self.finder.add(self.zip_hook, self.first)
+        package = self.finder.find_module('_index_pkg').load_module(
+                                                                '_index_pkg')
+        loader = self.finder.find_module('_index_pkg.sub', package.__path__)
+        self.assertIsNotNone(loader)
+        self.assertIsNone(self.finder.find_module('_index_pkg.sub',
+                                                  [self.directory]))
+
+    def test_reload(self):
+        # A replaced archive is picked up by top-level lookups.
+        hook = importers_zip.Hook(check_interval=0)
+        self.finder.add(hook, self.first)
+        self.assertIsNone(self.finder.find_module('_index_new'))
+        os.unlink(self.first)
+        self.create_zip('first.zip', {'_index_new.py': b'new = True'})
+        self.assertIsNotNone(self.finder.find_module('_index_new'))
+        self.assertIsNone(self.finder.archive_for('_index_mod'))
+
+    def test_evicted(self):
+        # Archives evicted from the hook's cache are reopened on demand.
+        hook = importers_zip.Hook(max_archives=1)
+        self.finder.add(hook, self.first)
+        other = self.create_zip('other.zip', {'_index_other.py': b''})
+        self.finder.add(hook, other)
+        self.assertNotIn(self.first, hook._archives)
+        loader = self.finder.find_module('_index_mod')
+        self.assertEqual(loader.load_module('_index_mod').where, 'first')
+
+    def test_remove(self):
+        # Removing an archive exposes names shadowed by it.
+        self.finder.add(self.zip_hook, self.first)
+        self.finder.add(self.sqlite3_hook, self.second)
+        self.finder.remove(self.first)
+        self.assertEqual(self.finder.archive_for('_index_mod'), self.second)
+        self.assertIsNone(self.finder.archive_for('_index_pkg'))
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(IndexFinderTest)
+
+
+if __name__ == '__main__':
+    main()
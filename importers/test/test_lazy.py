@@ -1,6 +1,7 @@
 from .. import lazy
 import imp
 import importlib.abc
+import io
 import sys
 import types
 import unittest
@@ -32,12 +33,25 @@ class MockLazyLoader(lazy.Mixin, MockLoader):
     pass
 
 
+class FailingLoader(importlib.abc.Loader):
+
+    """Mock loader whose loads fail."""
+
+    def load_module(self, fullname):
+        raise ImportError(fullname)
+
+
+class FailingLazyLoader(lazy.Mixin, FailingLoader):
+    """Class mixing the failing loader with the lazy mixin."""
+    pass
+
+
 class LazyMixinTest(unittest.TestCase):
 
     """Test importer.lazy.Mixin."""
 
     def setUp(self):
-        self.name = '_lazy_test_mdoule'
+        self.name = '_lazy_test_module'
         self.loader = MockLazyLoader()
         self.tearDown()
 
@@ -131,9 +145,76 @@ class LazyMixinTest(unittest.TestCase):
         self.assertTrue(isinstance(module, types.ModuleType))
 
 
+class LoadAccountingTest(unittest.TestCase):
+
+    """Test the lazy module registry in importers.lazy."""
+
+    def setUp(self):
+        self.name = '_lazy_test_module'
+        self.loader = MockLazyLoader()
+        self.tearDown()
+
+    def tearDown(self):
+        lazy.clear()
+        try:
+            del sys.modules[self.name]
+        except KeyError:
+            pass
+
+    def test_unmaterialized(self):
+        # A lazy module that is never touched should be reported as such.
+        self.loader.load_module(self.name)
+        records = lazy.records()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].name, self.name)
+        self.assertIsNone(records[0].materialized)
+        self.assertIsNone(records[0].trigger)
+        self.assertEqual(lazy.unmaterialized(), [self.name])
+
+    def test_materialized(self):
+        # Accessing an attribute should record the trigger and load time.
+        module = self.loader.load_module(self.name)
+        module.attr
+        record = lazy.records()[0]
+        self.assertEqual(record.trigger, 'attr')
+        self.assertGreaterEqual(record.materialized, record.created)
+        self.assertGreaterEqual(record.load_time, 0)
+        self.assertEqual(lazy.unmaterialized(), [])
+
+    def test_failed_load(self):
+        # A load which fails does not count as materialized.
+        module = FailingLazyLoader().load_module(self.name)
+        with self.assertRaises(ImportError):
+            module.attr
+        record = lazy.records()[0]
+        self.assertIsNone(record.materialized)
+        self.assertIsNone(record.trigger)
+        self.assertEqual(lazy.unmaterialized(), [self.name])
+
+    def test_reload_not_recorded(self):
+        # Reloads are not lazy and thus not recorded.
+        module = self.loader.load_module(self.name)
+        module.attr
+        lazy.clear()
+        self.loader.load_module(self.name)
+        self.assertEqual(lazy.records(), [])
+
+    def test_report(self):
+        # The report should mention every lazy module.
+        self.loader.load_module(self.name)
+        self.loader.load_module(self.name + '2').attr
+        self.addCleanup(sys.modules.pop, self.name + '2')
+        output = io.StringIO()
+        lazy.report(output)
+        text = output.getvalue()
+        self.assertIn('2 created, 1 materialized', text)
+        self.assertIn(self.name + ': never materialized', text)
+        self.assertIn(self.name + "2: 'attr'", text)
+
+
 def main():
     from test.support import run_unittest
-    run_unittest(LazyMixinTest)
+    run_unittest(LazyMixinTest, LoadAccountingTest)
 
 
 if __name__ == '__main__':
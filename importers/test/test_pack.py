@@ -0,0 +1,229 @@
+from .. import graph
+from .. import pack
+from .. import sqlite3 as importers_sqlite3
+from .. import zip as importers_zip
+import imp
+import json
+import marshal
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+import zipfile
+
+
+BC = next(x[0] for x in imp.get_suffixes() if x[2] == imp.PY_COMPILED)
+
+
+class PackTestCase(unittest.TestCase):
+
+    """Superclass for packing tests which creates a tree to pack in
+    self.tree."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(self.tree, 'pkg', '__pycache__'))
+        self.files = {'pkg/__init__.py': b'',
+                      'pkg/small.py': b'x = 1',
+                      'pkg/large.py': b'x = 1\n' * 2000}
+        for relative, data in self.files.items():
+            with open(os.path.join(self.tree, *relative.split('/')),
+                      'wb') as file:
+                file.write(data)
+        with open(os.path.join(self.tree, 'pkg', '__pycache__', 'x.pyc'),
+                  'wb') as file:
+            file.write(b'junk')
+
+
+class PackSqlite3Test(PackTestCase):
+
+    """Test importers.pack.pack_sqlite3."""
+
+    def setUp(self):
+        super().setUp()
+        self.db_path = os.path.join(self.directory, 'archive.db')
+
+    def test_pack(self):
+        # Every file is stored, with only large files compressed.
+        count = pack.pack_sqlite3(self.tree, self.db_path, codec='zlib',
+                                  threshold=1024)
+        self.assertEqual(count, len(self.files))
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            rows = {path: codec for path, codec in
+                        cxn.execute('SELECT path, codec FROM FS')}
+            self.assertEqual(rows, {'pkg/__init__.py': None,
+                                    'pkg/small.py': None,
+                                    'pkg/large.py': 'zlib'})
+            kinds = {path: kind for path, kind in
+                        cxn.execute('SELECT path, kind FROM FS')}
+            self.assertEqual(set(kinds.values()), {'source'})
+            importer = importers_sqlite3.Importer(cxn, self.db_path, 'pkg')
+            for relative, data in self.files.items():
+                self.assertEqual(importer.get_data(relative), data)
+        finally:
+            cxn.close()
+
+    def test_open_data(self):
+        # Members of a packed database are streamed through blob handles.
+        pack.pack_sqlite3(self.tree, self.db_path)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            if not hasattr(cxn, 'blobopen'):
+                self.skipTest("sqlite3 lacks incremental blob I/O")
+            importer = importers_sqlite3.Importer(cxn, self.db_path, 'pkg')
+            with importer.open_data('pkg/large.py') as stream:
+                self.assertIsInstance(stream.raw, importers_sqlite3._BlobIO)
+                self.assertEqual(stream.read(), self.files['pkg/large.py'])
+        finally:
+            cxn.close()
+
+    def test_choose_codec(self):
+        # Compression is only picked at or above the threshold.
+        self.assertIsNone(pack.choose_codec(b'abc', 'zlib', 4))
+        self.assertEqual(pack.choose_codec(b'abcd', 'zlib', 4), 'zlib')
+        self.assertIsNone(pack.choose_codec(b'abcd', None, 4))
+
+
+    def test_bytecode(self):
+        # Bytecode is stored right after its source and is loadable.
+        pack.pack_sqlite3(self.tree, self.db_path, bytecode=True, workers=2)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            paths = [row[0] for row in cxn.execute('SELECT path FROM FS')]
+            self.assertIn('pkg/small' + BC, paths)
+            importer = importers_sqlite3.Importer(cxn, self.db_path, 'pkg')
+            bytecode = importer.get_data('pkg/small' + BC)
+            self.assertEqual(bytecode[:4], imp.get_magic())
+            self.assertEqual(importer.bytecode_path('pkg.small'),
+                             os.path.join(self.db_path, 'pkg', 'small' + BC))
+            # The code has the file name the importer gives the source.
+            code = marshal.loads(bytecode[8:])
+            self.assertEqual(code.co_filename,
+                             importer.source_path('pkg.small'))
+        finally:
+            cxn.close()
+
+    def test_hashes(self):
+        # Source and the bytecode compiled from it share the source's hash.
+        pack.pack_sqlite3(self.tree, self.db_path, bytecode=True, workers=1,
+                          hashes=True)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            hashes = dict(cxn.execute('SELECT path, source_hash FROM FS'))
+        finally:
+            cxn.close()
+        expected = importers_sqlite3.hash_source(self.files['pkg/small.py'])
+        self.assertEqual(hashes['pkg/small.py'], expected)
+        self.assertEqual(hashes['pkg/small' + BC], expected)
+
+    def test_optimize(self):
+        # Bytecode is stored for every optimization level under its tag.
+        with open(os.path.join(self.tree, 'pkg', 'doc.py'), 'w') as file:
+            file.write('"""Docstring."""\nassert False\n')
+        pack.pack_sqlite3(self.tree, self.db_path, bytecode=True, workers=1,
+                          hashes=True, optimize=[0, 2])
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            rows = {path: (kind, source_hash) for path, kind, source_hash in
+                        cxn.execute('SELECT path, kind, source_hash FROM FS')}
+            importer = importers_sqlite3.Importer(cxn, self.db_path, 'pkg')
+            optimized = importer.get_data('pkg/doc.opt-2' + BC)
+        finally:
+            cxn.close()
+        self.assertEqual(rows['pkg/doc' + BC][0], 'bytecode')
+        self.assertEqual(rows['pkg/doc.opt-2' + BC][0], 'bytecode.opt-2')
+        self.assertNotIn('pkg/doc.opt-1' + BC, rows)
+        self.assertEqual(rows['pkg/doc.opt-2' + BC][1], rows['pkg/doc.py'][1])
+        # -OO bytecode has neither docstrings nor asserts.
+        namespace = {}
+        exec(marshal.loads(optimized[8:]), namespace)
+        self.assertIsNone(namespace.get('__doc__'))
+
+    def test_manifest(self):
+        # The manifest describes every other file.
+        pack.pack_sqlite3(self.tree, self.db_path, with_manifest=True)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            importer = importers_sqlite3.Importer(cxn, self.db_path, '')
+            data = importer.get_data(pack.MANIFEST_NAME)
+        finally:
+            cxn.close()
+        files = json.loads(data.decode())['files']
+        listed = {entry['path'] for entry in files}
+        self.assertEqual(listed, set(self.files))
+
+
+class PackZipTest(PackTestCase):
+
+    """Test importers.pack.pack_zip."""
+
+    def setUp(self):
+        super().setUp()
+        self.zip_path = os.path.join(self.directory, 'archive.zip')
+
+    def test_pack(self):
+        # Members are stored uncompressed in import order.
+        count = pack.pack_zip(self.tree, self.zip_path,
+                              order=['pkg.large', 'pkg'])
+        self.assertEqual(count, len(self.files))
+        with zipfile.ZipFile(self.zip_path) as zip_:
+            infos = zip_.infolist()
+            self.assertEqual([info.filename for info in infos],
+                             ['pkg/large.py', 'pkg/__init__.py',
+                              'pkg/small.py'])
+            for info in infos:
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_graph(self):
+        # With the import graph stored, modules follow the modules importing
+        # them.
+        with open(os.path.join(self.tree, 'pkg', '__init__.py'), 'w') as file:
+            file.write('from . import small\n')
+        pack.pack_zip(self.tree, self.zip_path, with_graph=True)
+        with zipfile.ZipFile(self.zip_path) as zip_:
+            self.assertEqual(zip_.namelist(),
+                             ['pkg/__init__.py', 'pkg/small.py',
+                              'pkg/large.py', graph.GRAPH_NAME])
+            modules = json.loads(zip_.read(graph.GRAPH_NAME).decode())[
+                        'modules']
+        self.assertEqual(modules['pkg']['imports'], ['pkg.small'])
+
+    def test_import(self):
+        # The zip importer can load from the packed archive.
+        pack.pack_zip(self.tree, self.zip_path, with_manifest=True)
+        with zipfile.ZipFile(self.zip_path) as zip_:
+            self.assertIn(pack.MANIFEST_NAME, zip_.namelist())
+            importer = importers_zip.Importer(zip_, self.zip_path, 'pkg')
+            loader = importer.find_module('pkg.small')
+            self.assertIsNotNone(loader)
+            module = loader.load_module('pkg.small')
+            try:
+                self.assertEqual(module.x, 1)
+            finally:
+                del sys.modules['pkg.small']
+
+
+class ModuleNameTest(unittest.TestCase):
+
+    """Test importers.pack.module_name."""
+
+    def test_module_name(self):
+        self.assertEqual(pack.module_name('pkg/mod.py'), 'pkg.mod')
+        self.assertEqual(pack.module_name('pkg/__init__.py'), 'pkg')
+        self.assertEqual(pack.module_name('pkg/mod' + BC), 'pkg.mod')
+        self.assertEqual(pack.module_name('pkg/mod.opt-2' + BC), 'pkg.mod')
+        self.assertIsNone(pack.module_name('pkg/data.txt'))
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(PackSqlite3Test, PackZipTest, ModuleNameTest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+from .. import pack
+from .. import shared
+from .. import sqlite3 as importers_sqlite3
+from .. import zip as importers_zip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+class SharedIndexTest(unittest.TestCase):
+
+    """Test importers.shared.write_index and SharedIndex."""
+
+    key = (1, 2, 3, 4)
+    entries = [('b.py', 10, 0, 0, 0, 0, 0, 0),
+               ('a/__init__.py', 20, 1, 2, 3, 4, 5, 6),
+               ('a/c.py', 30, 0, 0, 0, 0, 0, 0)]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'archive.index')
+        self.assertEqual(shared.write_index(self.path, self.key,
+                                            self.entries), 3)
+        self.index = shared.SharedIndex(self.path, self.key)
+        self.addCleanup(self.index.close)
+
+    def test_find(self):
+        for entry in self.entries:
+            self.assertEqual(self.index.find(entry[0]), entry[1:])
+        for path in ('', 'a', 'a/', 'c.py', 'zz'):
+            self.assertIsNone(self.index.find(path))
+
+    def test_paths(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.paths(),
+                         ['a/__init__.py', 'a/c.py', 'b.py'])
+        self.assertEqual(self.index.paths('a/'), ['a/__init__.py', 'a/c.py'])
+        self.assertEqual(self.index.paths('c'), [])
+
+    def test_other_key(self):
+        # An index is only used for the archive it was written for.
+        with self.assertRaises(ValueError):
+            shared.SharedIndex(self.path, (1, 2, 3, 5))
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'not an index')
+        with self.assertRaises(ValueError):
+            shared.SharedIndex(self.path, self.key)
+
+
+class SharedIndexesTest(unittest.TestCase):
+
+    """Test importers.shared.SharedIndexes."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.indexes = shared.SharedIndexes(os.path.join(self.directory,
+                                                         'indexes'))
+
+    def test_get(self):
+        # The index is only built by the first caller.
+        calls = []
+        def entries():
+            calls.append(None)
+            return [('a.py', 1, 0, 0, 0, 0, 0, 0)]
+        self.assertIsNone(self.indexes.attach((1, 2, 3, 4)))
+        first = self.indexes.get((1, 2, 3, 4), entries)
+        second = self.indexes.get((1, 2, 3, 4), entries)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.paths(), ['a.py'])
+        first.close()
+        second.close()
+        self.assertEqual(os.listdir(self.indexes.directory), ['1-2-3-4.index'])
+
+    def test_superseded(self):
+        # Publishing an index removes those of the same file's earlier
+        # versions, and only those.
+        entries = [('a.py', 1, 0, 0, 0, 0, 0, 0)]
+        self.indexes.publish((1, 2, 3, 4), entries).close()
+        self.indexes.publish((1, 3, 3, 4), entries).close()
+        self.indexes.publish((1, 2, 5, 6), entries).close()
+        self.assertEqual(sorted(os.listdir(self.indexes.directory)),
+                         ['1-2-5-6.index', '1-3-3-4.index'])
+
+    def test_default_directory(self):
+        self.assertEqual(os.path.basename(shared.SharedIndexes().directory),
+                         'indexes')
+
+
+class SharedArchiveTest(unittest.TestCase):
+
+    """Test the hooks with shared indexes; every hook stands in for a
+    process."""
+
+    files = {'shared_pkg/__init__.py': b'',
+             'shared_pkg/module.py': b'value = 42',
+             'shared_pkg/data.txt': b'data' * 1000}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, 'shared_pkg'))
+        for relative, data in self.files.items():
+            with open(os.path.join(tree, *relative.split('/')), 'wb') as file:
+                file.write(data)
+        self.tree = tree
+        self.indexes = shared.SharedIndexes(os.path.join(self.directory,
+                                                         'indexes'))
+        self.addCleanup(sys.modules.pop, 'shared_pkg.module', None)
+
+    def check_importer(self, importer, archive_path):
+        path = os.path.join(archive_path, 'shared_pkg', 'data.txt')
+        self.assertTrue(importer.file_exists(path))
+        self.assertFalse(importer.file_exists(path + 'x'))
+        self.assertEqual(importer.get_data(path), self.files['shared_pkg/'
+                                                             'data.txt'])
+        with importer.open_data(path) as stream:
+            self.assertEqual(stream.read(4), b'data')
+        self.assertEqual(list(importer.iter_modules()),
+                         [('module', False)])
+        module = importer.find_module('shared_pkg.module').load_module(
+                    'shared_pkg.module')
+        self.assertEqual(module.value, 42)
+        del sys.modules['shared_pkg.module']
+
+    def test_zip(self):
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path)
+        with importers_zip.Hook(shared_index=self.indexes) as first:
+            archive = first.archive(zip_path)
+            self.assertIsInstance(archive, importers_zip.SharedIndexZipFile)
+            self.assertFalse(archive._indexed())
+            self.assertEqual(len(os.listdir(self.indexes.directory)), 1)
+            with importers_zip.Hook(shared_index=self.indexes) as second:
+                archive = second.archive(zip_path)
+                self.assertTrue(archive._indexed())
+                self.assertEqual(archive.namelist(), sorted(self.files))
+                self.check_importer(second(os.path.join(zip_path,
+                                                        'shared_pkg')),
+                                    zip_path)
+
+    def test_zip_replaced(self):
+        # A replaced zip file gets an index of its own.
+        zip_path = os.path.join(self.directory, 'archive.zip')
+        pack.pack_zip(self.tree, zip_path)
+        with importers_zip.Hook(shared_index=self.indexes) as hook:
+            hook.archive(zip_path)
+        os.unlink(zip_path)
+        os.remove(os.path.join(self.tree, 'shared_pkg', 'data.txt'))
+        pack.pack_zip(self.tree, zip_path)
+        with importers_zip.Hook(shared_index=self.indexes) as hook:
+            archive = hook.archive(zip_path)
+            self.assertFalse(archive._indexed())
+            self.assertNotIn('shared_pkg/data.txt', archive.namelist())
+        self.assertEqual(len(os.listdir(self.indexes.directory)), 2)
+
+    def test_sqlite3(self):
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path)
+        with importers_sqlite3.Hook(shared_index=self.indexes) as first:
+            first(db_path)
+            with importers_sqlite3.Hook(shared_index=self.indexes) as second:
+                importer = second(os.path.join(db_path, 'shared_pkg'))
+                queries = []
+                importer._state.archive.set_trace_callback(queries.append)
+                path = os.path.join(db_path, 'shared_pkg', 'module.py')
+                self.assertTrue(importer.file_exists(path))
+                self.assertEqual(importer.path_mtime(path),
+                                 importer._state.index.find(
+                                     'shared_pkg/module.py')[0])
+                self.assertEqual(queries, [])
+                importer._state.archive.set_trace_callback(None)
+                self.check_importer(importer, db_path)
+
+    def test_sqlite3_write(self):
+        # Writing to the database drops the index.
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path)
+        with importers_sqlite3.Hook(shared_index=self.indexes) as hook:
+            importer = hook(db_path)
+            path = os.path.join(db_path, 'new.py')
+            importer.write_data(path, b'')
+            self.assertIsNone(importer._state.index)
+            self.assertTrue(importer.file_exists(path))
+            # The index is not rebuilt for the written database.
+            importer = hook(os.path.join(db_path, 'shared_pkg'))
+            self.assertIsNone(importer._state.index)
+        self.assertEqual(len(os.listdir(self.indexes.directory)), 1)
+
+    def test_sqlite3_wal(self):
+        # Commits to the write-ahead log change the key of the database, and
+        # the index of the new version replaces the old one.
+        db_path = os.path.join(self.directory, 'archive.db')
+        pack.pack_sqlite3(self.tree, db_path)
+        with importers_sqlite3.Hook(shared_index=self.indexes,
+                                    wal=True) as hook:
+            hook(db_path)
+            key = importers_sqlite3._database_key(db_path)
+            with importers_sqlite3.Hook(shared_index=self.indexes,
+                                        wal=True) as writer:
+                importer = writer(db_path)
+                importer.write_data(os.path.join(db_path, 'new.py'), b'')
+                self.assertNotEqual(importers_sqlite3._database_key(db_path),
+                                    key)
+                with importers_sqlite3.Hook(shared_index=self.indexes,
+                                            wal=True) as reader:
+                    index = reader(db_path)._state.index
+                    self.assertIsNotNone(index.find('new.py'))
+        self.assertEqual(len(os.listdir(self.indexes.directory)), 1)
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(SharedIndexTest, SharedIndexesTest, SharedArchiveTest)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,22 @@
+from .. import neutral_path
+from .. import pack
 from .. import sqlite3 as importer
 from . import util
 import contextlib
+import gc
+import imp
+import importlib.abc
+import marshal
 import os
 import shutil
 import sqlite3
 import sys
 import tempfile
 import unittest
+from unittest import mock
+
+
+BC = next(x[0] for x in imp.get_suffixes() if x[2] == imp.PY_COMPILED)
 
 
 @contextlib.contextmanager
@@ -65,15 +75,130 @@ class Sqlite3HookTest(unittest.TestCase):
             finder = hook.finder(db, db_path, '')
             self.assertTrue(isinstance(finder, importer.Importer))
 
+    def test_shared_state(self):
+        # Importers for the same database share their state, keeping only
+        # their own settings.
+        hook = importer.Hook()
+        with TestDB() as db_path:
+            finder1 = hook(db_path)
+            finder2 = hook(os.path.join(db_path, 'pkg'))
+            self.assertIs(finder1._state, finder2._state)
+            self.assertEqual(set(vars(finder1)),
+                             {'location', '_state', '_codec', '_level',
+                              '_wal', '_resolved'})
+            hook.close()
+
+    def test_closed(self):
+        # Importers keep working after their hook closed the database or was
+        # dropped.
+        with TestDB() as db_path:
+            hook = importer.Hook()
+            finder = hook(db_path)
+            path = os.path.join(db_path, 'x.py')
+            hook.close()
+            self.assertFalse(finder.file_exists(path))
+            del hook
+            gc.collect()
+            self.assertTrue(finder.write_data(path, b''))
+            self.assertTrue(finder.file_exists(path))
+            finder._state.hook.close()
+
+    def test_check_own_writes(self):
+        # Data written through the hook's importers does not make the
+        # database look changed.
+        with TestDB() as db_path:
+            hook = importer.Hook(check_interval=0)
+            finder = hook(db_path)
+            self.assertTrue(finder.write_data(os.path.join(db_path, 'x.py'),
+                                              b''))
+            self.assertEqual(hook.check(), [])
+            hook.close()
+
+    def test_check_other_writes(self):
+        # Data written through another connection is detected.
+        with TestDB() as db_path:
+            hook = importer.Hook(check_interval=0)
+            hook(db_path)
+            cxn = sqlite3.connect(db_path)
+            with cxn:
+                cxn.execute("INSERT INTO FS VALUES ('x.py', 0, X'')")
+            cxn.close()
+            self.assertEqual(hook.check(), [db_path])
+            self.assertEqual(hook.check(), [])
+            hook.close()
 
-class Sqlite3ImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest):
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'requires fork')
+    def test_fork(self):
+        # A forked child uses connections of its own, for both the hook and
+        # existing importers.
+        hook = importer.Hook()
+        with TestDB() as db_path:
+            finder = hook(db_path)
+            parent_cxn = finder._state.archive
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    if (finder._state.archive is not parent_cxn and
+                            hook.archive(db_path) is finder._state.archive and
+                            not finder.file_exists(os.path.join(db_path,
+                                                                'x.py'))):
+                        status = 0
+                finally:
+                    os._exit(status)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            self.assertIs(finder._state.archive, parent_cxn)
+            hook.close()
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'requires fork')
+    def test_fork_missing(self):
+        # A database which was removed does not stop other databases from
+        # being reconnected to in a forked child.
+        hook = importer.Hook()
+        with TestDB() as db_path, TestDB() as missing_path:
+            finder = hook(db_path)
+            missing = hook(missing_path)
+            parent_cxn = finder._state.archive
+            shutil.rmtree(os.path.dirname(missing_path))
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    if (finder._state.archive is not parent_cxn and
+                            missing._state._archive is None):
+                        status = 0
+                finally:
+                    os._exit(status)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            os.mkdir(os.path.dirname(missing_path))
+            hook.close()
+
+
+# Probe bounds for importers going through the file-based search of the
+# ABCs: pkg/module/__init__ and pkg/module are probed for by suffix and
+# load_module() searches for the source and bytecode paths again, and for
+# the bytecode path once more to write bytecode. A warm load reads the
+# bytecode instead of writing it.
+FIND_BOUNDS = {'file_exists': 3}
+LOAD_BOUNDS = {'file_exists': 14, 'path_mtime': 1, 'get_data': 1,
+               'write_data': 1}
+WARM_LOAD_BOUNDS = {'file_exists': 8, 'path_mtime': 1, 'get_data': 1}
+MISSING_BOUNDS = {'file_exists': 4}
+
+
+class Sqlite3ImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest,
+                          util.ProbeBoundsTest):
 
     mutable = True
+    find_bounds = FIND_BOUNDS
+    load_bounds = LOAD_BOUNDS
+    warm_load_bounds = WARM_LOAD_BOUNDS
+    missing_bounds = MISSING_BOUNDS
 
     def setUp(self):
         self._directory = tempfile.mkdtemp()
         self.base_path = os.path.join(self._directory, 'importers_test.db')
-        relative_path = importer._neutralpath(self.relative_file_path)
+        relative_path = neutral_path(self.relative_file_path)
         self.mtime = 42
         self._cxn = sqlite3.connect(self.base_path)
         with self._cxn:
@@ -91,12 +216,686 @@ class Sqlite3ImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest):
         # Returns self.
         self.assertIs(self.importer, self.importer.loader())
 
+    def test_open_data_blob(self):
+        # Raw data is streamed through a blob handle.
+        if not hasattr(self._cxn, 'blobopen'):
+            self.skipTest("sqlite3 lacks incremental blob I/O")
+        path = os.path.join(self.base_path, self.relative_file_path)
+        with self.importer.open_data(path) as stream:
+            self.assertIsInstance(stream.raw, importer._BlobIO)
+            stream.seek(5)
+            self.assertEqual(stream.read(), self.data[5:])
+            stream.seek(0)
+            self.assertEqual(stream.readline(), self.data)
+
+    def test_iter_modules_range(self):
+        # Only paths below the location are listed, not those of siblings
+        # sharing its name as a prefix.
+        with self._cxn:
+            self._cxn.executemany('INSERT INTO FS VALUES (?, ?, ?)',
+                                  [(path, self.mtime, b'') for path in
+                                   ['pkg/sub/__init__.py', 'pkg/sub/a.py',
+                                    'pkg0.py', 'pkg2/other.py', 'pkg.py',
+                                    'top.py']])
+        self.assertEqual(list(self.importer.iter_modules()),
+                         [('module', False), ('sub', True)])
+        root = importer.Importer(self._cxn, self.base_path, '')
+        self.assertEqual(list(root.iter_modules()),
+                         [('pkg', False), ('pkg0', False), ('top', False)])
+
+
+class CompressedImporterTest(util.PyFileFinderTest,
+                             util.PyPycFileLoaderTest, util.ProbeBoundsTest):
+
+    """Test importers.sqlite3.Importer with an FS table with a codec
+    column."""
+
+    mutable = True
+    find_bounds = FIND_BOUNDS
+    load_bounds = LOAD_BOUNDS
+    warm_load_bounds = WARM_LOAD_BOUNDS
+    missing_bounds = MISSING_BOUNDS
+    codec = 'zlib'
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.base_path = os.path.join(self._directory, 'importers_test.db')
+        relative_path = neutral_path(self.relative_file_path)
+        self.mtime = 42
+        self._cxn = sqlite3.connect(self.base_path)
+        with self._cxn:
+            self._cxn.execute(importer.sql_creation)
+        importer.add_codec_column(self._cxn)
+        with self._cxn:
+            self._cxn.execute('INSERT INTO FS VALUES (?, ?, ?, ?)',
+                                [relative_path, self.mtime,
+                                 importer._compress(self.data, self.codec),
+                                 self.codec])
+        self.importer = importer.Importer(self._cxn, self.base_path,
+                                          self.location, codec=self.codec)
+
+    def tearDown(self):
+        self._cxn.close()
+        shutil.rmtree(self._directory)
+
+    def test_compressed_write(self):
+        # Written data should be stored compressed.
+        path = os.path.join(self.base_path, 'pkg', 'new.py')
+        data = b'x = 1\n' * 100
+        self.importer.write_data(path, data)
+        stored, codec = self._cxn.execute('SELECT data, codec FROM FS '
+                                          "WHERE path='pkg/new.py'").fetchone()
+        self.assertEqual(codec, self.codec)
+        self.assertLess(len(stored), len(data))
+        self.assertEqual(self.importer.get_data(path), data)
+
+    def test_raw_row(self):
+        # Rows with a NULL codec are returned as-is.
+        with self._cxn:
+            self._cxn.execute("INSERT INTO FS VALUES ('raw.py', 1, ?, NULL)",
+                                [b'raw'])
+        self.assertEqual(self.importer.get_data('raw.py'), b'raw')
+
+
+class IndexedImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest,
+                          util.ProbeBoundsTest):
+
+    """Test importers.sqlite3.Importer with an FS table migrated to have the
+    module columns."""
+
+    mutable = True
+    # A module is found with a single query and loaded from what it found.
+    find_bounds = {}
+    load_bounds = {'get_data': 1, 'write_data': 1}
+    warm_load_bounds = {'get_data': 1}
+    missing_bounds = {}
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.base_path = os.path.join(self._directory, 'importers_test.db')
+        relative_path = neutral_path(self.relative_file_path)
+        self.mtime = 42
+        self._cxn = sqlite3.connect(self.base_path)
+        with self._cxn:
+            self._cxn.execute(importer.sql_creation)
+            self._cxn.execute('INSERT INTO FS VALUES (?, ?, ?)',
+                                [relative_path, self.mtime, self.data])
+        self.assertEqual(importer.add_module_columns(self._cxn), 1)
+        self.importer = importer.Importer(self._cxn, self.base_path,
+                                          self.location)
+
+    def tearDown(self):
+        self._cxn.close()
+        shutil.rmtree(self._directory)
+
+    def selects(self, operation):
+        """Return the number of SELECT statements the operation runs."""
+        statements = []
+        self._cxn.set_trace_callback(statements.append)
+        try:
+            operation()
+        finally:
+            self._cxn.set_trace_callback(None)
+        return sum(1 for statement in statements
+                    if statement.lstrip().upper().startswith('SELECT'))
+
+    def test_migrated(self):
+        # Existing rows get the module columns and keep a rowid.
+        row = self._cxn.execute('SELECT module_dir, stem, kind, is_package, '
+                                'codec FROM FS').fetchone()
+        self.assertEqual(row, ('pkg', 'module', 'source', 0, None))
+        sql, = self._cxn.execute("SELECT sql FROM sqlite_master "
+                                 "WHERE name='FS'").fetchone()
+        self.assertNotIn('WITHOUT ROWID', sql)
+        self.assertEqual(importer.add_module_columns(self._cxn), 0)
+
+    def test_open_data_blob(self):
+        # Raw data is streamed through a blob handle.
+        if not hasattr(self._cxn, 'blobopen'):
+            self.skipTest("sqlite3 lacks incremental blob I/O")
+        path = os.path.join(self.base_path, self.relative_file_path)
+        with self.importer.open_data(path) as stream:
+            self.assertIsInstance(stream.raw, importer._BlobIO)
+            self.assertEqual(stream.read(), self.data)
+
+    def test_migration_failure(self):
+        # A migration failing partway leaves the table as it was.
+        cxn = sqlite3.connect(os.path.join(self._directory, 'other.db'))
+        self.addCleanup(cxn.close)
+        with cxn:
+            cxn.execute(importer.sql_creation)
+            cxn.execute("INSERT INTO FS VALUES ('mod.py', 0, X'')")
+        with mock.patch.object(importer, 'module_columns',
+                               side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                importer.add_module_columns(cxn)
+        self.assertEqual(cxn.execute("SELECT name FROM sqlite_master "
+                                     "WHERE type='table'").fetchall(),
+                         [('FS',)])
+        self.assertNotIn('module_dir', importer._columns(cxn))
+        self.assertEqual(cxn.execute('SELECT path FROM FS').fetchall(),
+                         [('mod.py',)])
+
+    def test_covering_index(self):
+        # Modules are found through FS_module alone.
+        statements = []
+        self._cxn.set_trace_callback(statements.append)
+        try:
+            self.importer.find_module('pkg.module')
+        finally:
+            self._cxn.set_trace_callback(None)
+        select, = [statement for statement in statements
+                    if statement.lstrip().upper().startswith('SELECT')]
+        plan = [row[3] for row in
+                    self._cxn.execute('EXPLAIN QUERY PLAN ' + select)
+                    if row[3].startswith('SEARCH')]
+        self.assertTrue(plan)
+        for detail in plan:
+            self.assertIn('COVERING INDEX FS_module', detail)
+
+    def test_index_rebuilt(self):
+        # A table with the module columns gets the covering index.
+        with self._cxn:
+            self._cxn.execute('DROP INDEX FS_module')
+            self._cxn.execute('CREATE INDEX FS_module ON FS '
+                              '(module_dir, stem, kind, is_package, mtime)')
+        self.assertEqual(importer.add_module_columns(self._cxn), 0)
+        self.assertEqual(importer._module_index_columns(self._cxn),
+                         ['module_dir', 'stem', 'kind', 'is_package',
+                          'mtime', 'path'])
+
+    def test_single_query(self):
+        # Finding a module is one query, as is finding nothing.
+        self.assertEqual(self.selects(
+                            lambda: self.importer.find_module('pkg.module')),
+                         1)
+        self.assertEqual(self.selects(
+                            lambda: self.importer.find_module('pkg.nothing')),
+                         1)
+
+    def test_find_without_load(self):
+        # What a find found is not used by a later load without a find (e.g.
+        # a reload) after the module changed.
+        source_path = os.path.join(self.base_path, self.relative_file_path)
+        code = compile(b'fake = "old"', source_path, 'exec')
+        data = (imp.get_magic() + self.mtime.to_bytes(4, 'little') +
+                marshal.dumps(code))
+        bytecode_path = os.path.splitext(source_path)[0] + BC
+        self.assertTrue(self.importer.write_data(bytecode_path, data))
+        loader = self.importer.find_module('pkg.module')
+        self.assertIsNot(loader, self.importer)
+        self.assertEqual(self.importer._resolved, {})
+        with self._cxn:
+            self._cxn.execute("UPDATE FS SET data=?, mtime=? WHERE path=?",
+                              [b'fake = "new"', self.mtime + 1,
+                               neutral_path(self.relative_file_path)])
+        try:
+            module = self.importer.load_module('pkg.module')
+            self.assertEqual(module.fake, 'new')
+        finally:
+            sys.modules.pop('pkg.module', None)
+
+    def test_package(self):
+        # Packages are found through their __init__ file.
+        path = os.path.join(self.base_path, 'pkg', 'sub', '__init__.py')
+        self.assertTrue(self.importer.write_data(path, b''))
+        loader = self.importer.find_module('pkg.sub')
+        self.assertIsNotNone(loader)
+        self.assertTrue(loader.is_package('pkg.sub'))
+        self.assertEqual(loader.source_path('pkg.sub'), path)
+
+    def test_load_with_bytecode(self):
+        # With bytecode stored, finding and loading the module takes two
+        # queries: one to find it and one to read the bytecode.
+        source_path = os.path.join(self.base_path, self.relative_file_path)
+        code = compile(self.data, source_path, 'exec')
+        data = (imp.get_magic() + self.mtime.to_bytes(4, 'little') +
+                marshal.dumps(code))
+        bytecode_path = os.path.splitext(source_path)[0] + BC
+        self.assertTrue(self.importer.write_data(bytecode_path, data))
+        self.importer._compressed()
+        def load():
+            loader = self.importer.find_module('pkg.module')
+            loader.load_module('pkg.module')
+        try:
+            self.assertEqual(self.selects(load), 2)
+        finally:
+            sys.modules.pop('pkg.module', None)
+        self.assertEqual(self.importer._resolved, {})
+
+    def test_other_optimization_level(self):
+        # Bytecode for another optimization level is never used; bytecode
+        # compiled on load is stored under the interpreter's tag.
+        other = 1 if sys.flags.optimize != 1 else 2
+        source_path = os.path.join(self.base_path, self.relative_file_path)
+        code = compile(b'fake = False', source_path, 'exec')
+        data = (imp.get_magic() + self.mtime.to_bytes(4, 'little') +
+                marshal.dumps(code))
+        base_path = os.path.splitext(source_path)[0]
+        other_path = base_path + importer.optimization_tag(other) + BC
+        self.assertTrue(self.importer.write_data(other_path, data))
+        row = self._cxn.execute('SELECT stem, kind FROM FS WHERE path=?',
+                                [neutral_path(os.path.relpath(
+                                    other_path, self.base_path))]).fetchone()
+        self.assertEqual(row, ('module', 'bytecode.opt-{}'.format(other)))
+        written = []
+        write_data = self.importer.write_data
+        def recording_write_data(path, data):
+            written.append(path)
+            return write_data(path, data)
+        self.importer.write_data = recording_write_data
+        sys.dont_write_bytecode, old = False, sys.dont_write_bytecode
+        self.addCleanup(setattr, sys, 'dont_write_bytecode', old)
+        try:
+            loader = self.importer.find_module('pkg.module')
+            self.assertIsNone(loader.bytecode_path('pkg.module'))
+            module = loader.load_module('pkg.module')
+            self.assertTrue(module.fake)
+        finally:
+            sys.modules.pop('pkg.module', None)
+        self.assertEqual(written,
+                         [base_path + importer.bytecode_suffixes()[0]])
+
+
+class HashedImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest,
+                         util.ProbeBoundsTest):
+
+    """Test importers.sqlite3.Importer validating bytecode by source hash."""
+
+    mutable = True
+    find_bounds = FIND_BOUNDS
+    load_bounds = LOAD_BOUNDS
+    warm_load_bounds = WARM_LOAD_BOUNDS
+    missing_bounds = MISSING_BOUNDS
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.base_path = os.path.join(self._directory, 'importers_test.db')
+        relative_path = neutral_path(self.relative_file_path)
+        self.mtime = 42
+        self._cxn = sqlite3.connect(self.base_path)
+        with self._cxn:
+            self._cxn.execute(importer.sql_creation)
+            self._cxn.execute('INSERT INTO FS VALUES (?, ?, ?)',
+                                [relative_path, self.mtime, self.data])
+        self.assertEqual(importer.add_hash_column(self._cxn), 1)
+        self.importer = importer.Importer(self._cxn, self.base_path,
+                                          self.location)
+        self.source_path = os.path.join(self.base_path,
+                                        self.relative_file_path)
+        dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        self.addCleanup(setattr, sys, 'dont_write_bytecode',
+                        dont_write_bytecode)
+
+    def tearDown(self):
+        self._cxn.close()
+        shutil.rmtree(self._directory)
+
+    def stored_hashes(self):
+        return dict(self._cxn.execute('SELECT path, source_hash FROM FS'))
+
+    def load(self):
+        try:
+            return self.importer.load_module('pkg.module')
+        finally:
+            sys.modules.pop('pkg.module', None)
+
+    def test_source_hash(self):
+        # Source is stored with the hash of its contents.
+        expected = importer.hash_source(self.data)
+        self.assertEqual(self.stored_hashes(),
+                         {'pkg/module.py': expected})
+        self.importer.write_data(self.source_path, b'fake = False')
+        self.assertEqual(self.stored_hashes(),
+                         {'pkg/module.py': importer.hash_source(
+                                                b'fake = False')})
+
+    def test_migration_failure(self):
+        # A migration failing partway leaves the table without the column.
+        cxn = sqlite3.connect(os.path.join(self._directory, 'other.db'))
+        self.addCleanup(cxn.close)
+        with cxn:
+            cxn.execute(importer.sql_creation)
+            cxn.execute("INSERT INTO FS VALUES ('mod.py', 0, X'')")
+        with mock.patch.object(importer, 'hash_source',
+                               side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                importer.add_hash_column(cxn)
+        self.assertNotIn('source_hash', importer._columns(cxn))
+
+    def test_bytecode_hash(self):
+        # Written bytecode carries the hash of the source it came from.
+        self.load()
+        self.assertEqual(self.stored_hashes(),
+                         {'pkg/module.py': importer.hash_source(self.data),
+                          'pkg/module' + BC: importer.hash_source(self.data)})
+
+    def test_compiled_as_source(self):
+        # Source is compiled as by source-only loaders, whether or not the
+        # table has the source_hash column.
+        code = compile('fake = "inherited"', self.source_path, 'exec')
+        with mock.patch.object(importlib.abc.PyLoader, 'get_code',
+                               return_value=code) as get_code:
+            module = self.load()
+        get_code.assert_called_once_with(self.importer, 'pkg.module')
+        self.assertEqual(module.fake, 'inherited')
+        self.assertEqual(self.stored_hashes()['pkg/module' + BC],
+                         importer.hash_source(self.data))
+
+    def test_mtime_ignored(self):
+        # Bytecode is used as long as the source hash matches, whatever the
+        # mtimes.
+        self.load()
+        with self._cxn:
+            self._cxn.execute("UPDATE FS SET mtime=mtime+1000 "
+                              "WHERE path='pkg/module.py'")
+        read = []
+        get_data = self.importer.get_data
+        def recording_get_data(path):
+            read.append(path)
+            return get_data(path)
+        self.importer.get_data = recording_get_data
+        self.assertEqual(self.load().fake, True)
+        self.assertEqual(read, [os.path.splitext(self.source_path)[0] + BC])
+
+    def test_changed_source(self):
+        # Bytecode for a different source is not used, even if newer.
+        self.load()
+        self.importer.write_data(self.source_path, b'fake = False')
+        with self._cxn:
+            self._cxn.execute("UPDATE FS SET mtime=0 "
+                              "WHERE path='pkg/module.py'")
+        self.assertEqual(self.load().fake, False)
+        self.assertEqual(len(set(self.stored_hashes().values())), 1)
+
+
+class DedupHookTest(unittest.TestCase):
+
+    """Test importers.sqlite3.DedupHook."""
+
+    def test_open_db(self):
+        # A DB with the content-addressed tables should be accepted while one
+        # with only the FS table should not.
+        hook = importer.DedupHook()
+        with TestDB() as db_path:
+            with self.assertRaises(ValueError):
+                hook.open(db_path)
+            cxn = sqlite3.connect(db_path)
+            cxn.executescript(importer.dedup_sql_creation)
+            cxn.close()
+            db = hook.open(db_path)
+            try:
+                finder = hook.finder(db, db_path, '')
+                self.assertTrue(isinstance(finder, importer.DedupImporter))
+            finally:
+                db.close()
+
+
+class DedupImporterTest(util.PyFileFinderTest, util.PyPycFileLoaderTest,
+                        util.ProbeBoundsTest):
+
+    """Test importers.sqlite3.DedupImporter."""
+
+    mutable = True
+    find_bounds = FIND_BOUNDS
+    load_bounds = LOAD_BOUNDS
+    warm_load_bounds = WARM_LOAD_BOUNDS
+    missing_bounds = MISSING_BOUNDS
+    codec = 'zlib'
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.base_path = os.path.join(self._directory, 'importers_test.db')
+        relative_path = neutral_path(self.relative_file_path)
+        self.mtime = 42
+        self._cxn = sqlite3.connect(self.base_path)
+        with self._cxn:
+            self._cxn.executescript(importer.dedup_sql_creation)
+            importer._store(self._cxn, relative_path, self.mtime, self.data,
+                            self.codec)
+        self.importer = importer.DedupImporter(self._cxn, self.base_path,
+                                                self.location,
+                                                codec=self.codec)
+
+    def tearDown(self):
+        self._cxn.close()
+        shutil.rmtree(self._directory)
+
+    def test_shared_blob(self):
+        # Identical contents are only stored once.
+        path = os.path.join(self.base_path, 'pkg', 'copy.py')
+        self.assertTrue(self.importer.write_data(path, self.data))
+        self.assertEqual(self.importer.get_data(path), self.data)
+        blobs = self._cxn.execute('SELECT count(*) FROM Blobs').fetchone()
+        self.assertEqual(blobs[0], 1)
+
+    def test_prune_blobs(self):
+        # Overwritten contents leave an orphaned blob behind to prune.
+        path = os.path.join(self.base_path, self.relative_file_path)
+        self.importer.write_data(path, b'fake = False')
+        self.assertEqual(importer.prune_blobs(self._cxn), 1)
+        self.assertEqual(self.importer.get_data(path), b'fake = False')
+
+
+class MigrateTest(unittest.TestCase):
+
+    """Test importers.sqlite3.migrate_to_dedup."""
+
+    def test_migrate(self):
+        # Rows with identical data should end up sharing a blob.
+        with TestDB() as db_path:
+            cxn = sqlite3.connect(db_path)
+            with cxn:
+                cxn.executemany('INSERT INTO FS VALUES (?, ?, ?)',
+                                [('a/mod.py', 1, b'x = 1'),
+                                 ('b/mod.py', 2, b'x = 1'),
+                                 ('b/other.py', 3, b'x = 2')])
+            cxn.close()
+            dest_path = os.path.join(os.path.dirname(db_path), 'dedup.db')
+            self.assertEqual(importer.migrate_to_dedup(db_path, dest_path,
+                                                       codec='zlib'),
+                             (3, 2))
+            dest = sqlite3.connect(dest_path)
+            try:
+                finder = importer.DedupImporter(dest, dest_path, 'b')
+                path = os.path.join(dest_path, 'b', 'mod.py')
+                self.assertEqual(finder.get_data(path), b'x = 1')
+                self.assertEqual(finder.path_mtime(path), 2)
+            finally:
+                dest.close()
+
+    def test_migrate_compressed(self):
+        # Compressed rows are stored by their uncompressed contents.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        tree = os.path.join(directory, 'tree')
+        os.makedirs(os.path.join(tree, 'a'))
+        os.makedirs(os.path.join(tree, 'b'))
+        for relative in ('a/mod.py', 'b/mod.py'):
+            with open(os.path.join(tree, relative), 'wb') as file:
+                file.write(b'x = 1\n' * 100)
+        source = os.path.join(directory, 'source.db')
+        dest_path = os.path.join(directory, 'dedup.db')
+        pack.pack_sqlite3(tree, source, codec='zlib', threshold=0)
+        self.assertEqual(importer.migrate_to_dedup(source, dest_path,
+                                                   codec='zlib'),
+                         (2, 1))
+        dest = sqlite3.connect(dest_path)
+        try:
+            finder = importer.DedupImporter(dest, dest_path, 'b')
+            self.assertEqual(finder.get_data(os.path.join(dest_path, 'b',
+                                                          'mod.py')),
+                             b'x = 1\n' * 100)
+            digest, = dest.execute('SELECT hash FROM Blobs').fetchone()
+            self.assertEqual(digest, importer.hash_source(b'x = 1\n' * 100))
+        finally:
+            dest.close()
+
+
+class WALTest(unittest.TestCase):
+
+    """Test hooks and importers in WAL mode; a second connection stands in
+    for another process."""
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self.db_path = os.path.join(self._directory, 'importers_test.db')
+        cxn = sqlite3.connect(self.db_path)
+        with cxn:
+            cxn.execute(importer.sql_creation)
+        cxn.close()
+        self.hook = importer.Hook(wal=True, busy_timeout=0)
+        self.addCleanup(self.hook.close)
+        self.importer = self.hook(self.db_path)
+        self.other = sqlite3.connect(self.db_path, timeout=0,
+                                     isolation_level=None)
+        self.addCleanup(self.other.close)
+        self.bytecode_path = os.path.join(self.db_path, 'mod' + BC)
+        self.bytecode = imp.get_magic() + b'\x01\x00\x00\x00' + b'code'
+
+    def lock(self):
+        """Hold the write lock from the other connection."""
+        self.other.execute('BEGIN IMMEDIATE')
+
+    def test_open(self):
+        cxn = self.importer._state.archive
+        self.assertEqual(cxn.execute('PRAGMA journal_mode').fetchone()[0],
+                         'wal')
+        self.assertEqual(cxn.execute('PRAGMA busy_timeout').fetchone()[0],
+                         0)
+        # The default timeout is short in WAL mode.
+        hook = importer.Hook(wal=True)
+        cxn = hook.open(self.db_path)
+        try:
+            self.assertEqual(cxn.execute('PRAGMA busy_timeout').fetchone()[0],
+                             importer.WAL_BUSY_TIMEOUT * 1000)
+        finally:
+            cxn.close()
+
+    def test_check(self):
+        # Commits by other processes are detected although the database file
+        # is not written to before a checkpoint, unlike the importer's own.
+        hook = importer.Hook(wal=True, check_interval=0)
+        self.addCleanup(hook.close)
+        finder = hook(self.db_path)
+        self.assertEqual(hook.check(), [])
+        self.assertTrue(finder.write_data(self.bytecode_path, self.bytecode))
+        self.assertEqual(hook.check(), [])
+        stat = os.stat(self.db_path)
+        self.other.execute("INSERT INTO FS VALUES ('x.py', 0, X'')")
+        self.assertEqual(os.stat(self.db_path).st_mtime, stat.st_mtime)
+        self.assertEqual(hook.check(), [self.db_path])
+
+    def test_read_while_locked(self):
+        self.assertTrue(self.importer.write_data(self.bytecode_path,
+                                                 self.bytecode))
+        self.lock()
+        self.other.execute("DELETE FROM FS")
+        self.assertEqual(self.importer.get_data(self.bytecode_path),
+                         self.bytecode)
+        self.other.execute('ROLLBACK')
+
+    def test_bytecode_stored(self):
+        # Bytecode already stored for the same source is not written again.
+        self.other.execute('INSERT INTO FS VALUES (?, 0, ?)',
+                           ['mod' + BC, self.bytecode + b'other'])
+        queries = []
+        self.importer._state.archive.set_trace_callback(queries.append)
+        self.assertFalse(self.importer.write_data(self.bytecode_path,
+                                                  self.bytecode))
+        self.importer._state.archive.set_trace_callback(None)
+        self.assertFalse(any('INSERT' in query for query in queries))
+        # Bytecode for another source mtime replaces it.
+        bytecode = imp.get_magic() + b'\x02\x00\x00\x00' + b'code'
+        self.assertTrue(self.importer.write_data(self.bytecode_path,
+                                                 bytecode))
+        self.assertEqual(self.importer.get_data(self.bytecode_path),
+                         bytecode)
+
+    def test_retry(self):
+        # A locked write is retried after backing off.
+        self.lock()
+        def sleep(seconds):
+            self.assertLessEqual(seconds, importer.WRITE_BACKOFF)
+            self.other.execute('COMMIT')
+        with mock.patch.object(importer.time, 'sleep', sleep):
+            self.assertTrue(self.importer.write_data(self.bytecode_path,
+                                                     self.bytecode))
+        self.assertEqual(self.importer.get_data(self.bytecode_path),
+                         self.bytecode)
+
+    def test_locked(self):
+        # Bytecode is given up on once the retries run out; other data is
+        # not.
+        self.lock()
+        delays = []
+        with mock.patch.object(importer.time, 'sleep', delays.append):
+            self.assertFalse(self.importer.write_data(self.bytecode_path,
+                                                      self.bytecode))
+            with self.assertRaises(sqlite3.OperationalError):
+                self.importer.write_data(os.path.join(self.db_path,
+                                                      'mod.py'), b'')
+        self.assertEqual(len(delays), 2 * importer.WRITE_RETRIES)
+        self.assertLess(delays[0], delays[importer.WRITE_RETRIES - 1])
+        self.other.execute('ROLLBACK')
+        self.assertFalse(self.importer.file_exists(self.bytecode_path))
+
+    def test_dedup(self):
+        dedup_path = os.path.join(self._directory, 'dedup.db')
+        self.assertEqual(importer.migrate_to_dedup(self.db_path, dedup_path),
+                         (0, 0))
+        with importer.DedupHook(wal=True) as hook:
+            finder = hook(dedup_path)
+            path = os.path.join(dedup_path, 'mod' + BC)
+            self.assertTrue(finder.write_data(path, self.bytecode))
+            self.assertFalse(finder.write_data(path, self.bytecode))
+
+
+class OptimizationTagTest(unittest.TestCase):
+
+    """Test the naming of bytecode for optimization levels."""
+
+    def test_tags(self):
+        self.assertEqual(importer.optimization_tag(0), '')
+        self.assertEqual(importer.optimization_tag(2), '.opt-2')
+        self.assertEqual(importer.optimization_tag(),
+                         importer.optimization_tag(sys.flags.optimize))
+        self.assertEqual(importer.bytecode_suffixes(1), ['.opt-1' + BC])
+
+    def test_split(self):
+        self.assertEqual(importer.split_optimization_tag('pkg/mod' + BC),
+                         ('pkg/mod', 0))
+        self.assertEqual(
+                importer.split_optimization_tag('pkg/mod.opt-2' + BC),
+                ('pkg/mod', 2))
+        self.assertEqual(
+                importer.split_optimization_tag('pkg/mod.opt-3' + BC),
+                ('pkg/mod.opt-3', 0))
+
+    def test_module_columns(self):
+        self.assertEqual(importer.module_columns('pkg/mod.opt-1' + BC),
+                         ('pkg', 'mod', 'bytecode.opt-1', 0))
+        self.assertEqual(importer.module_columns('pkg/__init__.opt-2' + BC),
+                         ('pkg', '__init__', 'bytecode.opt-2', 1))
+        self.assertEqual(importer.module_columns('pkg/mod' + BC),
+                         ('pkg', 'mod', 'bytecode', 0))
+
 
 def main():
     from test.support import run_unittest
     run_unittest(
             Sqlite3HookTest,
             Sqlite3ImporterTest,
+            CompressedImporterTest,
+            IndexedImporterTest,
+            HashedImporterTest,
+            DedupHookTest,
+            DedupImporterTest,
+            MigrateTest,
+            OptimizationTagTest,
+            WALTest,
             )
 
 
@@ -0,0 +1,148 @@
+from .. import pack
+from .. import sqlite3 as importers_sqlite3
+from .. import warm
+import imp
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+
+BC = next(x[0] for x in imp.get_suffixes() if x[2] == imp.PY_COMPILED)
+
+
+class WarmTest(unittest.TestCase):
+
+    """Test importers.warm.warm."""
+
+    files = {'warm_pkg/__init__.py': b'',
+             'warm_pkg/module.py': b'value = 42',
+             'warm_pkg/broken.py': b'def',
+             'warm_pkg/data.txt': b'not source'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, 'warm_pkg'))
+        for relative, data in self.files.items():
+            with open(os.path.join(tree, *relative.split('/')), 'wb') as file:
+                file.write(data)
+        self.tree = tree
+        self.db_path = os.path.join(self.directory, 'archive.db')
+
+    def paths(self, table='FS'):
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            return {row[0] for row in
+                        cxn.execute('SELECT path FROM {}'.format(table))}
+        finally:
+            cxn.close()
+
+    def test_warm(self):
+        # Bytecode is written for every source that compiles.
+        pack.pack_sqlite3(self.tree, self.db_path)
+        self.assertEqual(warm.warm(self.db_path, workers=2), 2)
+        expected = set(self.files) | {'warm_pkg/__init__' + BC,
+                                      'warm_pkg/module' + BC}
+        self.assertEqual(self.paths(), expected)
+
+    def test_bytecode_used(self):
+        # The written bytecode is used by the importer.
+        pack.pack_sqlite3(self.tree, self.db_path)
+        warm.warm(self.db_path, workers=1)
+        with importers_sqlite3.Hook() as hook:
+            importer = hook(os.path.join(self.db_path, 'warm_pkg'))
+            path = os.path.join(self.db_path, 'warm_pkg', 'module' + BC)
+            data = importer.get_data(path)
+            self.assertEqual(data[:4], imp.get_magic())
+            read = []
+            get_data = importer.get_data
+            def recording_get_data(path):
+                read.append(path)
+                return get_data(path)
+            importer.get_data = recording_get_data
+            try:
+                module = importer.load_module('warm_pkg.module')
+                self.assertEqual(module.value, 42)
+                self.assertEqual(read, [path])
+                self.assertEqual(module.__loader__.get_code(
+                                    'warm_pkg.module').co_filename,
+                                 importer.source_path('warm_pkg.module'))
+            finally:
+                sys.modules.pop('warm_pkg.module', None)
+
+    def test_up_to_date(self):
+        # Sources with up-to-date bytecode are not compiled again.
+        pack.pack_sqlite3(self.tree, self.db_path, bytecode=True, workers=1)
+        self.assertEqual(warm.warm(self.db_path, workers=1), 0)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            with cxn:
+                cxn.execute('UPDATE FS SET mtime=mtime+10 WHERE path=?',
+                            ['warm_pkg/module.py'])
+        finally:
+            cxn.close()
+        self.assertEqual(warm.warm(self.db_path, workers=1), 1)
+
+    def test_hashes(self):
+        # With source hashes, bytecode is validated by hash, not by mtime.
+        pack.pack_sqlite3(self.tree, self.db_path, hashes=True)
+        self.assertEqual(warm.warm(self.db_path, workers=1), 2)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            hashes = dict(cxn.execute('SELECT path, source_hash FROM FS'))
+            with cxn:
+                cxn.execute('UPDATE FS SET mtime=mtime+10 WHERE path=?',
+                            ['warm_pkg/module.py'])
+        finally:
+            cxn.close()
+        self.assertEqual(hashes['warm_pkg/module' + BC],
+                         hashes['warm_pkg/module.py'])
+        self.assertEqual(warm.warm(self.db_path, workers=1), 0)
+
+    def test_compressed(self):
+        # Bytecode is compressed with the codec.
+        pack.pack_sqlite3(self.tree, self.db_path, codec='zlib', threshold=0)
+        self.assertEqual(warm.warm(self.db_path, workers=1, codec='zlib'), 2)
+        cxn = sqlite3.connect(self.db_path)
+        try:
+            codec, = cxn.execute('SELECT codec FROM FS WHERE path=?',
+                                 ['warm_pkg/module' + BC]).fetchone()
+        finally:
+            cxn.close()
+        self.assertEqual(codec, 'zlib')
+
+    def test_dedup(self):
+        # The content-addressed layout is supported.
+        source = os.path.join(self.directory, 'source.db')
+        pack.pack_sqlite3(self.tree, source)
+        importers_sqlite3.migrate_to_dedup(source, self.db_path)
+        self.assertEqual(warm.warm(self.db_path, workers=1), 2)
+        self.assertIn('warm_pkg/module' + BC, self.paths('Paths'))
+
+    def test_optimize(self):
+        # Each optimization level gets bytecode of its own.
+        pack.pack_sqlite3(self.tree, self.db_path, bytecode=True, workers=1,
+                          optimize=[0])
+        self.assertEqual(warm.warm(self.db_path, workers=1, optimize=2), 2)
+        self.assertIn('warm_pkg/module.opt-2' + BC, self.paths())
+        self.assertEqual(warm.warm(self.db_path, workers=1, optimize=2), 0)
+        self.assertEqual(warm.warm(self.db_path, workers=1, optimize=0), 0)
+
+    def test_not_a_database(self):
+        with open(self.db_path, 'w') as file:
+            file.write('not a database')
+        with self.assertRaises(ValueError):
+            warm.warm(self.db_path)
+
+
+def main():
+    from test.support import run_unittest
+    run_unittest(WarmTest)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 from .. import zip as importer
 from . import util
 import os
+import pkgutil
 import shutil
+import sys
 import tempfile
 import unittest
 import zipfile
@@ -45,11 +47,50 @@ class ZipHookTest(unittest.TestCase):
         finder = self.hook.finder(zip_, self.path, '')
         self.assertTrue(isinstance(finder, importer.Importer))
 
+    def test_shared_state(self):
+        # Finders for the same zip file share their state, keeping only
+        # their location.
+        finder1 = self.hook(self.path)
+        finder2 = self.hook(os.path.join(self.path, 'pkg'))
+        self.assertIs(finder1._state, finder2._state)
+        self.assertEqual(set(vars(finder1)), {'location', '_state'})
+
+    def test_reopen(self):
+        # The zip file gets a new file handle but keeps its member index.
+        zip_ = self.hook.open(self.path)
+        old_fp = zip_.fp
+        self.assertIs(self.hook.reopen(self.path, zip_), zip_)
+        self.assertIsNot(zip_.fp, old_fp)
+        self.assertTrue(old_fp.closed)
+        self.assertEqual(zip_.read('module.py'), b'fake = True')
+        zip_.close()
+
+    def test_reopen_replaced(self):
+        # A replaced zip file is opened anew.
+        zip_ = self.hook.open(self.path)
+        os.unlink(self.path)
+        with zipfile.ZipFile(self.path, 'w') as new_zip:
+            new_zip.writestr('other.py', b'')
+        reopened = self.hook.reopen(self.path, zip_)
+        self.assertIsNot(reopened, zip_)
+        self.assertEqual(reopened.namelist(), ['other.py'])
+        zip_.close()
+        reopened.close()
 
-class ZipImporterTest(util.PyFileFinderTest, util.PyFileLoaderTest):
+
+class ZipImporterTest(util.PyFileFinderTest, util.PyFileLoaderTest,
+                      util.ProbeBoundsTest):
 
     """Test importers.zip.Importer."""
 
+    # Both pkg/module/__init__ and pkg/module are probed for by suffix; the
+    # source path is searched for again by load_module(). No bytecode is
+    # written, so loading again costs the same.
+    find_bounds = {'file_exists': 3}
+    load_bounds = {'file_exists': 6, 'get_data': 1}
+    warm_load_bounds = load_bounds
+    missing_bounds = {'file_exists': 4}
+
     def setUp(self):
         self.base_path = create_zip(self.relative_file_path, self.data)
         zip_ = zipfile.ZipFile(self.base_path)
@@ -62,6 +103,30 @@ class ZipImporterTest(util.PyFileFinderTest, util.PyFileLoaderTest):
         # Should return self.
         self.assertIs(self.importer, self.importer.loader())
 
+    def test_path_outside_archive(self):
+        # A path merely starting with the archive's name is not within it.
+        path = self.base_path + 'x' + os.sep + self.relative_file_path
+        self.assertFalse(self.importer.file_exists(path))
+        with self.assertRaises(IOError):
+            self.importer.get_data(path)
+
+    def test_open_data_stream(self):
+        # The member is streamed from the zip file.
+        path = os.path.join(self.base_path, self.relative_file_path)
+        with self.importer.open_data(path) as stream:
+            self.assertIsInstance(stream, zipfile.ZipExtFile)
+            stream.seek(5)
+            self.assertEqual(stream.read(), self.data[5:])
+
+    def test_pkgutil(self):
+        # pkgutil.iter_modules() enumerates through the importer.
+        sys.path_importer_cache[self.importer.location] = self.importer
+        self.addCleanup(sys.path_importer_cache.pop, self.importer.location)
+        self.assertEqual([(info[1], info[2]) for info in
+                              pkgutil.iter_modules([self.importer.location],
+                                                   'pkg.')],
+                         [('pkg.module', False)])
+
 
 def main():
     from test.support import run_unittest
@@ -1,8 +1,38 @@
+import collections
 import os
 import sys
 import unittest
 
 
+class ProbeCounter:
+
+    """Count the calls made to the storage methods of an importer.
+
+    The methods are replaced on the instance with wrappers incrementing
+    self.counts[method name] before calling the original.
+
+    """
+
+    methods = ('file_exists', 'get_data', 'path_mtime', 'write_data')
+
+    def __init__(self, importer):
+        self.counts = collections.Counter()
+        for name in self.methods:
+            method = getattr(importer, name, None)
+            if method is not None:
+                setattr(importer, name, self._counting(name, method))
+
+    def _counting(self, name, method):
+        def counting(*args, **kwargs):
+            self.counts[name] += 1
+            return method(*args, **kwargs)
+        return counting
+
+    def reset(self):
+        """Forget the calls counted so far."""
+        self.counts.clear()
+
+
 class PyFileFinderTest(unittest.TestCase):
 
     """Superclass for testing py file finders.
@@ -38,6 +68,13 @@ class PyFileFinderTest(unittest.TestCase):
         loader = self.importer.find_module('pkg.module')
         self.assertIsNotNone(loader)
 
+    def test_iter_modules(self):
+        # The module in the location is listed, with the prefix if given.
+        self.assertEqual(list(self.importer.iter_modules()),
+                         [('module', False)])
+        self.assertEqual(list(self.importer.iter_modules('pkg.')),
+                         [('pkg.module', False)])
+
 
 class PyFileLoaderTest(unittest.TestCase):
 
@@ -62,6 +99,15 @@ class PyFileLoaderTest(unittest.TestCase):
         with self.assertRaises(IOError):
             self.importer.get_data("I don't exist")
 
+    def test_open_data(self):
+        # Should return a stream over the data that is stored.
+        path = os.path.join(self.base_path, self.relative_file_path)
+        with self.importer.open_data(path) as stream:
+            self.assertEqual(stream.read(4), self.data[:4])
+            self.assertEqual(stream.read(), self.data[4:])
+        with self.assertRaises(IOError):
+            self.importer.open_data(os.path.join(self.base_path, 'nothing'))
+
     def test_load_module(self):
         # Integration test for load_module().
         module = self.importer.load_module('pkg.module')
@@ -93,7 +139,7 @@ class PyPycFileLoaderTest(PyFileLoaderTest):
     def test_write_data(self):
         # Should write the data to the DB.
         if not self.mutable:
-            self.skip("loader must support file mutation")
+            self.skipTest("loader must support file mutation")
         path = os.path.join(self.base_path, self.relative_file_path)
         new_data = b'fake = False'
         self.assertTrue(self.importer.write_data(path, new_data))
@@ -103,3 +149,93 @@ class PyPycFileLoaderTest(PyFileLoaderTest):
     def _test_load_module_w_bytecode(self):
         # XXX
         self.fail()
+
+
+class ProbeBoundsTest(unittest.TestCase):
+
+    """Superclass asserting upper bounds on the number of storage calls
+    (see ProbeCounter) importers make, so that extra probes in the
+    find/load flow fail deterministically.
+
+    Subclasses must provide the same attributes as PyFileFinderTest (the
+    importer acting as both finder and loader) and the bounds as dicts
+    mapping ProbeCounter.methods to the maximum number of calls (0 if
+    missing):
+
+        * find_bounds
+            For find_module() of the module.
+        * load_bounds
+            For load_module() of the module after find_module(), writing
+            bytecode if the importer can.
+        * warm_load_bounds
+            For load_module() of the module after find_module() once
+            load_module() wrote its bytecode.
+        * missing_bounds
+            For find_module() of a module that does not exist.
+
+    Loading writes bytecode (sys.dont_write_bytecode is false) whatever the
+    environment the tests run in.
+
+    """
+
+    find_bounds = {}
+    load_bounds = {}
+    warm_load_bounds = {}
+    missing_bounds = {}
+
+    def write_bytecode(self):
+        """Make loading write bytecode for the rest of the test."""
+        dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        self.addCleanup(setattr, sys, 'dont_write_bytecode',
+                        dont_write_bytecode)
+
+    def assertProbes(self, bounds, call, *args):
+        """Call call(*args) and check the calls it caused are within the
+        bounds, returning the result."""
+        counter = getattr(self, '_probe_counter', None)
+        if counter is None:
+            counter = self._probe_counter = ProbeCounter(self.importer)
+        counter.reset()
+        result = call(*args)
+        for name in ProbeCounter.methods:
+            self.assertLessEqual(counter.counts[name], bounds.get(name, 0),
+                                 "{} calls to {}".format(
+                                    counter.counts[name], name))
+        return result
+
+    def test_find_module_probes(self):
+        loader = self.assertProbes(self.find_bounds, self.importer.find_module,
+                                   'pkg.module')
+        self.assertIsNotNone(loader)
+
+    def test_warm_find_module_probes(self):
+        # Finding a module again costs no more than the first time.
+        self.importer.find_module('pkg.module')
+        self.assertProbes(self.find_bounds, self.importer.find_module,
+                          'pkg.module')
+
+    def test_load_module_probes(self):
+        self.write_bytecode()
+        loader = self.importer.find_module('pkg.module')
+        try:
+            self.assertProbes(self.load_bounds, loader.load_module,
+                              'pkg.module')
+        finally:
+            sys.modules.pop('pkg.module', None)
+
+    def test_warm_load_module_probes(self):
+        self.write_bytecode()
+        self.importer.find_module('pkg.module').load_module('pkg.module')
+        del sys.modules['pkg.module']
+        loader = self.importer.find_module('pkg.module')
+        try:
+            self.assertProbes(self.warm_load_bounds, loader.load_module,
+                              'pkg.module')
+        finally:
+            sys.modules.pop('pkg.module', None)
+
+    def test_missing_module_probes(self):
+        loader = self.assertProbes(self.missing_bounds,
+                                   self.importer.find_module, 'pkg.missing')
+        self.assertIsNone(loader)
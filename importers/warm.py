@@ -0,0 +1,149 @@
+"""Compile all source in a sqlite3 database ahead of time.
+
+An importer compiles a module the first time it is imported and writes the
+bytecode back to the database, so a freshly built database pays the cost of
+compiling every module on its first import. warm() instead compiles every
+source file lacking up-to-date bytecode across a pool of worker processes and
+writes all of the bytecode through the importer's write_data() in a single
+transaction. For databases with the source_hash column of importers.sqlite3,
+bytecode is validated and written with the hash of its source. Bytecode is
+compiled for one optimization level (that of the interpreter by default) and
+stored under its tag, so warm a database once per level processes use.
+
+From the command line::
+
+  python -m importers.warm DATABASE [--workers N] [--codec zlib] [--level N]
+                                    [--optimize N]
+
+Both the FS and the content-addressed layouts of importers.sqlite3 are
+supported.
+
+"""
+from . import pack
+from . import sqlite3 as importers_sqlite3
+import imp
+import os
+import sys
+
+
+def _hook(db_path, codec, level):
+    """Return a hook for the layout of the database and the importer for its
+    root."""
+    for hook_class in (importers_sqlite3.Hook, importers_sqlite3.DedupHook):
+        hook = hook_class(codec, level)
+        try:
+            hook.archive(db_path)
+        except ValueError:
+            hook.close()
+            continue
+        return hook, hook(db_path)
+    raise ValueError("{} is not a sqlite3 database importers can "
+                     "use".format(db_path))
+
+
+def _rows(importer):
+    """Yield (path, mtime, data, source hash) for every file in the
+    database."""
+    cxn = importer._state.archive
+    if isinstance(importer, importers_sqlite3.DedupImporter):
+        query = """SELECT path, mtime, codec, data, NULL FROM Paths
+                   JOIN Blobs USING (hash)"""
+    else:
+        query = 'SELECT path, mtime, {}, data, {} FROM FS'.format(
+                    'codec' if importer._compressed() else 'NULL',
+                    'source_hash' if importer._hashed() else 'NULL')
+    for path, mtime, codec, data, source_hash in cxn.execute(query):
+        yield (path, mtime, importers_sqlite3._decompress(codec, data),
+               source_hash)
+
+
+def _is_fresh(bytecode, mtime, source_hash):
+    """Return true if the (bytecode data, source hash) pair is usable for
+    source with the mtime and source hash.
+
+    Bytecode is validated by hash if the source has a stored hash, otherwise
+    by mtime.
+
+    """
+    data, bytecode_hash = bytecode
+    if data[:4] != imp.get_magic():
+        return False
+    if source_hash is not None:
+        return bytecode_hash == source_hash
+    return int.from_bytes(data[4:8], 'little') >= mtime
+
+
+def stale_sources(importer, optimize=None):
+    """Return (path, mtime, data) triples for the source files in the
+    importer's database without up-to-date bytecode for the optimization
+    level (sys.flags.optimize if None)."""
+    if optimize is None:
+        optimize = sys.flags.optimize
+    sources = []
+    bytecode = {}
+    hashes = {}
+    for path, mtime, data, source_hash in _rows(importer):
+        ext = os.path.splitext(path)[1]
+        if ext in pack._SOURCE_SUFFIXES:
+            sources.append((path, mtime, data))
+            hashes[path] = source_hash
+        elif ext == pack._BYTECODE_SUFFIX:
+            base, path_optimize = importers_sqlite3.split_optimization_tag(
+                                        path)
+            if path_optimize == optimize:
+                bytecode[base] = data, source_hash
+    return [(path, mtime, data) for path, mtime, data in sources
+                if not _is_fresh(bytecode.get(os.path.splitext(path)[0],
+                                              (b'', None)),
+                                 mtime, hashes[path])]
+
+
+def warm(db_path, workers=None, codec=None, level=None, optimize=None):
+    """Compile the source in the sqlite3 database which lacks up-to-date
+    bytecode for the optimization level 'optimize' (sys.flags.optimize if
+    None) using 'workers' processes, returning the number of bytecode files
+    written.
+
+    The bytecode is written in a single transaction, compressed with 'codec'
+    at 'level' if the database supports compression.
+
+    """
+    db_path = os.path.abspath(db_path)
+    hook, importer = _hook(db_path, codec, level)
+    with hook:
+        sources = stale_sources(importer, optimize)
+        hashes = {os.path.splitext(path)[0]:
+                        importers_sqlite3.hash_source(data)
+                    for path, _, data in sources}
+        bytecode = pack.compile_sources(sources, workers, optimize, db_path)
+        with importer.batch():
+            for relative, _, data in bytecode:
+                base = importers_sqlite3.split_optimization_tag(relative)[0]
+                importer.write_data(os.path.join(db_path, relative), data,
+                                    hashes[base])
+    return len(bytecode)
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m importers.warm',
+                description='Compile all source in a sqlite3 database.')
+    parser.add_argument('database', help='database to compile the source in')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes to compile with')
+    parser.add_argument('--codec', choices=['zlib', 'lzma'], default=None,
+                        help='compress bytecode with the codec')
+    parser.add_argument('--level', type=int, default=None,
+                        help='compression level/preset for the codec')
+    parser.add_argument('--optimize', type=int, choices=[0, 1, 2],
+                        default=None,
+                        help='optimization level to compile for (default: '
+                             'that of the interpreter)')
+    options = parser.parse_args(args)
+    count = warm(options.database, options.workers, options.codec,
+                 options.level, options.optimize)
+    print('{} files compiled in {}'.format(count, options.database))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,133 @@
-from . import remove_file
+from . import ArchivePrefix
 from . import abc as importers_abc
+from . import shared
+import collections.abc
+import contextlib
+import imp
+import json
 import os
+import struct
+import sys
+import threading
 import zipfile
+import zlib
+
+
+# The member holding the import graph written by importers.graph.
+GRAPH_NAME = '__imports__.json'
+
+GRAPH_VERSION = 1
+
+# Members this close together are read with a single read when prefetching.
+PREFETCH_GAP = 64 * 1024
+
+_SOURCE_SUFFIXES = [x[0] for x in imp.get_suffixes() if x[2] == imp.PY_SOURCE]
+
+# The file name and extra field lengths ending a local file header, and their
+# offset in it.
+_HEADER_LENGTHS = struct.Struct('<2H')
+_HEADER_LENGTHS_OFFSET = 26
+
+
+def _dos_stamp(date_time):
+    """Return the DOS date and time of the ZipInfo.date_time tuple as
+    (date << 16) | time."""
+    year, month, day, hour, minute, second = date_time
+    date = (year - 1980) << 9 | month << 5 | day
+    return date << 16 | hour << 11 | minute << 5 | second // 2
+
+
+def _index_entries(infos):
+    """Return the shared index entries for the ZipInfo objects."""
+    return [(info.filename, _dos_stamp(info.date_time), info.header_offset,
+             info.compress_size, info.file_size, info.CRC,
+             info.compress_type, info.flag_bits)
+            for info in infos]
+
+
+class _IndexedNames(collections.abc.Mapping):
+
+    """Stand-in for ZipFile.NameToInfo creating the ZipInfo objects of the
+    members looked up from a shared index."""
+
+    def __init__(self, index):
+        self._index = index
+        self._infos = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._infos[name]
+        except KeyError:
+            pass
+        entry = self._index.find(name)
+        if entry is None:
+            raise KeyError(name)
+        stamp, offset, compressed, size, crc, method, flags = entry
+        date, time = stamp >> 16, stamp & 0xFFFF
+        info = zipfile.ZipInfo(name, ((date >> 9) + 1980, (date >> 5) & 0xF,
+                                      date & 0x1F, time >> 11,
+                                      (time >> 5) & 0x3F, (time & 0x1F) * 2))
+        info.header_offset = offset
+        info.compress_size = compressed
+        info.file_size = size
+        info.CRC = crc
+        info.compress_type = method
+        info.flag_bits = flags
+        self._infos[name] = info
+        return info
+
+    def __iter__(self):
+        return iter(self._index.paths())
+
+    def __len__(self):
+        return len(self._index)
+
+
+class SharedIndexZipFile(zipfile.ZipFile):
+
+    """Read-only ZipFile taking its member table from a shared index.
+
+    The first process to open the zip file parses its central directory as
+    usual and publishes the index to 'indexes' (an
+    importers.shared.SharedIndexes); others map that index and only create
+    the ZipInfo objects of the members they look up.
+
+    """
+
+    def __init__(self, path, indexes):
+        self._indexes = indexes
+        self.index = None
+        super().__init__(path, 'r')
+
+    def _RealGetContents(self):
+        # Called by ZipFile.__init__() to read the central directory.
+        key = shared.file_key(os.fstat(self.fp.fileno()))
+        self.index = self._indexes.attach(key)
+        if self.index is not None:
+            self.NameToInfo = _IndexedNames(self.index)
+            return
+        super()._RealGetContents()
+        if all(info.filename == info.orig_filename for info in self.filelist):
+            self.index = self._indexes.publish(key,
+                                               _index_entries(self.filelist))
+
+    def _indexed(self):
+        return isinstance(self.NameToInfo, _IndexedNames)
+
+    def namelist(self):
+        if self._indexed():
+            return self.index.paths()
+        return super().namelist()
+
+    def infolist(self):
+        if self._indexed():
+            return [self.NameToInfo[name] for name in self.index.paths()]
+        return super().infolist()
+
+    def close(self):
+        super().close()
+        if self.index is not None:
+            self.index.close()
 
 class Hook(importers_abc.ArchiveHook):
 
@@ -11,29 +137,152 @@ class Hook(importers_abc.ArchiveHook):
         """Open the zip file."""
         if not zipfile.is_zipfile(path):
             raise ValueError("{} is not a zipfile", path)
+        if self.shared_index is not None:
+            return SharedIndexZipFile(path, self.shared_index)
         return zipfile.ZipFile(path, 'r')
 
     def finder(self, archive, archive_path, location):
-        return Importer(archive, archive_path, location)
+        return Importer(archive, archive_path, location,
+                        state=self.shared_state(archive, archive_path,
+                                                _ZipState))
+
+    def reopen(self, path, archive):
+        """Give the zip file a file handle of its own, keeping the already
+        parsed central directory.
+
+        A new zip file is opened if the file at the path is no longer the one
+        the zip file was read from.
+
+        """
+        if archive.fp is None:
+            return self.open(path)
+        fp = open(path, 'rb')
+        old_stat = os.fstat(archive.fp.fileno())
+        new_stat = os.fstat(fp.fileno())
+        if (old_stat.st_dev, old_stat.st_ino) != (new_stat.st_dev,
+                                                  new_stat.st_ino):
+            fp.close()
+            return self.open(path)
+        old_fp = archive.fp
+        archive.fp = fp
+        if hasattr(archive, '_lock'):
+            # The lock may have been held by another thread at fork time.
+            archive._lock = threading.RLock()
+        old_fp.close()
+        return archive
+
+    def paths(self, archive):
+        """Return the names of all members of the zip file."""
+        return archive.namelist()
+
+
+def read_graph(data):
+    """Return a dict mapping module names to (dependency name, path of its
+    files without suffix) pairs from the contents of a GRAPH_NAME member,
+    raising ValueError if it is not an import graph of GRAPH_VERSION."""
+    try:
+        graph = json.loads(data.decode('utf-8'))
+        if graph['version'] != GRAPH_VERSION:
+            raise ValueError("import graph version {} is not "
+                             "{}".format(graph['version'], GRAPH_VERSION))
+        modules = graph['modules']
+        return {name: [(dependency, modules[dependency]['path'])
+                       for dependency in module['imports']]
+                for name, module in modules.items()}
+    except (KeyError, TypeError, UnicodeDecodeError) as exc:
+        raise ValueError("not an import graph: {}".format(exc))
+
+
+def _read_members(archive, infos):
+    """Return a dict mapping member names to the data of the stored
+    (uncompressed, unencrypted) members among the ZipInfo objects, reading
+    members less than PREFETCH_GAP bytes apart with a single read.
+
+    Members which cannot be read this way are left out, to be read as
+    usual.
+
+    """
+    infos = sorted((info for info in infos
+                    if info.compress_type == zipfile.ZIP_STORED and
+                       not info.flag_bits & 0x1),
+                   key=lambda info: info.header_offset)
+    runs = []
+    for info in infos:
+        end = (info.header_offset + zipfile.sizeFileHeader +
+               len(info.filename.encode('utf-8')) + len(info.extra) +
+               info.compress_size)
+        if runs and info.header_offset - runs[-1][1] <= PREFETCH_GAP:
+            runs[-1][1] = max(runs[-1][1], end)
+            runs[-1][2].append(info)
+        else:
+            runs.append([info.header_offset, end, [info]])
+    lock = getattr(archive, '_lock', contextlib.nullcontext())
+    data = {}
+    for start, end, run in runs:
+        with lock:
+            if archive.fp is None:
+                break
+            archive.fp.seek(start)
+            span = archive.fp.read(end - start)
+        for info in run:
+            offset = info.header_offset - start
+            header = span[offset:offset + zipfile.sizeFileHeader]
+            if (len(header) != zipfile.sizeFileHeader or
+                    header[:4] != zipfile.stringFileHeader):
+                continue
+            name_length, extra_length = _HEADER_LENGTHS.unpack_from(
+                                            header, _HEADER_LENGTHS_OFFSET)
+            offset += zipfile.sizeFileHeader + name_length + extra_length
+            member = span[offset:offset + info.compress_size]
+            if (len(member) == info.compress_size and
+                    zlib.crc32(member) & 0xFFFFFFFF == info.CRC):
+                data[info.filename] = member
+    return data
+
+
+class _ZipState(importers_abc.ArchiveState):
+
+    """State shared by all importers for the same open zip file."""
+
+    __slots__ = ('prefix', 'graph', 'prefetched')
+
+    def __init__(self, archive, archive_path):
+        super().__init__(archive, archive_path)
+        self.prefix = ArchivePrefix(archive_path)
+        # The import graph as returned by read_graph() ({} if there is none);
+        # None until read.
+        self.graph = None
+        # Member name -> data read ahead by Importer._prefetch().
+        self.prefetched = {}
 
 
 class Importer(importers_abc.PyFileFinder, importers_abc.PyFileLoader):
 
-    """Importer for zipfiles."""
+    """Importer for zipfiles.
+
+    The zip file and its path are kept in a state object which the hook
+    shares between all importers for the same zip file ('state').
+
+    If the zip file has an import graph (see importers.graph), loading a
+    module first reads the source of the dependencies which are not imported
+    yet in as few reads as possible; get_data() returns that data once.
+
+    """
 
-    def __init__(self, archive, archive_path, location):
-        self._archive = archive
-        self._archive_path = archive_path
+    def __init__(self, archive, archive_path, location, state=None):
+        self._state = (state if state is not None
+                        else _ZipState(archive, archive_path))
         super().__init__(os.path.join(archive_path, location))
 
     def file_exists(self, path):
         """Check if the file exists in the zip file."""
+        state = self._state
         try:
-            path = remove_file(self._archive_path, path)
+            path = state.prefix.relative(path)
         except ValueError:
             return False
         try:
-            self._archive.getinfo(path)
+            state.archive.getinfo(path)
             return True
         except KeyError:
             return False
@@ -41,9 +290,77 @@ class Importer(importers_abc.PyFileFinder, importers_abc.PyFileLoader):
     def loader(self, *args, **kwargs):
         return self
 
+    def location_paths(self):
+        """Return the paths of the members below the location from the
+        already read central directory."""
+        state = self._state
+        try:
+            directory = state.prefix.relative(os.path.join(self.location, ''))
+        except ValueError:
+            return []
+        start = len(directory)
+        return [name[start:] for name in state.archive.namelist()
+                    if name.startswith(directory)]
+
+    def _graph(self):
+        """Return the (cached) import graph of the zip file."""
+        state = self._state
+        if state.graph is None:
+            try:
+                state.graph = read_graph(state.archive.read(GRAPH_NAME))
+            except (KeyError, ValueError):
+                state.graph = {}
+        return state.graph
+
+    def _prefetch(self, fullname):
+        """Read the source of the module's dependencies which are not
+        imported yet for get_data() to return, returning the member names
+        read."""
+        state = self._state
+        infos = []
+        for dependency, path in self._graph().get(fullname, ()):
+            if dependency in sys.modules:
+                continue
+            for suffix in _SOURCE_SUFFIXES:
+                if path + suffix in state.prefetched:
+                    continue
+                try:
+                    infos.append(state.archive.getinfo(path + suffix))
+                except KeyError:
+                    pass
+        if not infos:
+            return []
+        prefetched = _read_members(state.archive, infos)
+        state.prefetched.update(prefetched)
+        return list(prefetched)
+
+    def load_module(self, fullname):
+        """Load the module, prefetching its dependencies first; prefetched
+        data the module did not import is dropped once it is loaded."""
+        prefetched = self._prefetch(fullname)
+        try:
+            return super().load_module(fullname)
+        finally:
+            for name in prefetched:
+                self._state.prefetched.pop(name, None)
+
     def get_data(self, path):
+        state = self._state
         try:
-            path = remove_file(self._archive_path, path)
+            path = state.prefix.relative(path)
         except ValueError:
             raise IOError("{!r} does not exist".format(path))
-        return self._archive.read(path)
+        data = state.prefetched.pop(path, None)
+        if data is not None:
+            return data
+        return state.archive.read(path)
+
+    def open_data(self, path):
+        """Return a stream reading (and decompressing) the member at the path
+        as it is read."""
+        state = self._state
+        try:
+            member = state.prefix.relative(path)
+            return state.archive.open(member)
+        except (ValueError, KeyError):
+            raise IOError("{!r} does not exist".format(path))